@@ -0,0 +1 @@
+"""Benchmarks for the proxysub build pipeline (run with `python -m benchmarks.<name>`)."""
@@ -0,0 +1,26 @@
+"""Synthetic inputs shared by the benchmarks."""
+
+from __future__ import annotations
+
+from typing import Any
+
+_REGIONS = ("美国", "日本", "香港", "新加坡", "US", "JP", "HK", "Taiwan", "德国", "UK")
+
+
+def make_subs_doc(n_proxies: int, n_providers: int) -> dict[str, Any]:
+    """A subs document with `n_proxies` manual proxies (the first is `US-Home`) and `n_providers` providers."""
+    proxies = [{"name": "US-Home", "type": "http", "server": "203.0.113.10", "port": 3128}]
+    for i in range(1, n_proxies):
+        proxies.append(
+            {
+                "name": f"{_REGIONS[i % len(_REGIONS)]} 节点 {i:06d}",
+                "type": "ss",
+                "server": f"198.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+                "port": 8000 + i % 1000,
+                "cipher": "aes-128-gcm",
+                "password": f"secret-{i}",
+                "udp": True,
+            }
+        )
+    providers = {f"订阅{i}": f"https://example.com/sub{i}.yaml" for i in range(1, n_providers + 1)}
+    return {"proxies": proxies, "proxy-providers": providers}
@@ -0,0 +1,276 @@
+"""Per-stage timings and peak memory of the build pipeline on synthetic inputs.
+
+    uv run python -m benchmarks.pipeline --preset quick --output bench.json
+    uv run python -m benchmarks.pipeline --output new.json --baseline bench.json
+
+A case is `proxies:providers:groups:rules`; `--cases 1000:20:200:500,100000:500:5000:5000`
+overrides the preset. With `--baseline`, stages slower than the baseline by more
+than `--threshold` are listed and the exit status is 1.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+from benchmarks.inputs import make_subs_doc
+from proxysub import builder, yamlio
+from proxysub.subscriptions import parse_subs_config
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_TEMPLATE_PATH = REPO_ROOT / "templates" / "ryan.yaml"
+
+STAGES = ("load_subs", "parse_subs", "clone_template", "apply_subs", "profile_script", "dump", "splice")
+PRESETS = {
+    "quick": "1:1:10:10,100:5:50:100,1000:20:200:500",
+    "full": "1:1:10:10,100:5:50:100,1000:20:200:500,10000:100:1000:2000,100000:500:5000:5000",
+}
+
+
+@dataclass(frozen=True)
+class BenchCase:
+    proxies: int
+    providers: int
+    groups: int
+    rules: int
+
+    @property
+    def case_id(self) -> str:
+        return f"{self.proxies}:{self.providers}:{self.groups}:{self.rules}"
+
+    @classmethod
+    def parse(cls, spec: str) -> BenchCase:
+        parts = [int(v) for v in spec.split(":")]
+        if len(parts) != 4 or min(parts) < 1:
+            raise ValueError(f"invalid case {spec!r}, expected proxies:providers:groups:rules (all >= 1)")
+        return cls(*parts)
+
+
+def make_template(base: dict[str, Any], n_groups: int, n_rules: int) -> dict[str, Any]:
+    """Grow (or trim) the groups and rules of `base` to `n_groups` / `n_rules`.
+
+    Extra groups alternate between `select` groups with an explicit proxy list and
+    `url-test` groups pulling in every provider; extra rules mix RULE-SET rules
+    (each with its own rule-provider) with plain domain and IP rules.
+    """
+    template = yamlio.clone_yaml_tree(base)
+    groups = [g for g in template.get("proxy-groups") or [] if isinstance(g, dict)][:n_groups]
+    group_names = [g["name"] for g in groups if isinstance(g.get("name"), str)] or ["DIRECT"]
+    for i in range(len(groups), n_groups):
+        name = f"分组 {i:05d}"
+        if i % 2:
+            proxies = ["DIRECT", "REJECT", group_names[i % len(group_names)]]
+            groups.append({"name": name, "type": "select", "proxies": proxies})
+        else:
+            groups.append({"name": name, "type": "url-test", "include-all-proxies": True, "use": [], "interval": 300})
+    template["proxy-groups"] = groups
+
+    rules = [r for r in template.get("rules") or [] if isinstance(r, str) and not r.startswith("MATCH,")]
+    rules = rules[: max(n_rules - 1, 0)]
+    rule_providers = dict(template.get("rule-providers") or {})
+    targets = [g["name"] for g in groups]
+    for i in range(len(rules), n_rules - 1):
+        target = targets[i % len(targets)]
+        kind = i % 3
+        if kind == 0:
+            provider = f"set-{i:05d}"
+            rule_providers[provider] = {
+                "type": "http",
+                "format": "mrs",
+                "behavior": "domain",
+                "url": f"https://example.com/rules/{provider}.mrs",
+                "path": f"./ruleset/{provider}.mrs",
+                "interval": 86400,
+            }
+            rules.append(f"RULE-SET,{provider},{target}")
+        elif kind == 1:
+            rules.append(f"DOMAIN-SUFFIX,d{i}.example.com,{target}")
+        else:
+            rules.append(f"IP-CIDR,10.{i // 256 % 256}.{i % 256}.0/24,{target},no-resolve")
+    rules.append(f"MATCH,{targets[0]}")
+    template["rule-providers"] = rule_providers
+    template["rules"] = rules
+    return template
+
+
+class _ProfileTimer:
+    """Stands in for `builder.apply_profile_script` to time it inside `_apply_subs_config`."""
+
+    def __init__(self) -> None:
+        self.elapsed_s = 0.0
+        self._real = builder.apply_profile_script
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return self._real(*args, **kwargs)
+        finally:
+            self.elapsed_s += time.perf_counter() - started
+
+    def __enter__(self) -> _ProfileTimer:
+        builder.apply_profile_script = self
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        builder.apply_profile_script = self._real
+
+
+def _run_pipeline(
+    template_path: Path,
+    subs_text: str,
+    measure: Callable[[str, Callable[[], Any]], Any],
+) -> tuple[str, float]:
+    """Run every stage through `measure`; returns the output and the time spent in the profile script."""
+    template, version = builder._load_template_doc_with_version(template_path)
+    subs_doc = measure("load_subs", lambda: yamlio.load_yaml(subs_text))
+    subs_config = measure("parse_subs", lambda: parse_subs_config(subs_doc))
+    config = measure("clone_template", lambda: yamlio.clone_yaml_tree(template))
+    with _ProfileTimer() as profile:
+        measure("apply_subs", lambda: builder._apply_subs_config(config, subs_config))
+    measure("dump", lambda: yamlio.dump_yaml(config))
+    static_key = builder._static_key(template_path, version)
+    output = measure("splice", lambda: builder._dump_spliced(config, static_key=static_key))
+    return output, profile.elapsed_s
+
+
+def _timed_run(template_path: Path, subs_text: str) -> dict[str, float]:
+    timings: dict[str, float] = {}
+
+    def measure(stage: str, fn: Callable[[], Any]) -> Any:
+        started = time.perf_counter()
+        value = fn()
+        timings[stage] = time.perf_counter() - started
+        return value
+
+    _, profile_s = _run_pipeline(template_path, subs_text, measure)
+    # Report the profile script separately from the rest of `_apply_subs_config`.
+    timings["profile_script"] = profile_s
+    timings["apply_subs"] -= profile_s
+    return timings
+
+
+def _traced_run(template_path: Path, subs_text: str) -> dict[str, int]:
+    peaks: dict[str, int] = {}
+
+    def measure(stage: str, fn: Callable[[], Any]) -> Any:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        value = fn()
+        peaks[stage] = tracemalloc.get_traced_memory()[1] - base
+        return value
+
+    tracemalloc.start()
+    try:
+        _run_pipeline(template_path, subs_text, measure)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def run_case(case: BenchCase, *, base_template: dict[str, Any], work_dir: Path, repeat: int) -> dict[str, Any]:
+    template_path = work_dir / f"template-{case.groups}-{case.rules}.yaml"
+    yamlio.write_yaml_atomic(make_template(base_template, case.groups, case.rules), template_path)
+    subs_text = yamlio.dump_yaml(make_subs_doc(case.proxies, case.providers))
+    builder.clear_template_cache()
+
+    # Warm the template and splice caches so every stage is measured in steady state.
+    output, _ = _run_pipeline(template_path, subs_text, lambda _stage, fn: fn())
+
+    best: dict[str, float] = {}
+    for _ in range(repeat):
+        for stage, elapsed in _timed_run(template_path, subs_text).items():
+            best[stage] = min(best.get(stage, elapsed), elapsed)
+    peaks = _traced_run(template_path, subs_text)
+
+    # Allocations of the profile script are counted in `apply_subs`.
+    return {
+        "case": case.case_id,
+        "output_bytes": len(output.encode("utf-8")),
+        "stages": {stage: {"time_s": best[stage], "peak_bytes": peaks.get(stage)} for stage in STAGES},
+    }
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], *, threshold: float) -> list[str]:
+    """Return one line per stage that is more than `threshold` slower than in `baseline`."""
+    base_cases = {case["case"]: case for case in baseline.get("cases", [])}
+    regressions: list[str] = []
+    print(f"\n{'case':<28}{'stage':<16}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for case in results["cases"]:
+        base_case = base_cases.get(case["case"])
+        if base_case is None:
+            continue
+        for stage, current in case["stages"].items():
+            base_stage = base_case["stages"].get(stage)
+            if not base_stage or not base_stage["time_s"]:
+                continue
+            ratio = current["time_s"] / base_stage["time_s"]
+            line = (
+                f"{case['case']:<28}{stage:<16}{base_stage['time_s'] * 1000:>10.2f}ms"
+                f"{current['time_s'] * 1000:>10.2f}ms{ratio:>7.2f}x"
+            )
+            print(line)
+            if ratio > 1 + threshold:
+                regressions.append(line)
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--template", type=Path, default=DEFAULT_TEMPLATE_PATH, help="base template to scale")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    parser.add_argument("--cases", help="comma-separated proxies:providers:groups:rules, overrides --preset")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case (best is kept)")
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    parser.add_argument("--baseline", type=Path, help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown vs baseline (0.10 = 10%%)")
+    parser.add_argument("--work-dir", type=Path, help="keep generated templates here (default: a temporary directory)")
+    args = parser.parse_args(argv)
+
+    cases = [BenchCase.parse(spec) for spec in (args.cases or PRESETS[args.preset]).split(",") if spec.strip()]
+    base_template = yamlio.load_yaml_file(args.template)
+
+    results: dict[str, Any] = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "yaml_backend": yamlio.get_yaml_backend(),
+            "repeat": args.repeat,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "cases": [],
+    }
+    print(f"{'case':<28}" + "".join(f"{stage:>16}" for stage in STAGES) + f"{'peak':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = args.work_dir or Path(tmp)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        for case in cases:
+            result = run_case(case, base_template=base_template, work_dir=work_dir, repeat=args.repeat)
+            results["cases"].append(result)
+            stages = result["stages"]
+            peak = max(stage["peak_bytes"] or 0 for stage in stages.values())
+            cells = "".join(f"{stages[stage]['time_s'] * 1000:>14.2f}ms" for stage in STAGES)
+            print(f"{case.case_id:<28}{cells}{peak / 1024 / 1024:>10.1f}MB")
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text(encoding="utf-8")), threshold=args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) regressed by more than {args.threshold:.0%}:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,156 @@
+"""Cold-start cost of the web app: `import main`, startup (lifespan) and the first requests.
+
+    uv run python -m benchmarks.startup --repeat 5 --output startup.json
+
+Every run is a fresh interpreter. Each `PROXYSUB_STARTUP` mode is measured with
+and without a precomputed artifacts file (`python main.py --precompute`); requests
+are sent to the ASGI app directly, without a server or HTTP client.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+MODES = ("normal", "lazy", "warm")
+METRICS = ("import_s", "startup_s", "first_index_s", "first_upload_s")
+_BOUNDARY = "proxysub-bench"
+_SUBS = b"""proxies:
+  - {name: US-Home, type: ss, server: 192.0.2.1, port: 8388, cipher: aes-128-gcm, password: bench}
+  - {name: JP-1, type: ss, server: 192.0.2.2, port: 8388, cipher: aes-128-gcm, password: bench}
+"""
+
+
+async def _request(app: Any, method: str, path: str, *, body: bytes = b"", content_type: str | None = None) -> int:
+    headers = [(b"host", b"bench")]
+    if content_type is not None:
+        headers += [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())]
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": headers,
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    pending = [{"type": "http.request", "body": body, "more_body": False}]
+    status = 0
+
+    async def receive() -> dict[str, Any]:
+        return pending.pop() if pending else {"type": "http.disconnect"}
+
+    async def send(message: dict[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def _child_requests(app: Any, timings: dict[str, float]) -> None:
+    upload = (
+        f"--{_BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"subs.yaml\"\r\n"
+        "Content-Type: application/x-yaml\r\n\r\n"
+    ).encode() + _SUBS + f"\r\n--{_BOUNDARY}--\r\n".encode()
+
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        timings["startup_s"] = time.perf_counter() - started
+        for metric, args, kwargs in (
+            ("first_index_s", ("GET", "/"), {}),
+            ("first_upload_s", ("POST", "/upload"), {"body": upload, "content_type": f"multipart/form-data; boundary={_BOUNDARY}"}),
+        ):
+            started = time.perf_counter()
+            status = await _request(app, *args, **kwargs)
+            timings[metric] = time.perf_counter() - started
+            if status != 200:
+                raise RuntimeError(f"{args[0]} {args[1]} returned {status}")
+
+
+def _child() -> None:
+    sys.path.insert(0, str(REPO_ROOT))
+    started = time.perf_counter()
+    import main
+
+    timings = {"import_s": time.perf_counter() - started}
+    asyncio.run(_child_requests(main.app, timings))
+    print(json.dumps(timings))
+
+
+def _run_once(mode: str, precomputed: Path) -> dict[str, float]:
+    env = {
+        **os.environ,
+        "PROXYSUB_STARTUP": mode,
+        "PROXYSUB_PRECOMPUTED": str(precomputed),
+        "PROXYSUB_DOWNLOAD_STORE": "memory",
+    }
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child"],
+        cwd=REPO_ROOT,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="fresh processes per scenario (median is kept)")
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        _child()
+        return 0
+
+    results: dict[str, Any] = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "scenarios": [],
+    }
+    print(f"{'scenario':<24}" + "".join(f"{metric:>16}" for metric in METRICS) + f"{'total':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        precomputed = Path(tmp) / "precomputed.json"
+        subprocess.run(
+            [sys.executable, "main.py", "--precompute", str(precomputed)], cwd=REPO_ROOT, check=True
+        )
+        missing = Path(tmp) / "missing.json"
+        for mode in MODES:
+            for label, path in (("", missing), ("+precomputed", precomputed)):
+                runs = [_run_once(mode, path) for _ in range(args.repeat)]
+                medians = {metric: statistics.median(run[metric] for run in runs) for metric in METRICS}
+                results["scenarios"].append({"scenario": mode + label, **medians})
+                cells = "".join(f"{medians[metric] * 1000:>14.1f}ms" for metric in METRICS)
+                print(f"{mode + label:<24}{cells}{sum(medians.values()) * 1000:>10.1f}ms")
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,98 @@
+"""Compare the pure-Python and libyaml YAML loaders (output always uses the Python emitter).
+
+    uv run python -m benchmarks.yaml_backends --repeat 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+from benchmarks.inputs import make_subs_doc
+from proxysub import yamlio
+from proxysub.builder import _apply_subs_config
+from proxysub.subscriptions import parse_subs_config
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_TEMPLATE_PATH = REPO_ROOT / "templates" / "ryan.yaml"
+
+
+def _scale_template(template_text: str, factor: int) -> str:
+    if factor <= 1:
+        return template_text
+    doc = yamlio.load_yaml(template_text)
+    providers = doc.get("rule-providers") or {}
+    rules = doc.get("rules") or []
+    scaled_providers: dict[str, Any] = {}
+    scaled_rules: list[Any] = []
+    for copy_idx in range(factor):
+        for name, provider in providers.items():
+            scaled_providers[f"{name}-{copy_idx}" if copy_idx else name] = provider
+        scaled_rules.extend(
+            rule.replace("RULE-SET,", f"RULE-SET,x{copy_idx}-") if copy_idx else rule for rule in rules[:-1]
+        )
+    scaled_rules.extend(rules[-1:])
+    doc["rule-providers"] = scaled_providers
+    doc["rules"] = scaled_rules
+    with yamlio.use_yaml_backend("python"):
+        return yamlio.dump_yaml(doc)
+
+
+def _best_of(repeat: int, fn: Callable[[], Any]) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--template", type=Path, default=DEFAULT_TEMPLATE_PATH)
+    parser.add_argument("--template-scales", default="1,4,16")
+    parser.add_argument("--subs-sizes", default="10,1000,10000")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    backends = ["python"] + (["libyaml"] if yamlio.HAS_LIBYAML else [])
+    if not yamlio.HAS_LIBYAML:
+        print("libyaml not available; only the python backend is measured")
+
+    base_text = args.template.read_text(encoding="utf-8")
+    print(f"{'case':<28}{'stage':<8}" + "".join(f"{name:>12}" for name in backends) + f"{'speedup':>10}")
+    for scale in [int(v) for v in args.template_scales.split(",") if v.strip()]:
+        template_text = _scale_template(base_text, scale)
+        for n_proxies in [int(v) for v in args.subs_sizes.split(",") if v.strip()]:
+            subs_text = _scale_subs_text(n_proxies)
+            timings: dict[str, dict[str, float]] = {}
+            outputs: dict[str, str] = {}
+            for backend in backends:
+                with yamlio.use_yaml_backend(backend):
+                    load_s = _best_of(
+                        args.repeat, lambda: (yamlio.load_yaml(template_text), yamlio.load_yaml(subs_text))
+                    )
+                    config = yamlio.load_yaml(template_text)
+                    _apply_subs_config(config, parse_subs_config(yamlio.load_yaml(subs_text)))
+                    outputs[backend] = yamlio.dump_yaml(config)
+                timings[backend] = {"load": load_s}
+
+            if len(set(outputs.values())) != 1:
+                raise SystemExit(f"backends disagree on output for template x{scale}, {n_proxies} proxies")
+            case = f"template x{scale}, {n_proxies} proxies"
+            for stage in ("load",):
+                cells = "".join(f"{timings[name][stage] * 1000:>10.1f}ms" for name in backends)
+                speedup = timings[backends[0]][stage] / timings[backends[-1]][stage]
+                print(f"{case:<28}{stage:<8}{cells}{speedup:>9.1f}x")
+    return 0
+
+
+def _scale_subs_text(n_proxies: int) -> str:
+    with yamlio.use_yaml_backend("python"):
+        return yamlio.dump_yaml(make_subs_doc(n_proxies, 5))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
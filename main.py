@@ -1,72 +1,135 @@
 from __future__ import annotations
 
+import asyncio
+import contextlib
+import functools
+import hashlib
 import html
+import json
 import os
-import secrets
-import string
-import time
-from dataclasses import dataclass
+from contextlib import asynccontextmanager
 from pathlib import Path
-
-import markdown as markdown_lib
-import yaml
-from fastapi import BackgroundTasks, FastAPI, File, HTTPException, Request, UploadFile
-from fastapi.responses import FileResponse, HTMLResponse
-
-from proxysub.builder import build_and_write_yaml_from_doc
+from typing import Any, AsyncIterator, Callable
+
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response
+
+from proxysub.compression import enabled_encodings, negotiate_encoding
+from proxysub.downloads import DownloadStoreFull, create_download_store_from_env, run_reaper
+from proxysub.env import env_choice
+from proxysub.httpcache import CachedAsset, KeyedAssetCache, etag_matches, file_version, make_asset
+from proxysub.ingest import UploadInvalid, UploadLimits, UploadTooLarge, read_multipart_file
+from proxysub.metrics import CONTENT_TYPE, METRICS_ENABLED, REGISTRY, REQUEST_ERRORS, REQUESTS, timed_stage
+from proxysub.pool import BuildPool, BuildPoolBusy, render_batch_encoded, render_batch_zip, render_upload_encoded
+from proxysub.profiling import PROFILE_HEADER, ProfileSettings, list_profiles, new_run_id, profile_file, run_profiled
+from proxysub.yamlio import write_bytes_atomic
 
 APP_ROOT = Path(__file__).resolve().parent
 DEFAULT_TEMPLATE_PATH = APP_ROOT / "templates" / "ryan.yaml"
 DEFAULT_TEMP_DIR = APP_ROOT / "temp"
 DEFAULT_DOCS_MD_PATH = APP_ROOT / "docs" / "index.md"
-_OUTPUT_TOKEN_ALPHABET = string.ascii_letters + string.digits
+DEFAULT_PRECOMPUTED_PATH = APP_ROOT / "temp" / "precomputed.json"
+PRECOMPUTED_ENV = "PROXYSUB_PRECOMPUTED"
+STARTUP_ENV = "PROXYSUB_STARTUP"
+# normal: start the build pool at startup; lazy: on the first build; warm: also do the first request's work up front.
+STARTUP_MODES = ("normal", "lazy", "warm")
 _ONE_TIME_DOWNLOAD_TTL_S = 180
 TEMPLATE_SOURCE_URL = "https://linux.do/t/topic/1282245"
 PROJECT_GITHUB_URL = "https://github.com/ticoAg/proxysub"
 
-app = FastAPI(title="proxysub", version="0.1.0")
+_STARTUP_MODE = env_choice(STARTUP_ENV, "normal", STARTUP_MODES)
+_UPLOAD_LIMITS = UploadLimits.from_env()
+enabled_encodings()  # fail fast on a bad PROXYSUB_COMPRESSION instead of on the first build
+_BUILD_POOL = BuildPool.from_env(template_path=DEFAULT_TEMPLATE_PATH)
+_DOWNLOAD_STORE = create_download_store_from_env(ttl_s=_ONE_TIME_DOWNLOAD_TTL_S, temp_dir=DEFAULT_TEMP_DIR)
+_PROFILE_SETTINGS = ProfileSettings.from_env(default_dir=DEFAULT_TEMP_DIR / "profiles")
+
+
+@asynccontextmanager
+async def _lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    if _STARTUP_MODE == "warm":
+        await _BUILD_POOL.warm()
+        await run_in_threadpool(_warm_assets)
+    elif _STARTUP_MODE == "normal":
+        _BUILD_POOL.start()
+    reaper = asyncio.create_task(run_reaper(_DOWNLOAD_STORE))
+    try:
+        yield
+    finally:
+        reaper.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await reaper
+        _BUILD_POOL.shutdown()
 
 
-def _generate_short_token(length: int = 8) -> str:
-    if length <= 0:
-        raise ValueError("length must be > 0")
-    return "".join(secrets.choice(_OUTPUT_TOKEN_ALPHABET) for _ in range(length))
+app = FastAPI(title="proxysub", version="0.1.0", lifespan=_lifespan)
 
 
-@dataclass(frozen=True)
-class _OneTimeDownload:
-    path: Path
-    created_at: float
+def _temp_dir_bytes() -> int:
+    total = 0
+    try:
+        with os.scandir(DEFAULT_TEMP_DIR) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+    except OSError:
+        return 0
+    return total
 
 
-_ONE_TIME_DOWNLOADS: dict[str, _OneTimeDownload] = {}
+REGISTRY.gauge(
+    "proxysub_download_tokens_outstanding",
+    "One-time download tokens not yet taken or expired.",
+    lambda: _DOWNLOAD_STORE.stats().outstanding,
+)
+REGISTRY.gauge(
+    "proxysub_download_outstanding_bytes",
+    "Bytes held by outstanding one-time downloads.",
+    lambda: _DOWNLOAD_STORE.stats().outstanding_bytes,
+)
+REGISTRY.gauge("proxysub_temp_dir_bytes", "Bytes of files directly under temp/.", _temp_dir_bytes)
+REGISTRY.gauge("proxysub_builds_in_flight", "Builds queued or running in the build pool.", lambda: _BUILD_POOL.in_flight)
 
 
-def _cleanup_one_time_downloads(*, now: float | None = None) -> None:
-    if now is None:
-        now = time.time()
+def _count_requests(endpoint: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Count calls to a route handler, and the ones that fail by HTTP status."""
 
-    stale_tokens = [
-        token for token, item in _ONE_TIME_DOWNLOADS.items() if now - item.created_at > _ONE_TIME_DOWNLOAD_TTL_S
-    ]
-    for token in stale_tokens:
-        item = _ONE_TIME_DOWNLOADS.pop(token, None)
-        if item is None:
-            continue
-        item.path.unlink(missing_ok=True)
+    def _status(exc: Exception) -> str:
+        return str(exc.status_code) if isinstance(exc, HTTPException) else "500"
 
+    def decorate(handler: Callable[..., Any]) -> Callable[..., Any]:
+        if not METRICS_ENABLED:
+            return handler
 
-def _reserve_one_time_download(*, temp_dir: Path, suffix: str = ".yaml") -> tuple[str, Path]:
-    _cleanup_one_time_downloads()
-    for _ in range(24):
-        token = _generate_short_token(10)
-        if token in _ONE_TIME_DOWNLOADS:
-            continue
-        path = temp_dir / f"{token}{suffix}"
-        if path.exists():
-            continue
-        return token, path
-    raise RuntimeError("failed to reserve one-time download slot")
+        if asyncio.iscoroutinefunction(handler):
+
+            @functools.wraps(handler)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                REQUESTS.inc(endpoint)
+                try:
+                    return await handler(*args, **kwargs)
+                except Exception as exc:
+                    REQUEST_ERRORS.inc(endpoint, _status(exc))
+                    raise
+
+            return async_wrapper
+
+        @functools.wraps(handler)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            REQUESTS.inc(endpoint)
+            try:
+                return handler(*args, **kwargs)
+            except Exception as exc:
+                REQUEST_ERRORS.inc(endpoint, _status(exc))
+                raise
+
+        return wrapper
+
+    return decorate
 
 
 def _html_page(*, body: str, title: str = "proxysub") -> str:
@@ -98,6 +161,9 @@ def _html_page(*, body: str, title: str = "proxysub") -> str:
 
 
 def _render_markdown(md_text: str) -> str:
+    # Imported here: only needed when the docs page is built and no precomputed copy matches.
+    import markdown as markdown_lib
+
     return markdown_lib.markdown(md_text, extensions=["fenced_code", "tables"], output_format="html5")
 
 
@@ -128,7 +194,40 @@ def _read_git_head_sha() -> str | None:
     return head or None
 
 
+@functools.lru_cache(maxsize=1)
+def _load_precomputed() -> dict[str, Any]:
+    """Artifacts written by `python main.py --precompute`, or {} when there are none."""
+    raw_path = os.getenv(PRECOMPUTED_ENV, "").strip()
+    path = Path(raw_path) if raw_path else DEFAULT_PRECOMPUTED_PATH
+    try:
+        data = json.loads(path.read_bytes())
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _docs_html(md_text: str) -> str:
+    precomputed = _load_precomputed()
+    docs_html = precomputed.get("docs_html")
+    if isinstance(docs_html, str) and precomputed.get("docs_sha256") == _sha256_hex(md_text):
+        return docs_html
+    return _render_markdown(md_text)
+
+
+def _sha256_hex(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@functools.lru_cache(maxsize=1)
 def _get_deploy_commit() -> str:
+    commit = _get_env_commit()
+    if commit is None:
+        precomputed = _load_precomputed().get("commit")
+        commit = precomputed if isinstance(precomputed, str) and precomputed else None
+    return commit or _read_git_head_sha() or "unknown"
+
+
+def _get_env_commit() -> str | None:
     for key in (
         "VERCEL_GIT_COMMIT_SHA",
         "GITHUB_SHA",
@@ -139,22 +238,70 @@ def _get_deploy_commit() -> str:
         value = os.getenv(key)
         if value and value.strip():
             return value.strip()
-    return _read_git_head_sha() or "unknown"
+    return None
+
+
+def precompute(path: Path = DEFAULT_PRECOMPUTED_PATH) -> dict[str, Any]:
+    """Write the deploy commit and the rendered docs to `path` so startup and `/` skip them."""
+    md_text = _load_docs_markdown(DEFAULT_DOCS_MD_PATH)
+    data = {
+        "commit": _get_env_commit() or _read_git_head_sha() or "unknown",
+        "docs_sha256": _sha256_hex(md_text),
+        "docs_html": _render_markdown(md_text),
+    }
+    write_bytes_atomic(json.dumps(data, ensure_ascii=False).encode("utf-8"), path)
+    return data
+
+
+def _asset_response(request: Request, asset: CachedAsset, *, headers: dict[str, str] | None = None) -> Response:
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"), asset.variants)
+    cache_headers = {"ETag": asset.etag_for(encoding), "Cache-Control": "no-cache"}
+    if asset.variants:
+        cache_headers["Vary"] = "Accept-Encoding"
+    if etag_matches(request.headers.get("if-none-match"), cache_headers["ETag"]):
+        return Response(status_code=304, headers=cache_headers)
+    if encoding is None:
+        return Response(content=asset.body, media_type=asset.media_type, headers={**cache_headers, **(headers or {})})
+    return Response(
+        content=asset.variants[encoding],
+        media_type=asset.media_type,
+        headers={**cache_headers, "Content-Encoding": encoding, **(headers or {})},
+    )
+
+
+_TEMPLATE_ASSET = KeyedAssetCache(
+    key=lambda: file_version(DEFAULT_TEMPLATE_PATH),
+    build=lambda: make_asset(DEFAULT_TEMPLATE_PATH.read_bytes(), media_type="application/x-yaml", compress=True),
+)
 
 
 @app.get("/templates/ryan.yaml")
-def download_template() -> FileResponse:
-    if not DEFAULT_TEMPLATE_PATH.exists():
+def download_template(request: Request) -> Response:
+    if file_version(DEFAULT_TEMPLATE_PATH) is None:
         raise HTTPException(status_code=404, detail="Template not found")
-    return FileResponse(
-        path=DEFAULT_TEMPLATE_PATH,
-        media_type="application/x-yaml",
-        filename="ryan.yaml",
+    try:
+        asset = _TEMPLATE_ASSET.get()
+    except OSError as exc:
+        raise HTTPException(status_code=404, detail="Template not found") from exc
+    return _asset_response(
+        request,
+        asset,
+        headers={"Content-Disposition": 'attachment; filename="ryan.yaml"'},
     )
 
 
+_INDEX_ASSET = KeyedAssetCache(
+    key=lambda: (file_version(DEFAULT_DOCS_MD_PATH), _get_deploy_commit()),
+    build=lambda: make_asset(_render_index_html().encode("utf-8"), media_type="text/html; charset=utf-8"),
+)
+
+
 @app.get("/", response_class=HTMLResponse)
-def index() -> HTMLResponse:
+def index(request: Request) -> Response:
+    return _asset_response(request, _INDEX_ASSET.get())
+
+
+def _render_index_html() -> str:
     commit = _get_deploy_commit()
     commit_short = commit[:7] if commit != "unknown" else commit
 
@@ -169,7 +316,7 @@ def index() -> HTMLResponse:
         f"{html.escape(PROJECT_GITHUB_URL)}</a>"
     )
 
-    docs_html = _render_markdown(_load_docs_markdown(DEFAULT_DOCS_MD_PATH))
+    docs_html = _docs_html(_load_docs_markdown(DEFAULT_DOCS_MD_PATH))
     body = (
         "<h2>proxysub</h2>"
         "<p class=\"muted\">上传配置 YAML（仅需要包含 <code>proxies</code> 与 <code>proxy-providers</code>），生成一次性短链下载。</p>"
@@ -183,29 +330,68 @@ def index() -> HTMLResponse:
         "<hr style=\"border:none;border-top:1px solid #e5e7eb;margin:1.25rem 0;\" />"
         f"<div class=\"md\">{docs_html}</div>"
     )
-    return HTMLResponse(_html_page(body=body))
+    return _html_page(body=body)
 
 
-@app.post("/upload", response_class=HTMLResponse)
-async def upload_subscription(request: Request, file: UploadFile = File(...)) -> HTMLResponse:
-    raw = await file.read()
+def _warm_assets() -> None:
     try:
-        doc = yaml.safe_load(raw)
-    except yaml.YAMLError as exc:
-        raise HTTPException(status_code=400, detail=f"Invalid YAML: {exc}") from exc
+        _INDEX_ASSET.get()
+        _TEMPLATE_ASSET.get()
+    except OSError:
+        pass
 
-    token, output_path = _reserve_one_time_download(temp_dir=DEFAULT_TEMP_DIR)
 
+async def _read_upload(request: Request) -> bytes:
     try:
-        result = build_and_write_yaml_from_doc(
-            template_path=DEFAULT_TEMPLATE_PATH,
-            subs_doc=doc,
-            output_path=output_path,
-        )
+        with timed_stage("body_read"):
+            return await read_multipart_file(
+                request.stream(),
+                content_type=request.headers.get("content-type", ""),
+                content_length=request.headers.get("content-length"),
+                field_name="file",
+                max_bytes=_UPLOAD_LIMITS.max_bytes,
+            )
+    except UploadTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc)) from exc
+    except UploadInvalid as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+async def _run_build(fn: Callable[..., Any], *args: Any) -> Any:
+    try:
+        return await _BUILD_POOL.run(fn, *args)
+    except BuildPoolBusy as exc:
+        raise HTTPException(status_code=503, detail="Server busy, please retry shortly") from exc
     except Exception as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
 
-    _ONE_TIME_DOWNLOADS[token] = _OneTimeDownload(path=result.output_path, created_at=time.time())
+
+async def _store_download(rendered: bytes, variants: dict[str, bytes]) -> str:
+    token = _DOWNLOAD_STORE.reserve_token()
+    with timed_stage("store_write"):
+        if _DOWNLOAD_STORE.performs_io:
+            await run_in_threadpool(functools.partial(_DOWNLOAD_STORE.put, token, rendered, variants=variants))
+        else:
+            _DOWNLOAD_STORE.put(token, rendered, variants=variants)
+    return token
+
+
+@app.post("/upload", response_class=HTMLResponse)
+@_count_requests("upload")
+async def upload_subscription(request: Request) -> HTMLResponse:
+    raw = await _read_upload(request)
+    build = (render_upload_encoded, DEFAULT_TEMPLATE_PATH, raw, _UPLOAD_LIMITS)
+    profile_id: str | None = None
+    if _PROFILE_SETTINGS is not None and _PROFILE_SETTINGS.should_profile(request.headers.get(PROFILE_HEADER)):
+        profile_id = new_run_id()
+        rendered, variants = await _run_build(run_profiled, _PROFILE_SETTINGS, profile_id, "upload", *build)
+    else:
+        rendered, variants = await _run_build(*build)
+    try:
+        token = await _store_download(rendered, variants)
+    except DownloadStoreFull as exc:
+        raise HTTPException(status_code=503, detail="Server busy, please retry shortly") from exc
+
     download_path = f"/{token}.yaml"
     download_url = str(request.url_for("download_one_time_yaml", token=token))
 
@@ -217,27 +403,124 @@ async def upload_subscription(request: Request, file: UploadFile = File(...)) ->
 <p class="muted">链接有效期 {_ONE_TIME_DOWNLOAD_TTL_S // 60} 分钟；下载一次后即失效。</p>
 <p><a href="/">返回继续上传</a></p>
 """
-    return HTMLResponse(_html_page(body=body, title="生成成功"))
+    headers = {"X-Proxysub-Profile-Id": profile_id} if profile_id else None
+    return HTMLResponse(_html_page(body=body, title="生成成功"), headers=headers)
+
+
+@app.post("/batch")
+@_count_requests("batch")
+async def batch_upload(request: Request, format: str = "tokens") -> Response:
+    if format not in ("tokens", "zip"):
+        raise HTTPException(status_code=400, detail="format must be 'tokens' or 'zip'")
+    raw = await _read_upload(request)
+
+    if format == "zip":
+        archive = await _run_build(render_batch_zip, DEFAULT_TEMPLATE_PATH, raw, _UPLOAD_LIMITS)
+        return Response(
+            content=archive,
+            media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="proxysub-batch.zip"'},
+        )
+
+    items = await _run_build(render_batch_encoded, DEFAULT_TEMPLATE_PATH, raw, _UPLOAD_LIMITS)
+    results: list[dict[str, object]] = []
+    for item in items:
+        if item.rendered is None:
+            results.append({"index": item.index, "error": item.error})
+            continue
+        try:
+            token = await _store_download(item.rendered, item.variants)
+        except DownloadStoreFull:
+            results.append({"index": item.index, "error": "Server busy, please retry shortly"})
+            continue
+        download_url = str(request.url_for("download_one_time_yaml", token=token))
+        results.append({"index": item.index, "token": token, "url": download_url})
+    return JSONResponse({"expires_in": _ONE_TIME_DOWNLOAD_TTL_S, "items": results})
 
 
-@app.get("/{token}.yaml")
-def download_one_time_yaml(token: str, background_tasks: BackgroundTasks) -> FileResponse:
-    _cleanup_one_time_downloads()
+@app.get("/metrics")
+def metrics() -> Response:
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+_PROFILE_MEDIA_TYPES = {
+    ".prof": "application/octet-stream",
+    ".txt": "text/plain; charset=utf-8",
+    ".json": "application/json",
+}
+
+
+def _require_profiling(request: Request) -> ProfileSettings:
+    if _PROFILE_SETTINGS is None or not _PROFILE_SETTINGS.authorized(request.headers.get(PROFILE_HEADER)):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return _PROFILE_SETTINGS
+
 
-    item = _ONE_TIME_DOWNLOADS.pop(token, None)
-    if item is None or not item.path.exists():
+@app.get("/debug/profiles")
+def debug_profiles(request: Request) -> JSONResponse:
+    settings = _require_profiling(request)
+    return JSONResponse({"profiles": list_profiles(settings.out_dir)})
+
+
+@app.get("/debug/profiles/{name}")
+def debug_profile_file(name: str, request: Request) -> FileResponse:
+    settings = _require_profiling(request)
+    path = profile_file(settings.out_dir, name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path=path, media_type=_PROFILE_MEDIA_TYPES[path.suffix], filename=name)
+
+
+@app.get("/{token}.yaml")
+@_count_requests("download")
+def download_one_time_yaml(token: str, request: Request, background_tasks: BackgroundTasks) -> Response:
+    item = _DOWNLOAD_STORE.take(token)
+    if item is None:
         raise HTTPException(status_code=404, detail="Not found or already downloaded")
 
-    background_tasks.add_task(item.path.unlink, missing_ok=True)
+    filename = f"{token}{_DOWNLOAD_STORE.suffix}"
+    # Variants were compressed at build time; only the choice happens here.
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"), item.variants)
+    headers = {"Vary": "Accept-Encoding"} if item.variants else {}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    body = item.variants[encoding] if encoding is not None else (item.data if item.data is not None else item.path)
+
+    if isinstance(body, bytes):
+        return Response(
+            content=body,
+            media_type="application/x-yaml",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"', **headers},
+        )
+
+    background_tasks.add_task(_DOWNLOAD_STORE.release, item)
     return FileResponse(
-        path=item.path,
+        path=body,
         media_type="application/x-yaml",
-        filename=item.path.name,
+        filename=filename,
+        headers=headers,
         background=background_tasks,
     )
 
 
 if __name__ == "__main__":
-    import uvicorn
+    import argparse
+
+    parser = argparse.ArgumentParser(description="proxysub web service")
+    parser.add_argument(
+        "--precompute",
+        nargs="?",
+        const=DEFAULT_PRECOMPUTED_PATH,
+        type=Path,
+        metavar="PATH",
+        help=f"write build-time artifacts (deploy commit, rendered docs) and exit; default {DEFAULT_PRECOMPUTED_PATH.relative_to(APP_ROOT)}",
+    )
+    args = parser.parse_args()
+    if args.precompute is not None:
+        precompute(args.precompute)
+    else:
+        import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+        uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,3 @@
+from proxysub.cli import main
+
+raise SystemExit(main())
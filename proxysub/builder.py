@@ -1,17 +1,59 @@
 from __future__ import annotations
 
-from copy import deepcopy
+import logging
+import threading
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
+from types import MappingProxyType
+from typing import Any, Iterable, Mapping
 
 from proxysub.converter import apply_profile_script
+from proxysub.dedupe import DEFAULT_DEDUPE_POLICY, ProxyDedupeResult, dedupe_proxies
+from proxysub.metrics import timed_stage
+from proxysub.rules import DEFAULT_RULE_OPTIMIZER_MODE, RULE_OPTIMIZER_MODES, RulePlan, plan_rule_optimizations
 from proxysub.subscriptions import (
     SubsConfig,
     load_subs_config,
     parse_subs_config,
 )
-from proxysub.yamlio import FlowSeq, load_yaml_file, write_yaml_atomic
+from proxysub.yamlio import (
+    DetachedMap,
+    FlowSeq,
+    YamlCacheStats,
+    YamlFileCache,
+    clone_yaml_tree,
+    dump_yaml,
+    get_yaml_backend,
+    has_shared_nodes,
+    write_yaml_atomic,
+)
+
+logger = logging.getLogger(__name__)
+
+# Shared, read-only, by every provider without its own `health-check`; the dumper
+# emits it inline. A provider that needs other values gets its own mapping.
+_DEFAULT_HEALTH_CHECK: Mapping[str, Any] = MappingProxyType(
+    {
+        "enable": True,
+        "url": "https://www.gstatic.com/generate_204",
+        "interval": 300,
+        "lazy": True,
+    }
+)
+
+# Top-level sections `_apply_subs_config` rewrites; everything else is emitted
+# exactly as the template has it.
+DYNAMIC_TEMPLATE_SECTIONS = frozenset({"proxies", "proxy-providers", "proxy-groups"})
+
+# (resolved template path, template version, rule optimizer mode) of one render.
+_StaticKey = tuple[Path, tuple[int, int], str]
+
+_TEMPLATE_CACHE = YamlFileCache()
+_STATIC_SECTIONS: dict[_StaticKey, dict[str, str]] = {}
+_STATIC_SECTIONS_LOCK = threading.Lock()
+# `rules` / `rule-providers` only come from the template, so one plan per template version.
+_RULE_PLANS: dict[_StaticKey, RulePlan] = {}
+_rule_optimizer_mode = DEFAULT_RULE_OPTIMIZER_MODE
 
 
 @dataclass(frozen=True)
@@ -19,19 +61,69 @@ class BuildResult:
     config: dict[str, Any]
     output_path: Path
     subs_config: SubsConfig
+    dedupe: ProxyDedupeResult | None = None
 
 
-def build_config(*, template_path: Path, subs_path: Path) -> tuple[dict[str, Any], SubsConfig]:
-    template_doc = load_yaml_file(template_path)
+@dataclass(frozen=True)
+class RenderedDoc:
+    text: str | None = None
+    error: str | None = None
+
+
+def load_template_doc(template_path: Path) -> dict[str, Any]:
+    """Return a private, mutable copy of the (cached) parsed template."""
+    template_doc, _ = _load_template_doc_with_version(template_path)
+    return template_doc
+
+
+def _load_template_doc_with_version(template_path: Path) -> tuple[dict[str, Any], tuple[int, int]]:
+    template_doc, version = _TEMPLATE_CACHE.load_with_version(template_path)
     if template_doc is None:
         template_doc = {}
     if not isinstance(template_doc, dict):
         raise ValueError(f"Template must be a YAML mapping, got {type(template_doc).__name__}")
+    return template_doc, version
 
-    subs_config = load_subs_config(subs_path)
 
-    _apply_subs_config(template_doc, subs_config)
+def template_version(template_path: Path) -> tuple[int, int]:
+    return _TEMPLATE_CACHE.version(template_path)
+
+
+def template_cache_stats() -> YamlCacheStats:
+    return _TEMPLATE_CACHE.stats()
+
 
+def clear_template_cache() -> None:
+    _TEMPLATE_CACHE.clear()
+    with _STATIC_SECTIONS_LOCK:
+        _STATIC_SECTIONS.clear()
+        _RULE_PLANS.clear()
+
+
+def set_rule_optimizer_mode(mode: str) -> None:
+    """Select the rule optimizer: `off`, `dry-run` (only log the plan) or `apply`."""
+    global _rule_optimizer_mode
+    if mode not in RULE_OPTIMIZER_MODES:
+        raise ValueError(f"Unknown rule optimizer mode {mode!r}, expected one of {', '.join(RULE_OPTIMIZER_MODES)}")
+    with _STATIC_SECTIONS_LOCK:
+        _rule_optimizer_mode = mode
+        # Spliced `rules` / `rule-providers` text depends on the mode.
+        _STATIC_SECTIONS.clear()
+        _RULE_PLANS.clear()
+
+
+def get_rule_optimizer_mode() -> str:
+    return _rule_optimizer_mode
+
+
+def render_settings() -> tuple[str, ...]:
+    """Process-wide settings that change the rendered output; part of any cache key over outputs."""
+    return _rule_optimizer_mode, DEFAULT_DEDUPE_POLICY, get_yaml_backend()
+
+
+def build_config(*, template_path: Path, subs_path: Path) -> tuple[dict[str, Any], SubsConfig]:
+    subs_config = load_subs_config(subs_path)
+    template_doc, _ = _build_config(template_path, subs_config)
     return template_doc, subs_config
 
 
@@ -40,26 +132,140 @@ def build_config_from_doc(
     template_path: Path,
     subs_doc: Any,
 ) -> tuple[dict[str, Any], SubsConfig]:
-    template_doc = load_yaml_file(template_path)
-    if template_doc is None:
-        template_doc = {}
-    if not isinstance(template_doc, dict):
-        raise ValueError(f"Template must be a YAML mapping, got {type(template_doc).__name__}")
-
     subs_config = parse_subs_config(subs_doc)
-    _apply_subs_config(template_doc, subs_config)
+    template_doc, _ = _build_config(template_path, subs_config)
     return template_doc, subs_config
 
 
+def _build_config(template_path: Path, subs_config: SubsConfig) -> tuple[dict[str, Any], ProxyDedupeResult]:
+    template_doc, version = _load_template_doc_with_version(template_path)
+    dedupe = _apply_subs_config(template_doc, subs_config)
+    _optimize_rules(template_doc, _static_key(template_path, version))
+    return template_doc, dedupe
+
+
+def render_yaml_from_doc(
+    *,
+    template_path: Path,
+    subs_doc: Any,
+    splice: bool = True,
+) -> str:
+    """Build the config for `subs_doc` and return it as YAML text.
+
+    With `splice`, the static template sections are serialized once per template
+    version and only `DYNAMIC_TEMPLATE_SECTIONS` are dumped per call; the result is
+    identical to `dump_yaml` of the built config.
+    """
+    with timed_stage("template_load"):
+        template_doc, version = _load_template_doc_with_version(template_path)
+    static_key = _static_key(template_path, version)
+    with timed_stage("parse_subs"):
+        subs_config = parse_subs_config(subs_doc)
+    with timed_stage("apply_subs"):
+        _apply_subs_config(template_doc, subs_config)
+    _optimize_rules(template_doc, static_key)
+    with timed_stage("dump"):
+        if not splice:
+            return dump_yaml(template_doc)
+        return _dump_spliced(template_doc, static_key=static_key)
+
+
+def render_yaml_batch(
+    *,
+    template_path: Path,
+    subs_docs: Iterable[Any],
+    splice: bool = True,
+) -> list[RenderedDoc]:
+    """Render many subs documents against a single template state.
+
+    The template is loaded (and its static sections resolved) once; each document
+    gets its own copy. A failing document is reported in its `RenderedDoc.error`
+    and does not affect the others.
+    """
+    with timed_stage("template_load"):
+        template_doc, version = _load_template_doc_with_version(template_path)
+    static_key = _static_key(template_path, version)
+
+    out: list[RenderedDoc] = []
+    for subs_doc in subs_docs:
+        try:
+            with timed_stage("template_load"):
+                config = clone_yaml_tree(template_doc)
+            with timed_stage("parse_subs"):
+                subs_config = parse_subs_config(subs_doc)
+            with timed_stage("apply_subs"):
+                _apply_subs_config(config, subs_config)
+            _optimize_rules(config, static_key)
+            with timed_stage("dump"):
+                text = _dump_spliced(config, static_key=static_key) if splice else dump_yaml(config)
+        except Exception as exc:
+            out.append(RenderedDoc(error=str(exc) or type(exc).__name__))
+            continue
+        out.append(RenderedDoc(text=text))
+    return out
+
+
+def _static_key(template_path: Path, version: tuple[int, int]) -> _StaticKey:
+    # The mode is read once per render, so a concurrent `set_rule_optimizer_mode`
+    # cannot make a render store static text for one mode under the other.
+    return Path(template_path).resolve(), version, _rule_optimizer_mode
+
+
+def _optimize_rules(config: dict[str, Any], static_key: _StaticKey) -> None:
+    """Run the rule optimizer stage; the plan is worked out (and logged) once per template version."""
+    mode = static_key[2]
+    if mode == "off":
+        return
+    with _STATIC_SECTIONS_LOCK:
+        plan = _RULE_PLANS.get(static_key)
+    if plan is None:
+        with timed_stage("rule_plan"):
+            plan = plan_rule_optimizations(config)
+        with _STATIC_SECTIONS_LOCK:
+            for stale_key in [k for k in _RULE_PLANS if k[0] == static_key[0]]:
+                del _RULE_PLANS[stale_key]
+            _RULE_PLANS[static_key] = plan
+        if plan.changed:
+            logger.info(
+                "rule optimizer (%s) for %s:\n  %s", mode, static_key[0], "\n  ".join(plan.report_lines())
+            )
+    if mode == "apply":
+        plan.apply(config)
+
+
+def _dump_spliced(config: dict[str, Any], *, static_key: _StaticKey) -> str:
+    with _STATIC_SECTIONS_LOCK:
+        static_sections = _STATIC_SECTIONS.get(static_key)
+
+    if static_sections is None:
+        # Splitting the document is only safe when the dumper emits no anchors.
+        if not config or has_shared_nodes(config):
+            return dump_yaml(config)
+        static_sections = {
+            key: dump_yaml({key: value}) for key, value in config.items() if key not in DYNAMIC_TEMPLATE_SECTIONS
+        }
+        with _STATIC_SECTIONS_LOCK:
+            for stale_key in [k for k in _STATIC_SECTIONS if k[0] == static_key[0]]:
+                del _STATIC_SECTIONS[stale_key]
+            _STATIC_SECTIONS[static_key] = static_sections
+    elif not config or has_shared_nodes({k: v for k, v in config.items() if k not in static_sections}):
+        return dump_yaml(config)
+
+    return "".join(
+        static_sections[key] if key in static_sections else dump_yaml({key: value}) for key, value in config.items()
+    )
+
+
 def build_and_write_yaml(
     *,
     template_path: Path,
     subs_path: Path,
     output_path: Path,
 ) -> BuildResult:
-    config, subs_config = build_config(template_path=template_path, subs_path=subs_path)
+    subs_config = load_subs_config(subs_path)
+    config, dedupe = _build_config(template_path, subs_config)
     write_yaml_atomic(config, output_path)
-    return BuildResult(config=config, output_path=output_path, subs_config=subs_config)
+    return BuildResult(config=config, output_path=output_path, subs_config=subs_config, dedupe=dedupe)
 
 
 def build_and_write_yaml_from_doc(
@@ -68,42 +274,53 @@ def build_and_write_yaml_from_doc(
     subs_doc: Any,
     output_path: Path,
 ) -> BuildResult:
-    config, subs_config = build_config_from_doc(template_path=template_path, subs_doc=subs_doc)
+    subs_config = parse_subs_config(subs_doc)
+    config, dedupe = _build_config(template_path, subs_config)
     write_yaml_atomic(config, output_path)
-    return BuildResult(config=config, output_path=output_path, subs_config=subs_config)
+    return BuildResult(config=config, output_path=output_path, subs_config=subs_config, dedupe=dedupe)
 
 
-def _apply_subs_config(template_doc: dict[str, Any], subs_config: SubsConfig) -> None:
-    template_doc["proxies"] = _dedupe_proxies_by_name(list(subs_config.proxies))
+def _apply_subs_config(template_doc: dict[str, Any], subs_config: SubsConfig) -> ProxyDedupeResult:
+    us_home_name = subs_config.first_proxy_name
+    dedupe = dedupe_proxies(subs_config.proxies, keep_names=(us_home_name,) if us_home_name else ())
+    if dedupe.collapsed:
+        logger.info("collapsed %d proxies sharing an endpoint with another proxy", dedupe.collapsed)
+        _rename_proxy_references(dedupe.proxies, template_doc.get("proxy-groups"), dedupe.aliases)
+    template_doc["proxies"] = dedupe.proxies
 
     proxy_providers, provider_names = _resolve_proxy_providers(template_doc.get("proxy-providers"), subs_config)
     template_doc["proxy-providers"] = proxy_providers
     _sync_group_use_fields(template_doc.get("proxy-groups"), provider_names)
 
-    apply_profile_script(
-        template_doc,
-        us_home_proxy_name=subs_config.us_home_proxy_name,
-        west_cowboy_url_override=subs_config.west_cowboy_url,
-        west_cowboy_expected_status_override=subs_config.west_cowboy_expected_status,
-    )
+    with timed_stage("profile_script"):
+        apply_profile_script(
+            template_doc,
+            us_home_proxy_name=subs_config.us_home_proxy_name,
+            west_cowboy_url_override=subs_config.west_cowboy_url,
+            west_cowboy_expected_status_override=subs_config.west_cowboy_expected_status,
+            west_cowboy_regions=subs_config.west_cowboy_regions,
+        )
     _flowify_proxy_group_lists(template_doc.get("proxy-groups"))
+    return dedupe
 
 
-def _dedupe_proxies_by_name(proxies: list[Any]) -> list[dict[str, Any]]:
-    seen_names: set[str] = set()
-    out: list[dict[str, Any]] = []
+def _rename_proxy_references(proxies: list[dict[str, Any]], proxy_groups: Any, aliases: dict[str, str]) -> None:
+    """Point group members and `dialer-proxy` fields at the proxies that replaced collapsed ones."""
     for proxy in proxies:
-        if not isinstance(proxy, dict):
-            continue
-        name = proxy.get("name")
-        if not isinstance(name, str):
+        dialer = proxy.get("dialer-proxy")
+        if isinstance(dialer, str) and dialer in aliases:
+            proxy["dialer-proxy"] = aliases[dialer]
+
+    if not isinstance(proxy_groups, list):
+        return
+    for group in proxy_groups:
+        if not isinstance(group, dict):
             continue
-        name = name.strip()
-        if not name or name in seen_names:
+        members = group.get("proxies")
+        if not isinstance(members, list) or not any(isinstance(m, str) and m in aliases for m in members):
             continue
-        seen_names.add(name)
-        out.append(proxy)
-    return out
+        renamed = [aliases.get(m, m) if isinstance(m, str) else m for m in members]
+        group["proxies"] = list(dict.fromkeys(renamed)) if all(isinstance(m, str) for m in renamed) else renamed
 
 
 def _build_proxy_providers(
@@ -131,18 +348,11 @@ def _build_proxy_providers(
         if not isinstance(base, dict):
             base = default_provider if isinstance(default_provider, dict) else {}
 
-        provider = deepcopy(base)
+        # Shallow copy: nested values stay shared with `base`; `DetachedMap` dumps them inline.
+        provider = DetachedMap(base)
         provider.setdefault("type", "http")
         provider.setdefault("interval", 3600)
-        provider.setdefault(
-            "health-check",
-            {
-                "enable": True,
-                "url": "https://www.gstatic.com/generate_204",
-                "interval": 300,
-                "lazy": True,
-            },
-        )
+        provider.setdefault("health-check", _DEFAULT_HEALTH_CHECK)
 
         provider["url"] = url
         if provider_name in existing and isinstance(existing.get(provider_name), dict):
@@ -180,18 +390,10 @@ def _normalize_proxy_providers(
         if not isinstance(raw_provider, dict):
             continue
 
-        provider = deepcopy(raw_provider)
+        provider = DetachedMap(raw_provider)
         provider.setdefault("type", "http")
         provider.setdefault("interval", 3600)
-        provider.setdefault(
-            "health-check",
-            {
-                "enable": True,
-                "url": "https://www.gstatic.com/generate_204",
-                "interval": 300,
-                "lazy": True,
-            },
-        )
+        provider.setdefault("health-check", _DEFAULT_HEALTH_CHECK)
 
         url = provider.get("url")
         if isinstance(url, str):
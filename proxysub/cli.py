@@ -0,0 +1,237 @@
+"""Offline bulk builder: render many subs files against one template.
+
+    uv run proxysub -t templates/ryan.yaml -o out/ subs/ 'more/*.yaml' --incremental
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Sequence
+
+from proxysub import __version__
+from proxysub.builder import (
+    get_rule_optimizer_mode,
+    load_template_doc,
+    render_yaml_from_doc,
+    set_rule_optimizer_mode,
+)
+from proxysub.rules import RULE_OPTIMIZER_MODES, plan_rule_optimizations
+from proxysub.yamlio import load_yaml_file, write_bytes_atomic
+
+DEFAULT_TEMPLATE_PATH = Path("templates") / "ryan.yaml"
+SUBS_SUFFIXES = (".yaml", ".yml")
+
+
+@dataclass(frozen=True)
+class BuildJob:
+    subs_path: Path
+    output_path: Path
+
+
+@dataclass(frozen=True)
+class JobResult:
+    job: BuildJob
+    status: str  # "built" | "skipped" | "failed"
+    elapsed_s: float = 0.0
+    output_bytes: int = 0
+    error: str | None = None
+
+
+def collect_subs_files(inputs: Sequence[str]) -> list[Path]:
+    """Expand files, directories (their `*.yaml`/`*.yml`) and glob patterns, keeping input order."""
+    seen: set[Path] = set()
+    out: list[Path] = []
+
+    def add(path: Path) -> None:
+        key = path.resolve()
+        if key not in seen:
+            seen.add(key)
+            out.append(path)
+
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            for child in sorted(path.iterdir()):
+                if child.is_file() and child.suffix.lower() in SUBS_SUFFIXES:
+                    add(child)
+        elif path.is_file():
+            add(path)
+        else:
+            matches = sorted(glob.glob(item, recursive=True))
+            if not matches:
+                raise FileNotFoundError(f"no subs files match {item!r}")
+            for match in matches:
+                if Path(match).is_file():
+                    add(Path(match))
+    return out
+
+
+def plan_jobs(subs_paths: Sequence[Path], output_dir: Path) -> list[BuildJob]:
+    jobs: list[BuildJob] = []
+    claimed: dict[Path, Path] = {}
+    for subs_path in subs_paths:
+        output_path = output_dir / f"{subs_path.stem}.yaml"
+        other = claimed.get(output_path)
+        if other is not None:
+            raise ValueError(f"{subs_path} and {other} would both be written to {output_path}")
+        claimed[output_path] = subs_path
+        jobs.append(BuildJob(subs_path=subs_path, output_path=output_path))
+    return jobs
+
+
+def is_up_to_date(job: BuildJob, template_path: Path) -> bool:
+    """True when the output is newer than both its subs file and the template."""
+    try:
+        output_mtime = job.output_path.stat().st_mtime_ns
+        return output_mtime > job.subs_path.stat().st_mtime_ns and output_mtime > template_path.stat().st_mtime_ns
+    except OSError:
+        return False
+
+
+def build_one(template_path: Path, job: BuildJob, splice: bool = True) -> JobResult:
+    """Render a single subs file; runs in a pool worker, which keeps the parsed template cached."""
+    started = time.perf_counter()
+    try:
+        rendered = render_yaml_from_doc(
+            template_path=template_path,
+            subs_doc=load_yaml_file(job.subs_path),
+            splice=splice,
+        ).encode("utf-8")
+        write_bytes_atomic(rendered, job.output_path)
+    except Exception as exc:
+        return JobResult(
+            job=job,
+            status="failed",
+            elapsed_s=time.perf_counter() - started,
+            error=str(exc) or type(exc).__name__,
+        )
+    return JobResult(job=job, status="built", elapsed_s=time.perf_counter() - started, output_bytes=len(rendered))
+
+
+def run_jobs(
+    jobs: Sequence[BuildJob],
+    *,
+    template_path: Path,
+    workers: int,
+    incremental: bool = False,
+    splice: bool = True,
+) -> list[JobResult]:
+    results: list[JobResult] = []
+    pending: list[BuildJob] = []
+    for job in jobs:
+        if incremental and is_up_to_date(job, template_path):
+            results.append(JobResult(job=job, status="skipped"))
+        else:
+            pending.append(job)
+
+    if workers <= 1 or len(pending) <= 1:
+        results.extend(build_one(template_path, job, splice) for job in pending)
+        return results
+
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(pending)),
+        initializer=_init_worker,
+        initargs=(template_path, get_rule_optimizer_mode()),
+    ) as executor:
+        futures = [executor.submit(build_one, template_path, job, splice) for job in pending]
+        results.extend(future.result() for future in as_completed(futures))
+    return results
+
+
+def _init_worker(template_path: Path, rule_optimizer_mode: str) -> None:
+    set_rule_optimizer_mode(rule_optimizer_mode)
+    # Parse the template once per worker; `main` has already validated it.
+    load_template_doc(template_path)
+
+
+def _format_summary(results: Sequence[JobResult], *, wall_s: float, verbose: bool) -> str:
+    built = [r for r in results if r.status == "built"]
+    failed = [r for r in results if r.status == "failed"]
+    skipped = [r for r in results if r.status == "skipped"]
+
+    lines: list[str] = []
+    for result in sorted(results, key=lambda r: str(r.job.subs_path)):
+        if result.status == "skipped" and not verbose:
+            continue
+        line = f"{result.status:<8} {result.job.subs_path} -> {result.job.output_path}"
+        if result.status != "skipped":
+            line += f"  {result.elapsed_s * 1000:.1f} ms"
+        if result.error:
+            line += f"  ({result.error})"
+        lines.append(line)
+
+    total_bytes = sum(r.output_bytes for r in built)
+    rate = len(built) / wall_s if wall_s > 0 else 0.0
+    lines.append(
+        f"built {len(built)}, skipped {len(skipped)}, failed {len(failed)} "
+        f"in {wall_s:.2f}s ({rate:.1f} files/s, {total_bytes / 1024 / 1024 / max(wall_s, 1e-9):.2f} MiB/s)"
+    )
+    if built:
+        timings = sorted(r.elapsed_s for r in built)
+        mean = sum(timings) / len(timings)
+        lines.append(
+            f"per file: min {timings[0] * 1000:.1f} ms, mean {mean * 1000:.1f} ms, "
+            f"p95 {timings[math.ceil(0.95 * len(timings)) - 1] * 1000:.1f} ms, max {timings[-1] * 1000:.1f} ms"
+        )
+    return "\n".join(lines)
+
+
+def _parse_args(argv: Sequence[str] | None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="proxysub", description="Build Clash/Mihomo configs from subs files.")
+    parser.add_argument("inputs", nargs="+", help="subs files, directories or glob patterns")
+    parser.add_argument("-t", "--template", type=Path, default=DEFAULT_TEMPLATE_PATH, help="template YAML")
+    parser.add_argument("-o", "--output-dir", type=Path, required=True, help="directory for the built configs")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="skip outputs newer than both their subs file and the template",
+    )
+    parser.add_argument("--full-render", action="store_true", help="dump every section instead of splicing")
+    parser.add_argument(
+        "--optimize-rules",
+        choices=RULE_OPTIMIZER_MODES,
+        help="drop shadowed rules / unused rule-providers and move cheap rules up; "
+        "dry-run only prints what would change (default: $PROXYSUB_RULE_OPTIMIZER or off)",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="also list skipped files")
+    parser.add_argument("--version", action="version", version=f"%(prog)s {__version__}")
+    return parser.parse_args(argv)
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    args = _parse_args(argv)
+    try:
+        template_doc = load_template_doc(args.template)
+        jobs = plan_jobs(collect_subs_files(args.inputs), args.output_dir)
+    except Exception as exc:
+        print(f"proxysub: {exc}", file=sys.stderr)
+        return 2
+
+    if args.optimize_rules:
+        set_rule_optimizer_mode(args.optimize_rules)
+    if get_rule_optimizer_mode() != "off":
+        print("\n".join(plan_rule_optimizations(template_doc).report_lines()))
+
+    started = time.perf_counter()
+    results = run_jobs(
+        jobs,
+        template_path=args.template,
+        workers=args.jobs,
+        incremental=args.incremental,
+        splice=not args.full_render,
+    )
+    print(_format_summary(results, wall_s=time.perf_counter() - started, verbose=args.verbose))
+    return 1 if any(r.status == "failed" for r in results) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,136 @@
+"""Precompressed response variants and Accept-Encoding negotiation.
+
+gzip is always available; brotli (`br`) and zstd need the optional `brotli` /
+`zstandard` packages. Variants are produced once when a body is built, never on
+the download path.
+"""
+
+from __future__ import annotations
+
+import functools
+import gzip
+import os
+from typing import Callable, Collection
+
+COMPRESSION_ENV = "PROXYSUB_COMPRESSION"
+# Default preference order when a client accepts several encodings equally.
+SUPPORTED_ENCODINGS = ("br", "zstd", "gzip")
+# Bodies smaller than this are not worth a variant.
+MIN_COMPRESS_BYTES = 1024
+
+
+def _gzip_encoder() -> Callable[[bytes], bytes]:
+    return functools.partial(gzip.compress, compresslevel=9, mtime=0)
+
+
+def _brotli_encoder() -> Callable[[bytes], bytes] | None:
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return functools.partial(brotli.compress, quality=9, mode=brotli.MODE_TEXT)
+
+
+def _zstd_encoder() -> Callable[[bytes], bytes] | None:
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard.ZstdCompressor(level=12).compress
+
+
+_ENCODER_FACTORIES: dict[str, Callable[[], Callable[[bytes], bytes] | None]] = {
+    "br": _brotli_encoder,
+    "zstd": _zstd_encoder,
+    "gzip": _gzip_encoder,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _encoder(encoding: str) -> Callable[[bytes], bytes] | None:
+    return _ENCODER_FACTORIES[encoding]()
+
+
+def available_encodings() -> tuple[str, ...]:
+    return tuple(encoding for encoding in SUPPORTED_ENCODINGS if _encoder(encoding) is not None)
+
+
+@functools.lru_cache(maxsize=1)
+def enabled_encodings() -> tuple[str, ...]:
+    """Encodings to precompute, in preference order, from `PROXYSUB_COMPRESSION`.
+
+    `auto` (default) means every available encoding, `off` none; otherwise a
+    comma-separated list, each of which must be available.
+    """
+    raw = os.getenv(COMPRESSION_ENV, "").strip().lower() or "auto"
+    if raw == "auto":
+        return available_encodings()
+    if raw == "off":
+        return ()
+    encodings = tuple(dict.fromkeys(part.strip() for part in raw.split(",") if part.strip()))
+    for encoding in encodings:
+        if encoding not in SUPPORTED_ENCODINGS:
+            raise ValueError(
+                f"{COMPRESSION_ENV} must be auto, off or a list of {', '.join(SUPPORTED_ENCODINGS)}, got {raw!r}"
+            )
+        if _encoder(encoding) is None:
+            package = "brotli" if encoding == "br" else "zstandard"
+            raise ValueError(f"{COMPRESSION_ENV} lists {encoding!r} but the {package!r} package is not installed")
+    return encodings
+
+
+def compress_variants(data: bytes, encodings: Collection[str] | None = None) -> dict[str, bytes]:
+    """Compressed copies of `data` by content-coding, keeping only the ones that are smaller."""
+    if encodings is None:
+        encodings = enabled_encodings()
+    if len(data) < MIN_COMPRESS_BYTES:
+        return {}
+    variants: dict[str, bytes] = {}
+    for encoding in encodings:
+        encoder = _encoder(encoding)
+        if encoder is None:
+            continue
+        compressed = encoder(data)
+        if len(compressed) < len(data):
+            variants[encoding] = compressed
+    return variants
+
+
+def negotiate_encoding(accept_encoding: str | None, available: Collection[str]) -> str | None:
+    """The entry of `available` to send for an Accept-Encoding header, or None for the identity body.
+
+    Picks the highest q-value; ties go to the order of `available`. `identity` only
+    wins when the client lists it with a higher q-value than any available coding.
+    """
+    if not accept_encoding or not available:
+        return None
+
+    qvalues: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value.strip())
+                except ValueError:
+                    q = 0.0
+        qvalues[coding] = q
+    if "x-gzip" in qvalues:
+        qvalues.setdefault("gzip", qvalues["x-gzip"])
+
+    wildcard = qvalues.get("*", 0.0)
+    best: str | None = None
+    best_q = 0.0
+    for encoding in available:
+        q = qvalues.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    identity_q = qvalues.get("identity")
+    if best is not None and identity_q is not None and identity_q > best_q:
+        return None
+    return best
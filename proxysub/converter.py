@@ -1,26 +1,26 @@
 from __future__ import annotations
 
-import re
-from typing import Any
+from typing import Any, Sequence
+
+from proxysub.regions import RegionSpec, get_region_classifier
 
 TEST_URL = "https://www.gstatic.com/generate_204"
 WEST_COWBOY_GROUP_NAME = "西部牛仔"
 LEGACY_DIALER_GROUP_NAME = "dialer-group"
 DEFAULT_WEST_COWBOY_EXPECTED_STATUS = 407
 
-_US_TOKEN_RE = re.compile(r"(^|[^A-Za-z0-9])US([^A-Za-z0-9]|$)", re.IGNORECASE)
-
-
 def apply_profile_script(
     config: Any,
     *,
     us_home_proxy_name: str,
     west_cowboy_url_override: str | None = None,
     west_cowboy_expected_status_override: str | int | None = None,
+    west_cowboy_regions: Sequence[RegionSpec] | None = None,
 ) -> Any:
     """Python port of `ref_scripts/scripts.js`.
 
-    Mutates and returns `config` (a Clash/Mihomo config dict).
+    Mutates and returns `config` (a Clash/Mihomo config dict). Manual proxies whose
+    names match `west_cowboy_regions` (default: US) join the west-cowboy group.
     """
     if not isinstance(config, dict):
         return config
@@ -39,19 +39,24 @@ def apply_profile_script(
         config[proxies_key] = []
     proxies: list[Any] = config[proxies_key]
 
-    us_home_proxy = _find_proxy(proxies, us_home_proxy_name)
+    # One pass over the proxies: name index, manual proxy names and legacy dialer users.
+    proxies_by_name: dict[str, dict[str, Any]] = {}
+    legacy_dialer_proxies: list[dict[str, Any]] = []
+    for p in proxies:
+        if not isinstance(p, dict):
+            continue
+        name = p.get("name")
+        if isinstance(name, str) and name not in proxies_by_name:
+            proxies_by_name[name] = p
+        if p.get("dialer-proxy") == LEGACY_DIALER_GROUP_NAME:
+            legacy_dialer_proxies.append(p)
+    manual_proxy_names = [name for name in proxies_by_name if name.strip()]
+
+    us_home_proxy = proxies_by_name.get(us_home_proxy_name)
     if us_home_proxy is not None:
         us_home_proxy["dialer-proxy"] = WEST_COWBOY_GROUP_NAME
     default_west_cowboy_url = _build_http_probe_url_from_proxy(us_home_proxy)
 
-    manual_proxy_names = _uniq_strings(
-        [
-            p.get("name")
-            for p in proxies
-            if isinstance(p, dict) and isinstance(p.get("name"), str) and p.get("name").strip()
-        ]
-    )
-
     proxy_providers = config.get("proxy-providers")
     provider_names = (
         list(proxy_providers.keys())
@@ -59,7 +64,9 @@ def apply_profile_script(
         else []
     )
 
-    matched_manual_proxy_names = [name for name in manual_proxy_names if _is_west_cowboy_node(name, us_home_proxy_name)]
+    candidate_names = [name for name in manual_proxy_names if name != us_home_proxy_name]
+    verdicts = get_region_classifier(west_cowboy_regions).classify_many(candidate_names)
+    matched_manual_proxy_names = [name for name, region in zip(candidate_names, verdicts) if region is not None]
 
     west_cowboy_group = _get_group(proxy_groups, WEST_COWBOY_GROUP_NAME)
     if west_cowboy_group is None:
@@ -112,25 +119,23 @@ def apply_profile_script(
         west_cowboy_group.pop("use", None)
         west_cowboy_group.pop("filter", None)
 
+    # The US-Home proxy no longer dials through the legacy group (see above).
+    dialer_group_still_used = any(p is not us_home_proxy for p in legacy_dialer_proxies)
     for group in proxy_groups:
         if not isinstance(group, dict):
             continue
-        if group.get("name") == WEST_COWBOY_GROUP_NAME:
-            continue
         group_proxies = group.get("proxies")
-        if not isinstance(group_proxies, list):
-            continue
-        group["proxies"] = _uniq_strings([p for p in group_proxies if isinstance(p, str)])
-        if group.get("include-all-proxies") is True:
+        if group.get("name") == WEST_COWBOY_GROUP_NAME or not isinstance(group_proxies, list):
+            if LEGACY_DIALER_GROUP_NAME in _ensure_list(group_proxies):
+                dialer_group_still_used = True
             continue
-        if us_home_proxy_name not in group["proxies"]:
-            group["proxies"].append(us_home_proxy_name)
-
-    dialer_group_still_used = any(
-        isinstance(p, dict) and p.get("dialer-proxy") == LEGACY_DIALER_GROUP_NAME for p in proxies
-    ) or any(
-        isinstance(g, dict) and LEGACY_DIALER_GROUP_NAME in _ensure_list(g.get("proxies")) for g in proxy_groups
-    )
+        deduped, seen = _dedupe_strings(group_proxies)
+        group["proxies"] = deduped
+        if group.get("include-all-proxies") is not True and us_home_proxy_name not in seen:
+            deduped.append(us_home_proxy_name)
+            seen.add(us_home_proxy_name)
+        if LEGACY_DIALER_GROUP_NAME in seen:
+            dialer_group_still_used = True
     if not dialer_group_still_used:
         proxy_groups[:] = [
             g
@@ -148,13 +153,6 @@ def _get_group(proxy_groups: list[Any], name: str) -> dict[str, Any] | None:
     return None
 
 
-def _find_proxy(proxies: list[Any], name: str) -> dict[str, Any] | None:
-    for proxy in proxies:
-        if isinstance(proxy, dict) and proxy.get("name") == name:
-            return proxy
-    return None
-
-
 def _build_http_probe_url_from_proxy(proxy: dict[str, Any] | None) -> str | None:
     if not isinstance(proxy, dict):
         return None
@@ -187,6 +185,11 @@ def _ensure_list(value: Any) -> list[Any]:
 
 
 def _uniq_strings(values: list[Any]) -> list[str]:
+    return _dedupe_strings(values)[0]
+
+
+def _dedupe_strings(values: list[Any]) -> tuple[list[str], set[str]]:
+    """Strings of `values` in first-seen order, plus the set of them for O(1) membership."""
     seen: set[str] = set()
     out: list[str] = []
     for value in values:
@@ -196,12 +199,4 @@ def _uniq_strings(values: list[Any]) -> list[str]:
             continue
         seen.add(value)
         out.append(value)
-    return out
-
-
-def _is_west_cowboy_node(name: str, us_home_proxy_name: str) -> bool:
-    if name == us_home_proxy_name:
-        return False
-    if "美国" in name:
-        return True
-    return bool(_US_TOKEN_RE.search(name))
+    return out, seen
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import Any, Collection, Iterable
+
+from proxysub.env import env_choice
+
+PROXY_DEDUPE_ENV = "PROXYSUB_PROXY_DEDUPE"
+# Which name survives when several proxies share an endpoint; `off` (default) keeps them all.
+DEDUPE_POLICIES = ("first", "last", "shortest", "off")
+DEFAULT_DEDUPE_POLICY = env_choice(PROXY_DEDUPE_ENV, "off", DEDUPE_POLICIES)
+
+# Client-side socket options: they do not change which server a proxy talks to.
+_LOCAL_OPTION_KEYS = frozenset({"name", "udp", "tfo", "mptcp", "interface-name", "routing-mark", "ip-version"})
+_encode_canonical = json.JSONEncoder(sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str).encode
+
+
+@dataclass(frozen=True)
+class ProxyDedupeResult:
+    proxies: list[dict[str, Any]]
+    # Entries dropped because another proxy has the same endpoint.
+    collapsed: int = 0
+    # Entries dropped because an earlier proxy has the same name.
+    duplicate_names: int = 0
+    # Dropped name -> the name of the proxy that replaced it.
+    aliases: dict[str, str] = field(default_factory=dict)
+
+
+def endpoint_fingerprint(proxy: dict[str, Any]) -> bytes | None:
+    """Digest of everything that identifies a proxy's endpoint, or None when it has no server/port.
+
+    Covers type, server, port, credentials and transport options: every field
+    except `name` and local socket options. Keys are sorted, `type`/`server` are
+    case-folded and `port` is compared as a number.
+    """
+    ptype = proxy.get("type")
+    server = proxy.get("server")
+    port = _canonical_port(proxy.get("port"))
+    if not isinstance(ptype, str) or not isinstance(server, str) or not server.strip() or port is None:
+        return None
+
+    fields = {k: v for k, v in proxy.items() if k not in _LOCAL_OPTION_KEYS}
+    fields["type"] = ptype.strip().lower()
+    fields["server"] = server.strip().rstrip(".").lower()
+    fields["port"] = port
+    try:
+        canonical = _encode_canonical(fields)
+    except (TypeError, ValueError):
+        # Mixed-type or recursive keys: treat the proxy as unique.
+        return None
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).digest()
+
+
+def dedupe_proxies(
+    proxies: Iterable[Any],
+    *,
+    policy: str = DEFAULT_DEDUPE_POLICY,
+    keep_names: Collection[str] = (),
+) -> ProxyDedupeResult:
+    """Drop unnamed proxies, repeated names and (unless `policy` is `off`) repeated endpoints, in one pass.
+
+    A group of same-endpoint proxies keeps the position of its first member and the
+    entry chosen by `policy`: the `first` or `last` seen, or the `shortest` name.
+    Proxies named in `keep_names` are never collapsed.
+    """
+    if policy not in DEDUPE_POLICIES:
+        raise ValueError(f"proxy dedupe policy must be one of {', '.join(DEDUPE_POLICIES)}, got {policy!r}")
+
+    out: list[dict[str, Any]] = []
+    seen_names: set[str] = set()
+    slot_by_fingerprint: dict[bytes, int] = {}
+    # Slot -> names of every proxy collapsed into it, for collapsed slots only.
+    members: dict[int, list[str]] = {}
+    duplicate_names = 0
+    named = [(p, p["name"].strip()) for p in proxies if isinstance(p, dict) and _has_name(p)]
+
+    for proxy, name in named:
+        if name in seen_names:
+            duplicate_names += 1
+            continue
+        seen_names.add(name)
+
+        fingerprint = None if policy == "off" or name in keep_names else endpoint_fingerprint(proxy)
+        if fingerprint is None:
+            out.append(proxy)
+            continue
+        slot = slot_by_fingerprint.get(fingerprint)
+        if slot is None:
+            slot_by_fingerprint[fingerprint] = len(out)
+            out.append(proxy)
+            continue
+
+        names = members.get(slot)
+        if names is None:
+            names = members[slot] = [out[slot]["name"].strip()]
+        names.append(name)
+        if policy == "last" or (policy == "shortest" and len(name) < len(out[slot]["name"].strip())):
+            out[slot] = proxy
+
+    aliases: dict[str, str] = {}
+    for slot, names in members.items():
+        kept = out[slot]["name"].strip()
+        for name in names:
+            if name != kept:
+                aliases[name] = kept
+
+    return ProxyDedupeResult(
+        proxies=out,
+        collapsed=len(aliases),
+        duplicate_names=duplicate_names,
+        aliases=aliases,
+    )
+
+
+def _has_name(proxy: dict[str, Any]) -> bool:
+    name = proxy.get("name")
+    return isinstance(name, str) and bool(name.strip())
+
+
+def _canonical_port(raw: Any) -> int | None:
+    if isinstance(raw, bool):
+        return None
+    if isinstance(raw, int):
+        return raw
+    if isinstance(raw, str) and raw.strip().isdigit():
+        return int(raw.strip())
+    return None
@@ -0,0 +1,442 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+import os
+import secrets
+import sqlite3
+import string
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import ClassVar, Mapping
+
+from proxysub.env import env_choice, env_int
+from proxysub.metrics import DOWNLOAD_RECLAIMED_BYTES, DOWNLOADS_RECLAIMED
+from proxysub.yamlio import write_bytes_atomic
+
+DOWNLOAD_STORE_ENV = "PROXYSUB_DOWNLOAD_STORE"
+DOWNLOAD_MEMORY_MAX_BYTES_ENV = "PROXYSUB_DOWNLOAD_MEMORY_MAX_BYTES"
+DOWNLOAD_SQLITE_PATH_ENV = "PROXYSUB_DOWNLOAD_SQLITE_PATH"
+DOWNLOAD_STORES = ("file", "memory", "sqlite")
+DEFAULT_MEMORY_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_REAP_INTERVAL_S = 10.0
+# Outside the source tree, but shared by every worker process on the machine.
+DEFAULT_SQLITE_PATH = Path(tempfile.gettempdir()) / "proxysub" / "downloads.sqlite3"
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_ALPHABET = string.ascii_letters + string.digits
+_VARIANT_SUFFIXES = {"gzip": ".gz", "br": ".br", "zstd": ".zst"}
+
+
+def generate_short_token(length: int = 8) -> str:
+    if length <= 0:
+        raise ValueError("length must be > 0")
+    return "".join(secrets.choice(_TOKEN_ALPHABET) for _ in range(length))
+
+
+class DownloadStoreFull(RuntimeError):
+    """Raised when a store cannot accept more data; the caller should shed load (HTTP 503)."""
+
+
+@dataclass(frozen=True)
+class OneTimeDownload:
+    token: str
+    created_at: float
+    # Bytes held for this entry, compressed variants included.
+    size: int
+    data: bytes | None = None
+    path: Path | None = None
+    # Content-Encoding -> precompressed body (bytes, or a file next to `path`).
+    variants: Mapping[str, bytes | Path] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class DownloadStoreStats:
+    outstanding: int
+    outstanding_bytes: int
+    reclaimed: int
+    reclaimed_bytes: int
+
+
+class OneTimeDownloadStore(ABC):
+    """Registry of rendered configs that may each be downloaded exactly once.
+
+    Expiry is tracked in a min-heap keyed on `created_at`: `cleanup` pops only the
+    entries whose TTL has passed, so request handlers never scan the registry.
+    Consumed tokens leave a stale heap entry that is skipped when it surfaces.
+    `performs_io` tells the web layer whether `put`/`cleanup` should be moved off
+    the event loop.
+    """
+
+    performs_io: ClassVar[bool] = False
+
+    def __init__(self, *, ttl_s: float, suffix: str = ".yaml") -> None:
+        self.ttl_s = ttl_s
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self._items: dict[str, OneTimeDownload] = {}
+        self._expiry: list[tuple[float, str]] = []
+        self._outstanding_bytes = 0
+        self._reclaimed = 0
+        self._reclaimed_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def reserve_token(self) -> str:
+        for _ in range(24):
+            token = generate_short_token(10)
+            if token in self._items or not self._token_available(token):
+                continue
+            return token
+        raise RuntimeError("failed to reserve one-time download slot")
+
+    def put(
+        self,
+        token: str,
+        data: bytes,
+        *,
+        variants: Mapping[str, bytes] | None = None,
+        now: float | None = None,
+    ) -> OneTimeDownload:
+        item = self._store(token, data, variants or {}, created_at=time.time() if now is None else now)
+        with self._lock:
+            self._items[token] = item
+            heapq.heappush(self._expiry, (item.created_at, token))
+            self._outstanding_bytes += item.size
+        return item
+
+    def take(self, token: str, *, now: float | None = None) -> OneTimeDownload | None:
+        """Atomically remove and return the entry for `token`, or None if missing/expired."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            item = self._items.pop(token, None)
+            if item is not None:
+                self._outstanding_bytes -= item.size
+        if item is None:
+            return None
+        if now - item.created_at > self.ttl_s:
+            self._reclaim([item])
+            return None
+        if not self._is_available(item):
+            return None
+        return item
+
+    def release(self, item: OneTimeDownload) -> None:
+        """Free whatever backs `item` once it has been served."""
+
+    def cleanup(self, *, now: float | None = None) -> int:
+        """Drop expired entries; costs O(log n) per expired heap entry."""
+        if now is None:
+            now = time.time()
+        stale_items: list[OneTimeDownload] = []
+        with self._lock:
+            while self._expiry and now - self._expiry[0][0] > self.ttl_s:
+                created_at, token = heapq.heappop(self._expiry)
+                item = self._items.get(token)
+                if item is None or item.created_at != created_at:
+                    continue
+                del self._items[token]
+                self._outstanding_bytes -= item.size
+                stale_items.append(item)
+        self._reclaim(stale_items)
+        return len(stale_items)
+
+    def stats(self) -> DownloadStoreStats:
+        with self._lock:
+            return DownloadStoreStats(
+                outstanding=len(self._items),
+                outstanding_bytes=self._outstanding_bytes,
+                reclaimed=self._reclaimed,
+                reclaimed_bytes=self._reclaimed_bytes,
+            )
+
+    def _reclaim(self, items: list[OneTimeDownload]) -> None:
+        for item in items:
+            self.release(item)
+        with self._lock:
+            self._reclaimed += len(items)
+            self._reclaimed_bytes += sum(item.size for item in items)
+
+    def _token_available(self, token: str) -> bool:
+        return True
+
+    def _is_available(self, item: OneTimeDownload) -> bool:
+        return True
+
+    @abstractmethod
+    def _store(self, token: str, data: bytes, variants: Mapping[str, bytes], *, created_at: float) -> OneTimeDownload:
+        raise NotImplementedError
+
+
+class MemoryDownloadStore(OneTimeDownloadStore):
+    """Keeps rendered configs as bytes in memory, up to `max_bytes` in total."""
+
+    def __init__(self, *, ttl_s: float, max_bytes: int = DEFAULT_MEMORY_MAX_BYTES, suffix: str = ".yaml") -> None:
+        super().__init__(ttl_s=ttl_s, suffix=suffix)
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be > 0")
+        self.max_bytes = max_bytes
+
+    def put(
+        self,
+        token: str,
+        data: bytes,
+        *,
+        variants: Mapping[str, bytes] | None = None,
+        now: float | None = None,
+    ) -> OneTimeDownload:
+        size = _stored_size(data, variants)
+        if size + self._outstanding_bytes > self.max_bytes:
+            self.cleanup(now=now)
+            if size + self._outstanding_bytes > self.max_bytes:
+                raise DownloadStoreFull("one-time download store is full")
+        return super().put(token, data, variants=variants, now=now)
+
+    def _store(self, token: str, data: bytes, variants: Mapping[str, bytes], *, created_at: float) -> OneTimeDownload:
+        return OneTimeDownload(
+            token=token,
+            created_at=created_at,
+            size=_stored_size(data, variants),
+            data=data,
+            variants=dict(variants),
+        )
+
+
+class FileDownloadStore(OneTimeDownloadStore):
+    """Writes rendered configs to `temp_dir`; the file is unlinked once served or expired."""
+
+    performs_io = True
+
+    def __init__(self, *, ttl_s: float, temp_dir: Path, suffix: str = ".yaml") -> None:
+        super().__init__(ttl_s=ttl_s, suffix=suffix)
+        self.temp_dir = temp_dir
+
+    def path_for(self, token: str) -> Path:
+        return self.temp_dir / f"{token}{self.suffix}"
+
+    def release(self, item: OneTimeDownload) -> None:
+        for variant in item.variants.values():
+            if isinstance(variant, Path):
+                variant.unlink(missing_ok=True)
+        if item.path is not None:
+            item.path.unlink(missing_ok=True)
+
+    def _token_available(self, token: str) -> bool:
+        return not self.path_for(token).exists()
+
+    def _is_available(self, item: OneTimeDownload) -> bool:
+        return item.path is not None and item.path.exists()
+
+    def _store(self, token: str, data: bytes, variants: Mapping[str, bytes], *, created_at: float) -> OneTimeDownload:
+        path = self.path_for(token)
+        variant_paths = {
+            encoding: write_bytes_atomic(body, path.with_name(path.name + _VARIANT_SUFFIXES[encoding]))
+            for encoding, body in variants.items()
+        }
+        write_bytes_atomic(data, path)
+        return OneTimeDownload(
+            token=token,
+            created_at=created_at,
+            size=_stored_size(data, variants),
+            path=path,
+            variants=variant_paths,
+        )
+
+
+class SqliteDownloadStore(OneTimeDownloadStore):
+    """Shares the registry between processes through a SQLite database in WAL mode.
+
+    Every uvicorn worker opens the same database file, so a token minted by one
+    worker can be consumed by any other. `take` selects and deletes the row inside
+    a `BEGIN IMMEDIATE` transaction, which keeps consume-once atomic across processes;
+    expiry is a range delete on the indexed `created_at` column.
+    """
+
+    performs_io = True
+
+    def __init__(self, *, ttl_s: float, db_path: Path, suffix: str = ".yaml", busy_timeout_s: float = 5.0) -> None:
+        super().__init__(ttl_s=ttl_s, suffix=suffix)
+        self.db_path = db_path
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            db_path,
+            timeout=busy_timeout_s,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS one_time_downloads ("
+                "token TEXT PRIMARY KEY, created_at REAL NOT NULL, size INTEGER NOT NULL, data BLOB NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS one_time_downloads_created_at ON one_time_downloads (created_at)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS one_time_download_variants ("
+                "token TEXT NOT NULL, encoding TEXT NOT NULL, data BLOB NOT NULL, PRIMARY KEY (token, encoding))"
+            )
+
+    def __len__(self) -> int:
+        return self.stats().outstanding
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def put(
+        self,
+        token: str,
+        data: bytes,
+        *,
+        variants: Mapping[str, bytes] | None = None,
+        now: float | None = None,
+    ) -> OneTimeDownload:
+        item = self._store(token, data, variants or {}, created_at=time.time() if now is None else now)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO one_time_downloads (token, created_at, size, data) VALUES (?, ?, ?, ?)",
+                    (token, item.created_at, item.size, sqlite3.Binary(data)),
+                )
+                self._conn.executemany(
+                    "INSERT INTO one_time_download_variants (token, encoding, data) VALUES (?, ?, ?)",
+                    [(token, encoding, sqlite3.Binary(body)) for encoding, body in (variants or {}).items()],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return item
+
+    def take(self, token: str, *, now: float | None = None) -> OneTimeDownload | None:
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT created_at, data FROM one_time_downloads WHERE token = ?",
+                    (token,),
+                ).fetchone()
+                variant_rows: list[tuple[str, bytes]] = []
+                if row is not None:
+                    variant_rows = self._conn.execute(
+                        "SELECT encoding, data FROM one_time_download_variants WHERE token = ?",
+                        (token,),
+                    ).fetchall()
+                    self._conn.execute("DELETE FROM one_time_downloads WHERE token = ?", (token,))
+                    self._conn.execute("DELETE FROM one_time_download_variants WHERE token = ?", (token,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        created_at, data = row
+        variants = {encoding: bytes(body) for encoding, body in variant_rows}
+        item = self._store(token, bytes(data), variants, created_at=created_at)
+        if now - created_at > self.ttl_s:
+            self._reclaim([item])
+            return None
+        return item
+
+    def cleanup(self, *, now: float | None = None) -> int:
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                count, size = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM one_time_downloads WHERE created_at < ?",
+                    (now - self.ttl_s,),
+                ).fetchone()
+                if count:
+                    self._conn.execute(
+                        "DELETE FROM one_time_download_variants WHERE token IN "
+                        "(SELECT token FROM one_time_downloads WHERE created_at < ?)",
+                        (now - self.ttl_s,),
+                    )
+                    self._conn.execute("DELETE FROM one_time_downloads WHERE created_at < ?", (now - self.ttl_s,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._reclaimed += count
+            self._reclaimed_bytes += size
+        return count
+
+    def stats(self) -> DownloadStoreStats:
+        with self._lock:
+            count, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM one_time_downloads"
+            ).fetchone()
+            return DownloadStoreStats(
+                outstanding=count,
+                outstanding_bytes=size,
+                reclaimed=self._reclaimed,
+                reclaimed_bytes=self._reclaimed_bytes,
+            )
+
+    def _token_available(self, token: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM one_time_downloads WHERE token = ?", (token,)).fetchone()
+        return row is None
+
+    def _store(self, token: str, data: bytes, variants: Mapping[str, bytes], *, created_at: float) -> OneTimeDownload:
+        return OneTimeDownload(
+            token=token,
+            created_at=created_at,
+            size=_stored_size(data, variants),
+            data=data,
+            variants=dict(variants),
+        )
+
+
+def _stored_size(data: bytes, variants: Mapping[str, bytes] | None) -> int:
+    return len(data) + sum(len(body) for body in (variants or {}).values())
+
+
+def create_download_store_from_env(*, ttl_s: float, temp_dir: Path) -> OneTimeDownloadStore:
+    kind = env_choice(DOWNLOAD_STORE_ENV, "file", DOWNLOAD_STORES)
+    if kind == "memory":
+        max_bytes = env_int(DOWNLOAD_MEMORY_MAX_BYTES_ENV, DEFAULT_MEMORY_MAX_BYTES)
+        return MemoryDownloadStore(ttl_s=ttl_s, max_bytes=max_bytes)
+    if kind == "sqlite":
+        raw_db_path = os.getenv(DOWNLOAD_SQLITE_PATH_ENV, "").strip()
+        db_path = Path(raw_db_path) if raw_db_path else DEFAULT_SQLITE_PATH
+        return SqliteDownloadStore(ttl_s=ttl_s, db_path=db_path)
+    return FileDownloadStore(ttl_s=ttl_s, temp_dir=temp_dir)
+
+
+async def run_reaper(store: OneTimeDownloadStore, *, interval_s: float = DEFAULT_REAP_INTERVAL_S) -> None:
+    """Periodically expire stale entries so request handlers don't have to."""
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            if store.performs_io:
+                await asyncio.to_thread(reap_once, store)
+            else:
+                reap_once(store)
+        except Exception:
+            logger.exception("one-time download reaper failed")
+
+
+def reap_once(store: OneTimeDownloadStore) -> None:
+    """Expire stale entries and add what this pass reclaimed to the reaper metrics."""
+    before = store.stats()
+    store.cleanup()
+    after = store.stats()
+    DOWNLOADS_RECLAIMED.inc(amount=after.reclaimed - before.reclaimed)
+    DOWNLOAD_RECLAIMED_BYTES.inc(amount=after.reclaimed_bytes - before.reclaimed_bytes)
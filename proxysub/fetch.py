@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import http.client
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Generic, TypeVar
+from urllib.parse import urljoin, urlsplit
+
+USER_AGENT = "proxysub/0.1"
+_REDIRECT_STATUSES = frozenset({301, 302, 303, 307, 308})
+_MAX_REDIRECTS = 5
+
+T = TypeVar("T")
+
+
+class FetchError(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class HttpResponse:
+    url: str
+    status: int
+    headers: dict[str, str]
+    body: bytes
+
+
+@dataclass(frozen=True)
+class FetchResult(Generic[T]):
+    url: str
+    value: T | None = None
+    error: str | None = None
+
+
+_HostKey = tuple[str, str, int]
+
+
+class HttpConnectionPool:
+    """Keep-alive `http.client` connections, reused per (scheme, host, port).
+
+    Connections are checked out by one thread at a time; at most `max_idle_per_host`
+    idle connections are kept for each host.
+    """
+
+    def __init__(self, *, max_idle_per_host: int = 4) -> None:
+        self.max_idle_per_host = max_idle_per_host
+        self._idle: dict[_HostKey, list[http.client.HTTPConnection]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def request(
+        self,
+        url: str,
+        *,
+        headers: dict[str, str] | None = None,
+        timeout_s: float,
+    ) -> HttpResponse:
+        """GET `url`, following redirects; the full body is read before returning."""
+        for _ in range(_MAX_REDIRECTS + 1):
+            response = self._request_once(url, headers=headers or {}, timeout_s=timeout_s)
+            location = response.headers.get("location")
+            if response.status not in _REDIRECT_STATUSES or not location:
+                return response
+            url = urljoin(url, location)
+        raise FetchError(f"too many redirects for {url}")
+
+    def close(self) -> None:
+        with self._lock:
+            idle = [conn for conns in self._idle.values() for conn in conns]
+            self._idle.clear()
+        for conn in idle:
+            conn.close()
+
+    def _request_once(self, url: str, *, headers: dict[str, str], timeout_s: float) -> HttpResponse:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise FetchError(f"unsupported url: {url}")
+        key: _HostKey = (
+            parts.scheme,
+            parts.hostname,
+            parts.port or (443 if parts.scheme == "https" else 80),
+        )
+        target = parts.path or "/"
+        if parts.query:
+            target = f"{target}?{parts.query}"
+        request_headers = {
+            "User-Agent": USER_AGENT,
+            "Accept": "application/yaml,text/yaml,text/plain,*/*",
+            "Connection": "keep-alive",
+            **headers,
+        }
+
+        conn, reused = self._checkout(key, timeout_s=timeout_s)
+        try:
+            try:
+                conn.request("GET", target, headers=request_headers)
+                resp = conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                if not reused:
+                    raise
+                # The server closed an idle keep-alive connection; retry once on a fresh one.
+                conn.close()
+                conn = self._connect(key, timeout_s=timeout_s)
+                conn.request("GET", target, headers=request_headers)
+                resp = conn.getresponse()
+            body = resp.read()
+        except BaseException:
+            conn.close()
+            raise
+
+        response = HttpResponse(
+            url=url,
+            status=resp.status,
+            headers={name.lower(): value for name, value in resp.getheaders()},
+            body=body,
+        )
+        if resp.will_close:
+            conn.close()
+        else:
+            self._checkin(key, conn)
+        return response
+
+    def _checkout(self, key: _HostKey, *, timeout_s: float) -> tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        if conn is None:
+            return self._connect(key, timeout_s=timeout_s), False
+        conn.timeout = timeout_s
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout_s)
+        return conn, True
+
+    def _checkin(self, key: _HostKey, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            idle = self._idle[key]
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    @staticmethod
+    def _connect(key: _HostKey, *, timeout_s: float) -> http.client.HTTPConnection:
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=timeout_s)
+        return http.client.HTTPConnection(host, port, timeout=timeout_s)
+
+
+def fetch_concurrently(
+    urls: list[str],
+    handler: Callable[[HttpConnectionPool, str, float], T],
+    *,
+    max_concurrency: int = 8,
+    per_host_concurrency: int = 2,
+    timeout_s: float = 25,
+    deadline_s: float | None = None,
+    pool: HttpConnectionPool | None = None,
+) -> list[FetchResult[T]]:
+    """Run `handler(pool, url, timeout_s)` for every url on a bounded thread pool.
+
+    At most `max_concurrency` requests run at once and at most `per_host_concurrency`
+    against any single host: each host has its own queue, and a url is only handed
+    to the thread pool once its host has a free slot, so a slow host never holds
+    threads that other hosts could use. `deadline_s` bounds the whole call: requests
+    still pending when it passes are reported as errors. Results are in input order.
+    """
+    if max_concurrency <= 0 or per_host_concurrency <= 0:
+        raise ValueError("concurrency limits must be > 0")
+    if not urls:
+        return []
+
+    owns_pool = pool is None
+    http_pool = pool if pool is not None else HttpConnectionPool(max_idle_per_host=per_host_concurrency)
+    deadline = time.monotonic() + deadline_s if deadline_s is not None else None
+    host_queues: dict[str, deque[int]] = defaultdict(deque)
+    for idx, url in enumerate(urls):
+        host_queues[_host_of(url)].append(idx)
+
+    def remaining() -> float:
+        return timeout_s if deadline is None else min(timeout_s, deadline - time.monotonic())
+
+    def run(url: str) -> T:
+        budget = remaining()
+        if budget <= 0:
+            raise TimeoutError("deadline exceeded")
+        return handler(http_pool, url, budget)
+
+    executor = ThreadPoolExecutor(max_workers=min(max_concurrency, len(urls)), thread_name_prefix="proxysub-fetch")
+    futures: dict[int, Future[T]] = {}
+    future_hosts: dict[Future[T], str] = {}
+
+    pending: set[Future[T]] = set()
+
+    def submit_next(host: str) -> None:
+        queue = host_queues[host]
+        if queue:
+            idx = queue.popleft()
+            future = futures[idx] = executor.submit(run, urls[idx])
+            future_hosts[future] = host
+            pending.add(future)
+
+    try:
+        for host in list(host_queues):
+            for _ in range(per_host_concurrency):
+                submit_next(host)
+        while pending:
+            wait_s = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, _ = wait(pending, timeout=wait_s, return_when=FIRST_COMPLETED)
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            for future in done:
+                pending.discard(future)
+                submit_next(future_hosts[future])
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    results: list[FetchResult[T]] = []
+    for idx, url in enumerate(urls):
+        future = futures.get(idx)
+        if future is None or future.cancelled() or not future.done():
+            if future is not None:
+                future.cancel()
+            results.append(FetchResult(url=url, error="deadline exceeded"))
+            continue
+        exc = future.exception()
+        if exc is not None:
+            results.append(FetchResult(url=url, error=str(exc) or type(exc).__name__))
+        else:
+            results.append(FetchResult(url=url, value=future.result()))
+
+    if owns_pool:
+        http_pool.close()
+    return results
+
+
+def _host_of(url: str) -> str:
+    return (urlsplit(url.strip()).hostname or "").lower()
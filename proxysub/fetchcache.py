@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO
+
+from proxysub.yamlio import write_bytes_atomic
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class CachedSubscription:
+    url: str
+    fetched_at: float
+    etag: str | None
+    last_modified: str | None
+    body_path: Path
+    # Parsed proxy list, or None when it could not be stored as JSON.
+    proxies: list[dict[str, Any]] | None
+
+    def conditional_headers(self) -> dict[str, str]:
+        headers: dict[str, str] = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def open_body(self) -> BinaryIO:
+        return self.body_path.open("rb")
+
+
+class SubscriptionCache:
+    """On-disk cache of subscription bodies keyed by URL, for conditional GETs.
+
+    Each entry is `<sha256(url)>.body` plus `<sha256(url)>.json` holding the
+    validators (ETag / Last-Modified), the fetch time and the parsed proxy list.
+    Entries younger than `max_age_s` are served without touching the network.
+    When the bodies exceed `max_bytes`, the least recently validated entries are evicted;
+    body sizes are tracked in memory, so the directory is only scanned on first use.
+    """
+
+    def __init__(self, directory: Path, *, max_age_s: float = 0, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be > 0")
+        self.directory = directory
+        self.max_age_s = max_age_s
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # sha256(url) -> body size, least recently validated first; None until first use.
+        self._sizes: OrderedDict[str, int] | None = None
+        self._total_bytes = 0
+
+    def get(self, url: str) -> CachedSubscription | None:
+        meta_path, body_path = self._paths(url)
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url or not body_path.exists():
+            return None
+        return CachedSubscription(
+            url=url,
+            fetched_at=float(meta.get("fetched_at") or 0),
+            etag=meta.get("etag"),
+            last_modified=meta.get("last_modified"),
+            body_path=body_path,
+            proxies=meta.get("proxies"),
+        )
+
+    def is_fresh(self, entry: CachedSubscription, *, now: float | None = None) -> bool:
+        if self.max_age_s <= 0:
+            return False
+        if now is None:
+            now = time.time()
+        return now - entry.fetched_at < self.max_age_s
+
+    def put(
+        self,
+        url: str,
+        *,
+        body: bytes,
+        headers: dict[str, str],
+        proxies: list[dict[str, Any]] | None,
+        now: float | None = None,
+    ) -> None:
+        if len(body) > self.max_bytes:
+            return
+        meta_path, body_path = self._paths(url)
+        write_bytes_atomic(body, body_path)
+        self._write_meta(
+            meta_path,
+            url=url,
+            fetched_at=time.time() if now is None else now,
+            etag=headers.get("etag"),
+            last_modified=headers.get("last-modified"),
+            proxies=proxies,
+        )
+        self._record(body_path.stem, len(body))
+
+    def refresh(self, entry: CachedSubscription, *, headers: dict[str, str], now: float | None = None) -> None:
+        """Record a 304 for `entry`: bump its fetch time and adopt any updated validators."""
+        meta_path, _ = self._paths(entry.url)
+        self._write_meta(
+            meta_path,
+            url=entry.url,
+            fetched_at=time.time() if now is None else now,
+            etag=headers.get("etag") or entry.etag,
+            last_modified=headers.get("last-modified") or entry.last_modified,
+            proxies=entry.proxies,
+        )
+        with self._lock:
+            sizes = self._load_sizes()
+            if meta_path.stem in sizes:
+                sizes.move_to_end(meta_path.stem)
+
+    def _write_meta(self, meta_path: Path, *, proxies: list[dict[str, Any]] | None, **fields: Any) -> None:
+        try:
+            payload = json.dumps({**fields, "proxies": proxies}, ensure_ascii=False)
+            round_trips = json.loads(payload)["proxies"] == proxies
+        except (TypeError, ValueError):
+            round_trips = False
+        if not round_trips:
+            # Proxies that JSON cannot represent faithfully (timestamps, non-str keys)
+            # are re-parsed from the cached body instead.
+            payload = json.dumps({**fields, "proxies": None}, ensure_ascii=False)
+        write_bytes_atomic(payload.encode("utf-8"), meta_path)
+
+    def _record(self, key: str, size: int) -> None:
+        with self._lock:
+            sizes = self._load_sizes()
+            self._total_bytes += size - sizes.pop(key, 0)
+            sizes[key] = size
+            while self._total_bytes > self.max_bytes:
+                old_key, old_size = sizes.popitem(last=False)
+                (self.directory / f"{old_key}.json").unlink(missing_ok=True)
+                (self.directory / f"{old_key}.body").unlink(missing_ok=True)
+                self._total_bytes -= old_size
+
+    def _load_sizes(self) -> OrderedDict[str, int]:
+        """The size index, built from the directory the first time it is needed (lock held)."""
+        if self._sizes is not None:
+            return self._sizes
+        bodies = []
+        for body_path in self.directory.glob("*.body"):
+            try:
+                stat = body_path.stat()
+            except OSError:
+                continue
+            try:
+                used_at = body_path.with_suffix(".json").stat().st_mtime
+            except OSError:
+                used_at = stat.st_mtime
+            bodies.append((used_at, body_path.stem, stat.st_size))
+        bodies.sort()
+        self._sizes = OrderedDict((key, size) for _, key, size in bodies)
+        self._total_bytes = sum(self._sizes.values())
+        return self._sizes
+
+    def _paths(self, url: str) -> tuple[Path, Path]:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return self.directory / f"{key}.json", self.directory / f"{key}.body"
+
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Hashable
+
+from proxysub.compression import compress_variants
+
+
+@dataclass(frozen=True)
+class CachedAsset:
+    body: bytes
+    etag: str
+    media_type: str
+    # Content-Encoding -> precompressed body.
+    variants: dict[str, bytes] = field(default_factory=dict)
+
+    def etag_for(self, encoding: str | None) -> str:
+        """Strong ETags must differ per content-coding: `"<hash>-gzip"` for the gzip variant."""
+        return self.etag if encoding is None else f'{self.etag[:-1]}-{encoding}"'
+
+
+def make_asset(body: bytes, *, media_type: str, compress: bool = False) -> CachedAsset:
+    """Wrap `body` with a strong ETag derived from its content, and precompress it when `compress` is set."""
+    return CachedAsset(
+        body=body,
+        etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+        media_type=media_type,
+        variants=compress_variants(body) if compress else {},
+    )
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Evaluate an If-None-Match header against `etag` (weak comparison, per RFC 9110)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+
+class KeyedAssetCache:
+    """Holds a single rendered asset, rebuilt whenever `key()` changes."""
+
+    def __init__(self, key: Callable[[], Hashable], build: Callable[[], CachedAsset]) -> None:
+        self._key = key
+        self._build = build
+        self._lock = threading.Lock()
+        self._cached: tuple[Hashable, CachedAsset] | None = None
+
+    def get(self) -> CachedAsset:
+        key = self._key()
+        cached = self._cached
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        with self._lock:
+            cached = self._cached
+            if cached is not None and cached[0] == key:
+                return cached[1]
+            asset = self._build()
+            self._cached = (key, asset)
+            return asset
+
+
+def file_version(path: Path) -> tuple[int, int] | None:
+    """(mtime_ns, size) of `path`, or None if it cannot be stat'ed."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
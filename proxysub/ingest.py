@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from proxysub.env import env_int
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header  # type: ignore[no-redef]
+
+UPLOAD_MAX_BYTES_ENV = "PROXYSUB_UPLOAD_MAX_BYTES"
+UPLOAD_MAX_NODES_ENV = "PROXYSUB_UPLOAD_MAX_NODES"
+UPLOAD_MAX_DEPTH_ENV = "PROXYSUB_UPLOAD_MAX_DEPTH"
+DEFAULT_UPLOAD_MAX_BYTES = 1024 * 1024
+DEFAULT_UPLOAD_MAX_NODES = 200_000
+DEFAULT_UPLOAD_MAX_DEPTH = 64
+
+
+class UploadTooLarge(ValueError):
+    """The request body exceeds the configured byte cap (HTTP 413)."""
+
+
+class UploadInvalid(ValueError):
+    """The request is not a usable multipart upload (HTTP 400)."""
+
+
+@dataclass(frozen=True)
+class UploadLimits:
+    max_bytes: int = DEFAULT_UPLOAD_MAX_BYTES
+    max_nodes: int = DEFAULT_UPLOAD_MAX_NODES
+    max_depth: int = DEFAULT_UPLOAD_MAX_DEPTH
+
+    @classmethod
+    def from_env(cls) -> UploadLimits:
+        return cls(
+            max_bytes=env_int(UPLOAD_MAX_BYTES_ENV, DEFAULT_UPLOAD_MAX_BYTES),
+            max_nodes=env_int(UPLOAD_MAX_NODES_ENV, DEFAULT_UPLOAD_MAX_NODES),
+            max_depth=env_int(UPLOAD_MAX_DEPTH_ENV, DEFAULT_UPLOAD_MAX_DEPTH),
+        )
+
+
+async def read_multipart_file(
+    chunks: AsyncIterator[bytes],
+    *,
+    content_type: str,
+    content_length: str | None,
+    field_name: str,
+    max_bytes: int,
+) -> bytes:
+    """Stream a multipart/form-data body and return the content of file field `field_name`.
+
+    The body is consumed chunk by chunk and rejected with `UploadTooLarge` as soon
+    as it passes `max_bytes`, so at most `max_bytes` of file data is ever buffered.
+    """
+    if content_length is not None and content_length.strip().isdigit() and int(content_length) > max_bytes:
+        raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+
+    mime_type, params = parse_options_header(content_type)
+    boundary = params.get(b"boundary")
+    if mime_type != b"multipart/form-data" or not boundary:
+        raise UploadInvalid("expected a multipart/form-data upload")
+
+    header_field = bytearray()
+    header_value = bytearray()
+    part_name: bytes | None = None
+    part_is_target = False
+    found = False
+    complete = False
+    data = bytearray()
+
+    def on_part_begin() -> None:
+        nonlocal part_name, part_is_target
+        part_name = None
+        part_is_target = False
+
+    def on_header_field(buf: bytes, start: int, end: int) -> None:
+        header_field.extend(buf[start:end])
+
+    def on_header_value(buf: bytes, start: int, end: int) -> None:
+        header_value.extend(buf[start:end])
+
+    def on_header_end() -> None:
+        nonlocal part_name
+        if bytes(header_field).lower() == b"content-disposition":
+            _, options = parse_options_header(bytes(header_value))
+            part_name = options.get(b"name")
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished() -> None:
+        nonlocal part_is_target, found
+        part_is_target = not found and part_name == field_name.encode()
+        found = found or part_is_target
+
+    def on_part_data(buf: bytes, start: int, end: int) -> None:
+        if part_is_target:
+            data.extend(buf[start:end])
+
+    def on_end() -> None:
+        nonlocal complete
+        complete = True
+
+    parser = MultipartParser(
+        boundary,
+        {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_end": on_end,
+        },
+    )
+
+    received = 0
+    async for chunk in chunks:
+        received += len(chunk)
+        if received > max_bytes:
+            raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+        try:
+            parser.write(chunk)
+        except Exception as exc:
+            raise UploadInvalid(f"malformed multipart body: {exc}") from exc
+    try:
+        parser.finalize()
+    except Exception as exc:
+        raise UploadInvalid(f"malformed multipart body: {exc}") from exc
+    if not complete:
+        raise UploadInvalid("truncated multipart body")
+
+    if not found:
+        raise UploadInvalid(f"missing file field {field_name!r}")
+    return bytes(data)
+
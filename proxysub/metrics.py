@@ -0,0 +1,250 @@
+"""In-process metrics in the Prometheus text format, without extra dependencies.
+
+Recording is a couple of `perf_counter` calls and a locked increment; gauges are
+callbacks evaluated only when `/metrics` is scraped. Stage timings taken in a
+build-pool worker are collected with `call_collecting_stages` and observed by the
+parent, so process pools report them too.
+"""
+
+from __future__ import annotations
+
+import bisect
+import contextvars
+import math
+import threading
+import time
+from typing import Any, Callable, Iterable, TypeVar
+
+from proxysub.env import env_choice
+
+METRICS_ENV = "PROXYSUB_METRICS"
+METRICS_ENABLED = env_choice(METRICS_ENV, "on", ("on", "off")) == "on"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers sub-millisecond parses up to multi-second builds.
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+T = TypeVar("T")
+StageTimings = list[tuple[str, float]]
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0.0)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            yield f"{self.name}{_labels(self.labelnames, labelvalues)} {_number(value)}"
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = STAGE_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # labelvalues -> [per-bucket counts (last one is +Inf), sum, count]
+        self._series: dict[tuple[str, ...], list[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][slot] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labelvalues: str) -> int:
+        series = self._series.get(labelvalues)
+        return 0 if series is None else series[2]
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._series.items())
+        for labelvalues, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, math.inf), counts):
+                cumulative += bucket_count
+                labels = _labels((*self.labelnames, "le"), (*labelvalues, _number(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {_number(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class CallbackGauge:
+    """A gauge whose value is read from `fn` at scrape time."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]) -> None:
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {_number(self.fn())}"
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, Counter | Histogram | CallbackGauge] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = STAGE_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float]) -> CallbackGauge:
+        """Register (or replace) a callback gauge."""
+        gauge = CallbackGauge(name, help, fn)
+        with self._lock:
+            self._metrics[name] = gauge
+        return gauge
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: list[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric: Any) -> Any:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name!r} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "proxysub_stage_duration_seconds",
+    "Time spent in each build stage (successful runs only); apply_subs includes profile_script.",
+    labelnames=("stage",),
+)
+REQUESTS = REGISTRY.counter("proxysub_requests_total", "Requests handled, by endpoint.", labelnames=("endpoint",))
+REQUEST_ERRORS = REGISTRY.counter(
+    "proxysub_request_errors_total",
+    "Requests answered with an error, by endpoint and HTTP status.",
+    labelnames=("endpoint", "status"),
+)
+DOWNLOADS_RECLAIMED = REGISTRY.counter(
+    "proxysub_download_reclaimed_total", "Expired one-time downloads reclaimed by the reaper."
+)
+DOWNLOAD_RECLAIMED_BYTES = REGISTRY.counter(
+    "proxysub_download_reclaimed_bytes_total", "Bytes of expired one-time downloads reclaimed by the reaper."
+)
+
+# Set while `call_collecting_stages` runs: timings go to this list instead of `STAGE_SECONDS`.
+_PENDING_STAGES: contextvars.ContextVar[StageTimings | None] = contextvars.ContextVar("proxysub_stages", default=None)
+
+
+class _StageTimer:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage: str) -> None:
+        self.stage = stage
+        self.started = 0.0
+
+    def __enter__(self) -> None:
+        self.started = time.perf_counter()
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        if exc_type is None:
+            record_stage(self.stage, time.perf_counter() - self.started)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        return None
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed_stage(stage: str) -> _StageTimer | _NullTimer:
+    """Context manager recording how long the block took as `stage`."""
+    return _StageTimer(stage) if METRICS_ENABLED else _NULL_TIMER
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    pending = _PENDING_STAGES.get()
+    if pending is not None:
+        pending.append((stage, seconds))
+    elif METRICS_ENABLED:
+        STAGE_SECONDS.observe(seconds, stage)
+
+
+def call_collecting_stages(fn: Callable[..., T], *args: Any) -> tuple[T, StageTimings]:
+    """Run `fn(*args)` and return its result with the stage timings it recorded; runs in a pool worker."""
+    pending: StageTimings = []
+    token = _PENDING_STAGES.set(pending)
+    try:
+        return fn(*args), pending
+    finally:
+        _PENDING_STAGES.reset(token)
+
+
+def observe_stages(timings: StageTimings) -> None:
+    for stage, seconds in timings:
+        STAGE_SECONDS.observe(seconds, stage)
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
@@ -0,0 +1,346 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import os
+import zipfile
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, TypeVar
+
+import yaml
+
+from proxysub.builder import (
+    load_template_doc,
+    render_settings,
+    render_yaml_batch,
+    render_yaml_from_doc,
+    template_version,
+)
+from proxysub.cache import LruBytesCache, LruCacheStats
+from proxysub.compression import compress_variants, enabled_encodings
+from proxysub.env import env_choice, env_int
+from proxysub.ingest import UploadLimits
+from proxysub.metrics import METRICS_ENABLED, call_collecting_stages, observe_stages, timed_stage
+from proxysub.yamlio import (
+    YamlDocument,
+    fingerprint_yaml_tree,
+    load_yaml_documents_limited,
+    load_yaml_limited,
+    split_yaml_documents,
+)
+
+BUILD_EXECUTOR_ENV = "PROXYSUB_BUILD_EXECUTOR"
+BUILD_WORKERS_ENV = "PROXYSUB_BUILD_WORKERS"
+BUILD_QUEUE_LIMIT_ENV = "PROXYSUB_BUILD_QUEUE_LIMIT"
+BUILD_EXECUTORS = ("thread", "process")
+DEFAULT_BUILD_QUEUE_LIMIT = 32
+RENDER_MODE_ENV = "PROXYSUB_RENDER_MODE"
+RENDER_MODES = ("splice", "full")
+BATCH_MAX_ITEMS_ENV = "PROXYSUB_BATCH_MAX_ITEMS"
+DEFAULT_BATCH_MAX_ITEMS = 100
+OUTPUT_CACHE_MAX_ENTRIES_ENV = "PROXYSUB_OUTPUT_CACHE_MAX_ENTRIES"
+OUTPUT_CACHE_MAX_BYTES_ENV = "PROXYSUB_OUTPUT_CACHE_MAX_BYTES"
+DEFAULT_OUTPUT_CACHE_MAX_ENTRIES = 256
+DEFAULT_OUTPUT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+T = TypeVar("T")
+
+
+class BuildPoolBusy(RuntimeError):
+    """Raised when the build queue is full; the caller should shed load (HTTP 503)."""
+
+
+class BuildPool:
+    """Bounded executor for the CPU-bound upload build stage.
+
+    At most `workers` builds run at once and at most `queue_limit` more may wait;
+    further submissions fail fast with `BuildPoolBusy`. `queue_limit <= 0` means
+    the queue is unbounded.
+    """
+
+    def __init__(
+        self,
+        *,
+        template_path: Path,
+        workers: int,
+        kind: str = "thread",
+        queue_limit: int = DEFAULT_BUILD_QUEUE_LIMIT,
+    ) -> None:
+        if kind not in BUILD_EXECUTORS:
+            raise ValueError(f"Unknown build executor {kind!r}, expected one of {', '.join(BUILD_EXECUTORS)}")
+        if workers <= 0:
+            raise ValueError("workers must be > 0")
+        self.template_path = template_path
+        self.workers = workers
+        self.kind = kind
+        self.queue_limit = queue_limit
+        self._executor: Executor | None = None
+        self._in_flight = 0
+
+    @classmethod
+    def from_env(cls, *, template_path: Path) -> BuildPool:
+        return cls(
+            template_path=template_path,
+            workers=env_int(BUILD_WORKERS_ENV, min(4, os.cpu_count() or 1)),
+            kind=env_choice(BUILD_EXECUTOR_ENV, "thread", BUILD_EXECUTORS),
+            queue_limit=env_int(BUILD_QUEUE_LIMIT_ENV, DEFAULT_BUILD_QUEUE_LIMIT),
+        )
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def start(self) -> None:
+        if self._executor is not None:
+            return
+        executor_cls = ProcessPoolExecutor if self.kind == "process" else ThreadPoolExecutor
+        self._executor = executor_cls(
+            max_workers=self.workers,
+            initializer=warm_worker,
+            initargs=(self.template_path,),
+        )
+
+    async def warm(self) -> None:
+        """Start every worker and wait until each has parsed the template."""
+        self.start()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(self._executor, warm_worker, self.template_path) for _ in range(self.workers))
+        )
+
+    def shutdown(self) -> None:
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        if self._executor is None:
+            self.start()
+        if self.queue_limit > 0 and self._in_flight >= self.workers + self.queue_limit:
+            raise BuildPoolBusy("build queue is full")
+
+        self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            if not METRICS_ENABLED:
+                return await loop.run_in_executor(self._executor, partial(fn, *args))
+            result, timings = await loop.run_in_executor(self._executor, partial(call_collecting_stages, fn, *args))
+            observe_stages(timings)
+            return result
+        finally:
+            self._in_flight -= 1
+
+
+def _render_mode() -> str:
+    return env_choice(RENDER_MODE_ENV, "splice", RENDER_MODES)
+
+
+# (template path, template version, render settings, subs doc fingerprint)
+_OutputKey = tuple[Path, tuple[int, int], tuple[str, ...], str]
+
+
+class _OutputCache:
+    """Rendered configs keyed by template path and version, render settings and subs doc fingerprint.
+
+    Compressed variants of a rendered config live in a second LRU with the same
+    limits, so a hit does not compress again. Lives in each pool worker process;
+    cleared whenever a template version changes.
+    """
+
+    def __init__(self, *, max_entries: int, max_bytes: int) -> None:
+        self._lru = LruBytesCache(max_entries=max_entries, max_bytes=max_bytes)
+        # (key, encodings) -> comma-joined encodings that were kept; (key, encodings, encoding) -> variant.
+        self._variants = LruBytesCache(max_entries=max_entries, max_bytes=max_bytes)
+        self._template_versions: dict[Path, tuple[int, int]] = {}
+
+    def key_for(self, template_path: Path, doc: Any) -> _OutputKey | None:
+        if not self._lru.enabled:
+            return None
+        version = template_version(template_path)
+        if self._template_versions.get(template_path, version) != version:
+            self._lru.clear()
+            self._variants.clear()
+        self._template_versions[template_path] = version
+        return template_path, version, render_settings(), fingerprint_yaml_tree(doc)
+
+    def get(self, key: _OutputKey | None) -> bytes | None:
+        return None if key is None else self._lru.get(key)
+
+    def put(self, key: _OutputKey | None, rendered: bytes) -> None:
+        if key is not None:
+            self._lru.put(key, rendered)
+
+    def get_variants(self, key: _OutputKey | None, encodings: tuple[str, ...]) -> dict[str, bytes] | None:
+        kept = None if key is None else self._variants.get((key, encodings))
+        if kept is None:
+            return None
+        variants: dict[str, bytes] = {}
+        for encoding in filter(None, kept.decode("ascii").split(",")):
+            variant = self._variants.get((key, encodings, encoding))
+            if variant is None:
+                return None
+            variants[encoding] = variant
+        return variants
+
+    def put_variants(self, key: _OutputKey | None, encodings: tuple[str, ...], variants: dict[str, bytes]) -> None:
+        if key is None:
+            return
+        for encoding, variant in variants.items():
+            self._variants.put((key, encodings, encoding), variant)
+        self._variants.put((key, encodings), ",".join(variants).encode("ascii"))
+
+    def stats(self) -> LruCacheStats:
+        return self._lru.stats()
+
+
+_OUTPUT_CACHE = _OutputCache(
+    max_entries=env_int(OUTPUT_CACHE_MAX_ENTRIES_ENV, DEFAULT_OUTPUT_CACHE_MAX_ENTRIES),
+    max_bytes=env_int(OUTPUT_CACHE_MAX_BYTES_ENV, DEFAULT_OUTPUT_CACHE_MAX_BYTES),
+)
+
+
+def output_cache_stats() -> LruCacheStats:
+    return _OUTPUT_CACHE.stats()
+
+
+def warm_worker(template_path: Path) -> None:
+    # Parse the template once per worker so the first upload hits the cache.
+    try:
+        load_template_doc(template_path)
+    except (OSError, ValueError, yaml.YAMLError):
+        pass
+
+
+def render_upload(template_path: Path, raw: bytes, limits: UploadLimits | None = None) -> bytes:
+    """Parse an uploaded subs document and return the rendered config; runs in a pool worker."""
+    return _render_upload_cached(template_path, raw, limits)[1]
+
+
+def _render_upload_cached(
+    template_path: Path, raw: bytes, limits: UploadLimits | None
+) -> tuple[_OutputKey | None, bytes]:
+    if limits is None:
+        limits = UploadLimits()
+    try:
+        with timed_stage("yaml_load"):
+            doc = load_yaml_limited(raw, max_nodes=limits.max_nodes, max_depth=limits.max_depth)
+    except yaml.YAMLError as exc:
+        # YAML errors carry parser marks that do not always pickle across processes.
+        raise ValueError(f"Invalid YAML: {exc}") from None
+
+    cache_key = _OUTPUT_CACHE.key_for(template_path, doc)
+    rendered = _OUTPUT_CACHE.get(cache_key)
+    if rendered is not None:
+        return cache_key, rendered
+
+    rendered = render_yaml_from_doc(
+        template_path=template_path,
+        subs_doc=doc,
+        splice=_render_mode() == "splice",
+    ).encode("utf-8")
+    _OUTPUT_CACHE.put(cache_key, rendered)
+    return cache_key, rendered
+
+
+def render_upload_encoded(
+    template_path: Path, raw: bytes, limits: UploadLimits | None = None
+) -> tuple[bytes, dict[str, bytes]]:
+    """Like `render_upload`, plus the precompressed variants of the result by content-coding."""
+    cache_key, rendered = _render_upload_cached(template_path, raw, limits)
+    encodings = enabled_encodings()
+    variants = _OUTPUT_CACHE.get_variants(cache_key, encodings)
+    if variants is None:
+        with timed_stage("compress"):
+            variants = compress_variants(rendered, encodings)
+        _OUTPUT_CACHE.put_variants(cache_key, encodings, variants)
+    return rendered, variants
+
+
+@dataclass(frozen=True)
+class BatchItem:
+    index: int
+    rendered: bytes | None = None
+    error: str | None = None
+    # Content-Encoding -> precompressed `rendered`; only filled by `render_batch_encoded`.
+    variants: dict[str, bytes] = field(default_factory=dict)
+
+
+def render_batch(template_path: Path, raw: bytes, limits: UploadLimits | None = None) -> list[BatchItem]:
+    """Render every subs document of a batch upload; runs in a pool worker.
+
+    The upload is either a multi-document YAML stream or a single YAML/JSON array
+    of subs documents. Each document is parsed on its own: per-item failures,
+    including YAML errors, are returned, not raised.
+    """
+    if limits is None:
+        limits = UploadLimits()
+    max_items = env_int(BATCH_MAX_ITEMS_ENV, DEFAULT_BATCH_MAX_ITEMS)
+    try:
+        sources = split_yaml_documents(raw)
+    except UnicodeDecodeError as exc:
+        raise ValueError(f"Invalid YAML: {exc}") from None
+    if len(sources) > max_items:
+        raise ValueError(f"batch contains {len(sources)} subs documents, at most {max_items} allowed")
+    with timed_stage("yaml_load"):
+        docs = load_yaml_documents_limited(sources, max_nodes=limits.max_nodes, max_depth=limits.max_depth)
+
+    if len(docs) == 1 and isinstance(docs[0].value, list):
+        docs = [YamlDocument(value=value) for value in docs[0].value]
+    if not docs:
+        raise ValueError("batch contains no subs documents")
+    if len(docs) > max_items:
+        raise ValueError(f"batch contains {len(docs)} subs documents, at most {max_items} allowed")
+
+    parsed = [doc.value for doc in docs if doc.error is None]
+    rendered = iter(
+        render_yaml_batch(
+            template_path=template_path,
+            subs_docs=parsed,
+            splice=_render_mode() == "splice",
+        )
+    )
+    items: list[BatchItem] = []
+    for idx, doc in enumerate(docs):
+        if doc.error is not None:
+            items.append(BatchItem(index=idx, error=f"Invalid YAML: {doc.error}"))
+            continue
+        result = next(rendered)
+        items.append(
+            BatchItem(
+                index=idx,
+                rendered=None if result.text is None else result.text.encode("utf-8"),
+                error=result.error,
+            )
+        )
+    return items
+
+
+def render_batch_encoded(template_path: Path, raw: bytes, limits: UploadLimits | None = None) -> list[BatchItem]:
+    """Like `render_batch`, with the precompressed variants of every rendered item."""
+    items = render_batch(template_path, raw, limits)
+    with timed_stage("compress"):
+        return [
+            item if item.rendered is None else replace(item, variants=compress_variants(item.rendered))
+            for item in items
+        ]
+
+
+def render_batch_zip(template_path: Path, raw: bytes, limits: UploadLimits | None = None) -> bytes:
+    """Like `render_batch`, packed as a zip of `NNN.yaml` files plus `errors.txt` for failed items."""
+    items = render_batch(template_path, raw, limits)
+    width = max(3, len(str(len(items))))
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        errors = []
+        for item in items:
+            name = f"{item.index + 1:0{width}d}.yaml"
+            if item.rendered is not None:
+                archive.writestr(name, item.rendered)
+            else:
+                errors.append(f"{name}: {item.error}")
+        if errors:
+            archive.writestr("errors.txt", "\n".join(errors) + "\n")
+    return buf.getvalue()
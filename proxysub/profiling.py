@@ -0,0 +1,207 @@
+"""Opt-in profiling of single builds with cProfile and tracemalloc.
+
+Disabled unless `PROXYSUB_PROFILE=on`; then a build is profiled when the request
+carries the `X-Proxysub-Profile` header (matching `PROXYSUB_PROFILE_KEY` when one is
+set) or is picked by `PROXYSUB_PROFILE_SAMPLE_RATE`. Each run writes `<id>.prof`
+(pstats), `<id>.txt` (top functions and allocation sites) and `<id>.json` (summary)
+into the profile directory, which keeps only the newest `PROXYSUB_PROFILE_MAX_RUNS`.
+"""
+
+from __future__ import annotations
+
+import cProfile
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import secrets
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, TypeVar
+
+from proxysub.env import env_choice, env_float, env_int
+from proxysub.yamlio import write_bytes_atomic
+
+PROFILE_ENV = "PROXYSUB_PROFILE"
+PROFILE_SAMPLE_RATE_ENV = "PROXYSUB_PROFILE_SAMPLE_RATE"
+PROFILE_KEY_ENV = "PROXYSUB_PROFILE_KEY"
+PROFILE_DIR_ENV = "PROXYSUB_PROFILE_DIR"
+PROFILE_MAX_RUNS_ENV = "PROXYSUB_PROFILE_MAX_RUNS"
+PROFILE_HEADER = "x-proxysub-profile"
+DEFAULT_PROFILE_MAX_RUNS = 20
+
+_TOP_FUNCTIONS = 40
+_TOP_ALLOCATIONS = 25
+# UTC timestamp to the millisecond, so ids sort by creation time.
+_RUN_ID_RE = re.compile(r"^\d{8}T\d{9}-[0-9a-f]{8}$")
+_REPORT_SUFFIXES = (".prof", ".txt", ".json")
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# tracemalloc is process-wide: one profiled build at a time per process.
+_PROFILE_LOCK = threading.Lock()
+
+
+@dataclass(frozen=True)
+class ProfileSettings:
+    out_dir: Path
+    max_runs: int = DEFAULT_PROFILE_MAX_RUNS
+    sample_rate: float = 0.0
+    # When set, the profile header and the debug endpoints must present it.
+    key: str | None = None
+
+    @classmethod
+    def from_env(cls, *, default_dir: Path) -> ProfileSettings | None:
+        """Settings from the environment, or None when profiling is off."""
+        if env_choice(PROFILE_ENV, "off", ("on", "off")) != "on":
+            return None
+        sample_rate = env_float(PROFILE_SAMPLE_RATE_ENV, 0.0)
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError(f"{PROFILE_SAMPLE_RATE_ENV} must be between 0 and 1, got {sample_rate}")
+        max_runs = env_int(PROFILE_MAX_RUNS_ENV, DEFAULT_PROFILE_MAX_RUNS)
+        if max_runs <= 0:
+            raise ValueError(f"{PROFILE_MAX_RUNS_ENV} must be > 0, got {max_runs}")
+        raw_dir = os.getenv(PROFILE_DIR_ENV, "").strip()
+        return cls(
+            out_dir=Path(raw_dir) if raw_dir else default_dir,
+            max_runs=max_runs,
+            sample_rate=sample_rate,
+            key=os.getenv(PROFILE_KEY_ENV, "").strip() or None,
+        )
+
+    def authorized(self, header_value: str | None) -> bool:
+        if self.key is None:
+            return True
+        return header_value is not None and hmac.compare_digest(header_value.strip().encode(), self.key.encode())
+
+    def should_profile(self, header_value: str | None) -> bool:
+        if header_value is not None and header_value.strip() and self.authorized(header_value):
+            return True
+        return self.sample_rate > 0.0 and random.random() < self.sample_rate
+
+
+def new_run_id() -> str:
+    now = time.time()
+    return f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(now))}{int(now * 1000) % 1000:03d}-{secrets.token_hex(4)}"
+
+
+def run_profiled(settings: ProfileSettings, run_id: str, label: str, fn: Callable[..., T], *args: Any) -> T:
+    """Call `fn(*args)` under cProfile and tracemalloc and write the reports as `run_id`; runs in a pool worker.
+
+    Reports are written whether or not `fn` raises; failing to write them is only logged.
+    """
+    with _PROFILE_LOCK:
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profiler = cProfile.Profile()
+        error: str | None = None
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                return fn(*args)
+            finally:
+                profiler.disable()
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+            raise
+        finally:
+            wall_s = time.perf_counter() - started
+            snapshot = tracemalloc.take_snapshot()
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            if not was_tracing:
+                tracemalloc.stop()
+            try:
+                _write_reports(
+                    settings,
+                    run_id,
+                    profiler,
+                    snapshot,
+                    summary={
+                        "id": run_id,
+                        "label": label,
+                        "created_at": time.time(),
+                        "wall_s": round(wall_s, 6),
+                        "peak_traced_bytes": peak_bytes,
+                        "error": error,
+                    },
+                )
+            except OSError:
+                logger.exception("failed to write profile %s", run_id)
+
+
+def list_profiles(out_dir: Path) -> list[dict[str, Any]]:
+    """Summaries of the stored runs, newest first."""
+    runs: list[dict[str, Any]] = []
+    for path in sorted(out_dir.glob("*.json"), reverse=True):
+        if not _RUN_ID_RE.match(path.stem):
+            continue
+        try:
+            summary = json.loads(path.read_bytes())
+        except (OSError, ValueError):
+            continue
+        summary["files"] = [path.stem + suffix for suffix in _REPORT_SUFFIXES if (out_dir / (path.stem + suffix)).exists()]
+        runs.append(summary)
+    return runs
+
+
+def profile_file(out_dir: Path, name: str) -> Path | None:
+    """Path of a stored report file by its file name, or None for anything else."""
+    stem, dot, suffix = name.rpartition(".")
+    if not dot or "." + suffix not in _REPORT_SUFFIXES or not _RUN_ID_RE.match(stem):
+        return None
+    path = out_dir / name
+    return path if path.is_file() else None
+
+
+def _write_reports(
+    settings: ProfileSettings,
+    run_id: str,
+    profiler: cProfile.Profile,
+    snapshot: tracemalloc.Snapshot,
+    *,
+    summary: dict[str, Any],
+) -> None:
+    out_dir = settings.out_dir
+    out_dir.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(str(out_dir / f"{run_id}.prof"))
+
+    report = io.StringIO()
+    report.write(f"# {summary['label']} {run_id}: {summary['wall_s']:.3f}s wall, {summary['peak_traced_bytes']} bytes peak\n")
+    if summary["error"]:
+        report.write(f"# failed: {summary['error']}\n")
+    report.write("\n## functions by cumulative time\n")
+    pstats.Stats(profiler, stream=report).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(_TOP_FUNCTIONS)
+    report.write("## allocation sites still alive at the end of the build\n")
+    report.write("# (process-wide: includes concurrent builds in other threads)\n")
+    snapshot = snapshot.filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        )
+    )
+    for stat in snapshot.statistics("lineno")[:_TOP_ALLOCATIONS]:
+        report.write(f"{stat}\n")
+    write_bytes_atomic(report.getvalue().encode("utf-8"), out_dir / f"{run_id}.txt")
+
+    # The summary goes last: `list_profiles` only lists complete runs.
+    write_bytes_atomic(json.dumps(summary).encode("utf-8"), out_dir / f"{run_id}.json")
+    _prune(out_dir, settings.max_runs)
+
+
+def _prune(out_dir: Path, max_runs: int) -> None:
+    stems = sorted({p.stem for p in out_dir.iterdir() if p.suffix in _REPORT_SUFFIXES and _RUN_ID_RE.match(p.stem)})
+    for stem in stems[: max(0, len(stems) - max_runs)]:
+        for suffix in _REPORT_SUFFIXES:
+            (out_dir / (stem + suffix)).unlink(missing_ok=True)
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import functools
+import re
+import sys
+import threading
+from dataclasses import dataclass
+from typing import Any, Iterable, Sequence
+
+# A region token must not touch other ASCII letters/digits: "US" matches "US-01"
+# and "美国 US" but not "USDT" or "Russia".
+_TOKEN_TEMPLATE = r"(?<![A-Za-z0-9]){}(?![A-Za-z0-9])"
+_UNSEEN = object()
+# Names come from subscriptions, so each classifier's memo is capped by the memory
+# its keys take (getsizeof), and unusually long names are classified without being memoized.
+_MEMO_MAX_BYTES = 4 * 1024 * 1024
+_MEMO_MAX_NAME_CHARS = 256
+_CLASSIFIERS_MAX_ENTRIES = 32
+
+
+@dataclass(frozen=True)
+class RegionSpec:
+    """Node-name patterns for one region.
+
+    `keywords` match anywhere in the name, `tokens` only as standalone ASCII words;
+    both ignore case.
+    """
+
+    name: str
+    keywords: tuple[str, ...] = ()
+    tokens: tuple[str, ...] = ()
+
+    def __post_init__(self) -> None:
+        if not self.name.strip():
+            raise ValueError("region name must be non-empty")
+        for pattern in (*self.keywords, *self.tokens):
+            if not pattern or "\n" in pattern:
+                raise ValueError(f"invalid pattern {pattern!r} for region {self.name!r}")
+        if not self.keywords and not self.tokens:
+            raise ValueError(f"region {self.name!r} needs at least one keyword or token")
+
+
+BUILTIN_REGIONS: dict[str, RegionSpec] = {
+    spec.name: spec
+    for spec in (
+        RegionSpec("US", keywords=("美国",), tokens=("US",)),
+        RegionSpec("JP", keywords=("日本",), tokens=("JP",)),
+        RegionSpec("SG", keywords=("新加坡", "狮城"), tokens=("SG",)),
+        RegionSpec("HK", keywords=("香港",), tokens=("HK",)),
+        RegionSpec("TW", keywords=("台湾",), tokens=("TW",)),
+    )
+}
+DEFAULT_WEST_COWBOY_REGIONS: tuple[RegionSpec, ...] = (BUILTIN_REGIONS["US"],)
+
+
+class RegionClassifier:
+    """All region patterns compiled into one alternation regex, with verdicts memoized per name.
+
+    A name's region is the one whose pattern occurs first in it (on a tie, the
+    region listed first), found with a single regex search; `classify_many`
+    handles a whole node list in one pass.
+    """
+
+    def __init__(self, regions: Sequence[RegionSpec]) -> None:
+        if not regions:
+            raise ValueError("at least one region is required")
+        self.regions = tuple(regions)
+        alternatives = []
+        for idx, spec in enumerate(self.regions):
+            patterns = [re.escape(k) for k in spec.keywords] + [
+                _TOKEN_TEMPLATE.format(re.escape(t)) for t in spec.tokens
+            ]
+            alternatives.append(f"(?P<r{idx}>{'|'.join(patterns)})")
+        self._pattern = re.compile("|".join(alternatives), re.IGNORECASE)
+        self._group_regions = {f"r{idx}": spec.name for idx, spec in enumerate(self.regions)}
+        self._memo: dict[str, str | None] = {}
+        self._memo_bytes = 0
+        self._lock = threading.Lock()
+
+    def classify(self, name: str) -> str | None:
+        """The region `name` belongs to, or None."""
+        return self.classify_many([name])[0]
+
+    def classify_many(self, names: Iterable[str]) -> list[str | None]:
+        memo = self._memo
+        search = self._pattern.search
+        out: list[str | None] = []
+        fresh: dict[str, str | None] = {}
+        for name in names:
+            verdict = memo.get(name, _UNSEEN)
+            if verdict is _UNSEEN:
+                match = search(name)
+                verdict = None if match is None else self._group_regions[match.lastgroup]  # type: ignore[index]
+                if len(name) <= _MEMO_MAX_NAME_CHARS:
+                    fresh[name] = verdict
+            out.append(verdict)  # type: ignore[arg-type]
+        if fresh:
+            with self._lock:
+                added = sum(sys.getsizeof(name) for name in fresh)
+                if self._memo_bytes + added > _MEMO_MAX_BYTES:
+                    memo.clear()
+                    self._memo_bytes = 0
+                for name, verdict in fresh.items():
+                    size = sys.getsizeof(name)
+                    if self._memo_bytes + size > _MEMO_MAX_BYTES:
+                        break
+                    if name not in memo:
+                        memo[name] = verdict
+                        self._memo_bytes += size
+        return out
+
+
+def get_region_classifier(regions: Sequence[RegionSpec] | None = None) -> RegionClassifier:
+    """Return the shared classifier for `regions`, compiling it on first use."""
+    return _classifier_for(tuple(regions) if regions else DEFAULT_WEST_COWBOY_REGIONS)
+
+
+# Region lists come from uploads, so only the most recently used classifiers are kept.
+@functools.lru_cache(maxsize=_CLASSIFIERS_MAX_ENTRIES)
+def _classifier_for(regions: tuple[RegionSpec, ...]) -> RegionClassifier:
+    return RegionClassifier(regions)
+
+
+def parse_region_specs(raw: Any) -> tuple[RegionSpec, ...]:
+    """Parse `regions` from the subs doc.
+
+    Accepts builtin region names (`[US, JP]` or `"US,JP"`) and custom entries
+    `{name, keywords, tokens}`.
+    """
+    if isinstance(raw, str):
+        raw = raw.split(",")
+    if not isinstance(raw, list):
+        raise ValueError("west-cowboy.regions must be a list or a comma-separated string")
+
+    specs: list[RegionSpec] = []
+    for item in raw:
+        if isinstance(item, str):
+            key = item.strip().upper()
+            if not key:
+                continue
+            if key not in BUILTIN_REGIONS:
+                known = ", ".join(BUILTIN_REGIONS)
+                raise ValueError(f"unknown region {item.strip()!r} (builtin: {known}); define keywords/tokens for it")
+            specs.append(BUILTIN_REGIONS[key])
+        elif isinstance(item, dict):
+            name = item.get("name")
+            if not isinstance(name, str) or not name.strip():
+                raise ValueError("custom regions need a non-empty 'name'")
+            specs.append(
+                RegionSpec(
+                    name=name.strip(),
+                    keywords=_string_tuple(item.get("keywords"), f"{name}.keywords"),
+                    tokens=_string_tuple(item.get("tokens"), f"{name}.tokens"),
+                )
+            )
+        else:
+            raise ValueError(f"invalid region entry {item!r}")
+    if not specs:
+        raise ValueError("west-cowboy.regions must name at least one region")
+    return tuple(dict.fromkeys(specs))
+
+
+def _string_tuple(raw: Any, field: str) -> tuple[str, ...]:
+    if raw is None:
+        return ()
+    if isinstance(raw, str):
+        raw = [raw]
+    if not isinstance(raw, list) or not all(isinstance(v, (str, int)) for v in raw):
+        raise ValueError(f"{field} must be a list of strings")
+    return tuple(str(v).strip() for v in raw if str(v).strip())
@@ -0,0 +1,458 @@
+"""Rule-list optimizer: drops unreachable rules and unused rule-providers, and moves
+cheap domain rules ahead of rules that make the client resolve DNS.
+
+Mihomo returns the target of the first matching rule. A rule that needs the
+destination IP (IP-CIDR, GEOIP, an ipcidr/classical RULE-SET, ... without
+`no-resolve`) resolves the domain on the spot, and later `no-resolve` IP rules
+see the resolved address. Every rewrite here keeps the first match of every
+connection unchanged:
+
+- a rule is removed only when an earlier rule matches everything it matches;
+- a DOMAIN / DOMAIN-SUFFIX / DOMAIN-KEYWORD rule (no side effects, never looks
+  at the IP) moves up only past rules with the same target or rules it provably
+  cannot match together with. `no-resolve` IP rules are never moved, because
+  ahead of a resolving rule they would stop seeing resolved addresses.
+"""
+
+from __future__ import annotations
+
+import ipaddress
+import re
+from dataclasses import dataclass
+from typing import Any
+
+from proxysub.env import env_choice
+
+RULE_OPTIMIZER_ENV = "PROXYSUB_RULE_OPTIMIZER"
+RULE_OPTIMIZER_MODES = ("off", "dry-run", "apply")
+DEFAULT_RULE_OPTIMIZER_MODE = env_choice(RULE_OPTIMIZER_ENV, "off", RULE_OPTIMIZER_MODES)
+
+_DOMAIN_TYPES = frozenset({"DOMAIN", "DOMAIN-SUFFIX", "DOMAIN-KEYWORD"})
+_CIDR_TYPES = frozenset({"IP-CIDR", "IP-CIDR6"})
+# Rule types that match on the destination IP.
+_IP_TYPES = frozenset({*_CIDR_TYPES, "IP-SUFFIX", "IP-ASN", "GEOIP"})
+# Types parsed as `TYPE,PAYLOAD,TARGET[,params]`; anything else is left opaque.
+_SIMPLE_TYPES = frozenset(
+    {
+        *_DOMAIN_TYPES,
+        *_IP_TYPES,
+        "GEOSITE",
+        "RULE-SET",
+        "SRC-IP-CIDR",
+        "SRC-PORT",
+        "DST-PORT",
+        "IN-PORT",
+        "NETWORK",
+        "PROCESS-NAME",
+        "PROCESS-PATH",
+    }
+)
+_LOGICAL_TYPES = frozenset({"AND", "OR", "NOT"})
+_RULE_SET_REF_RE = re.compile(r"RULE-SET\s*,\s*([^,()\s]+)", re.IGNORECASE)
+_RULE_SECTIONS = frozenset({"rules", "sub-rules", "rule-providers"})
+# Filled in from uploads and never reference rule-providers; proxy-groups come from
+# the template and are scanned like any other section.
+_SKIPPED_SECTIONS = frozenset({"proxies", "proxy-providers"})
+# How many rules a domain rule may be moved past; stopping early is always safe.
+_MAX_LOOKBACK = 128
+
+
+@dataclass(frozen=True)
+class RemovedRule:
+    index: int
+    rule: Any
+    reason: str
+
+
+@dataclass(frozen=True)
+class MovedRule:
+    index: int
+    rule: Any
+    # Original index of the rule it now precedes.
+    ahead_of: int
+
+
+@dataclass(frozen=True)
+class RulePlan:
+    """What `plan_rule_optimizations` would change; `apply` performs it on a config."""
+
+    source_rule_count: int
+    # Original indexes of the kept rules, in their new order.
+    rule_order: tuple[int, ...]
+    removed_rules: tuple[RemovedRule, ...] = ()
+    moved_rules: tuple[MovedRule, ...] = ()
+    removed_providers: tuple[str, ...] = ()
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.removed_rules or self.moved_rules or self.removed_providers)
+
+    def apply(self, config: dict[str, Any]) -> None:
+        if not self.changed:
+            return
+        rules = config.get("rules")
+        if not isinstance(rules, list) or len(rules) != self.source_rule_count:
+            raise ValueError("rule plan does not match this config")
+        if self.removed_rules or self.moved_rules:
+            config["rules"] = [rules[i] for i in self.rule_order]
+        if self.removed_providers:
+            dropped = set(self.removed_providers)
+            config["rule-providers"] = {k: v for k, v in config["rule-providers"].items() if k not in dropped}
+
+    def report_lines(self) -> list[str]:
+        lines = [
+            f"rules: removed {len(self.removed_rules)}, moved {len(self.moved_rules)}; "
+            f"rule-providers: removed {len(self.removed_providers)}"
+        ]
+        lines.extend(f"removed rules[{r.index}] {r.rule}: {r.reason}" for r in self.removed_rules)
+        lines.extend(f"moved rules[{m.index}] {m.rule}: ahead of rules[{m.ahead_of}]" for m in self.moved_rules)
+        lines.extend(f"removed rule-provider {name}: not referenced" for name in self.removed_providers)
+        return lines
+
+
+@dataclass(frozen=True)
+class _Rule:
+    index: int
+    raw: Any
+    # None for rules this module does not understand; those are never moved or shadowed.
+    type: str | None = None
+    payload: str = ""
+    target: str | None = None
+    no_resolve: bool = False
+    # Params other than `no-resolve`; rules with any are treated as opaque.
+    extra_params: tuple[str, ...] = ()
+    # Matches on the destination IP (unknown rules are assumed to).
+    uses_ip: bool = True
+    # May resolve the domain when evaluated (unknown rules are assumed to).
+    resolves: bool = True
+
+
+# An indexed earlier rule: (index, resolved the domain when evaluated, epoch after it).
+_Seen = tuple[int, bool, int]
+
+
+def plan_rule_optimizations(config: dict[str, Any]) -> RulePlan:
+    """Work out which `rules` / `rule-providers` entries can go and which rules can move up."""
+    raw_rules = config.get("rules")
+    if not isinstance(raw_rules, list):
+        return RulePlan(source_rule_count=0, rule_order=())
+    providers = config.get("rule-providers")
+    behaviors = _provider_behaviors(providers)
+
+    parsed = [_parse_rule(idx, raw, behaviors) for idx, raw in enumerate(raw_rules)]
+    kept, removed = _drop_unreachable(parsed)
+    ordered, moved = _move_cheap_rules(kept)
+
+    removed_providers: tuple[str, ...] = ()
+    if isinstance(providers, dict):
+        referenced = _referenced_rule_sets(config, [r.raw for r in ordered])
+        removed_providers = tuple(
+            name for name in providers if isinstance(name, str) and name.strip() not in referenced
+        )
+
+    return RulePlan(
+        source_rule_count=len(raw_rules),
+        rule_order=tuple(r.index for r in ordered),
+        removed_rules=tuple(removed),
+        moved_rules=tuple(moved),
+        removed_providers=removed_providers,
+    )
+
+
+def optimize_rules(config: dict[str, Any], *, dry_run: bool = False) -> RulePlan:
+    """Plan and (unless `dry_run`) apply the rule optimizations to `config` in place."""
+    plan = plan_rule_optimizations(config)
+    if not dry_run:
+        plan.apply(config)
+    return plan
+
+
+def _provider_behaviors(providers: Any) -> dict[str, str]:
+    if not isinstance(providers, dict):
+        return {}
+    out: dict[str, str] = {}
+    for name, provider in providers.items():
+        if isinstance(name, str) and isinstance(provider, dict) and isinstance(provider.get("behavior"), str):
+            out[name.strip()] = provider["behavior"].strip().lower()
+    return out
+
+
+def _parse_rule(index: int, raw: Any, behaviors: dict[str, str]) -> _Rule:
+    if not isinstance(raw, str):
+        return _Rule(index=index, raw=raw)
+    head, _, rest = raw.strip().partition(",")
+    rtype = head.strip().upper()
+
+    if rtype == "MATCH":
+        target = rest.strip()
+        if not target or "," in target:
+            return _Rule(index=index, raw=raw)
+        return _Rule(index=index, raw=raw, type=rtype, target=target, uses_ip=False, resolves=False)
+
+    if rtype in _LOGICAL_TYPES:
+        end = _closing_paren(rest)
+        if end is None or not rest[end + 1 :].startswith(","):
+            return _Rule(index=index, raw=raw)
+        target, *params = (f.strip() for f in rest[end + 2 :].split(","))
+        if not target:
+            return _Rule(index=index, raw=raw)
+        # Conservatively assume any IP rule inside may resolve.
+        inner_types = {t.upper() for t in re.findall(r"\(\s*([A-Za-z0-9-]+)\s*,", rest[: end + 1])}
+        uses_ip = bool(inner_types & (_IP_TYPES | {"RULE-SET"}))
+        return _Rule(
+            index=index,
+            raw=raw,
+            type=rtype,
+            payload=rest[: end + 1],
+            target=target,
+            extra_params=tuple(params),
+            uses_ip=uses_ip,
+            resolves=uses_ip,
+        )
+
+    if rtype not in _SIMPLE_TYPES:
+        return _Rule(index=index, raw=raw)
+    fields = [f.strip() for f in rest.split(",")]
+    if len(fields) < 2 or not fields[0] or not fields[1]:
+        return _Rule(index=index, raw=raw)
+    payload, target, params = fields[0], fields[1], fields[2:]
+    if rtype in _DOMAIN_TYPES:
+        payload = payload.lower()
+    no_resolve = "no-resolve" in params
+    uses_ip = rtype in _IP_TYPES or (rtype == "RULE-SET" and behaviors.get(payload) != "domain")
+    return _Rule(
+        index=index,
+        raw=raw,
+        type=rtype,
+        payload=payload,
+        target=target,
+        no_resolve=no_resolve,
+        extra_params=tuple(p for p in params if p != "no-resolve"),
+        uses_ip=uses_ip,
+        resolves=uses_ip and not no_resolve,
+    )
+
+
+def _closing_paren(text: str) -> int | None:
+    if not text.startswith("("):
+        return None
+    depth = 0
+    for pos, char in enumerate(text):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                return pos
+    return None
+
+
+def _drop_unreachable(rules: list[_Rule]) -> tuple[list[_Rule], list[RemovedRule]]:
+    """Remove exact duplicates, rules after MATCH and rules shadowed by an earlier, wider rule.
+
+    A `no-resolve` IP rule only covers a later one while no rule in between may
+    have resolved the domain: each such rule starts a new "epoch".
+    """
+    kept: list[_Rule] = []
+    removed: list[RemovedRule] = []
+    epoch = 0
+    seen_text: dict[str, tuple[int, int]] = {}
+    seen_keys: dict[tuple[str, str], _Seen] = {}
+    domains: dict[str, int] = {}
+    suffixes: dict[str, int] = {}
+    keywords: list[tuple[str, int]] = []
+    # (version, prefixlen) -> {network address as int: rule}
+    cidrs: dict[tuple[int, int], dict[int, _Seen]] = {}
+    match_index: int | None = None
+
+    for rule in rules:
+        if match_index is not None:
+            removed.append(RemovedRule(rule.index, rule.raw, f"unreachable after MATCH at rules[{match_index}]"))
+            continue
+        text = rule.raw.strip() if isinstance(rule.raw, str) else None
+        first = seen_text.get(text) if text is not None else None
+        if first is not None and (_ignores_resolution_state(rule) or first[1] == epoch):
+            removed.append(RemovedRule(rule.index, rule.raw, f"duplicate of rules[{first[0]}]"))
+            continue
+        shadow = _shadowed_by(rule, epoch, seen_keys, domains, suffixes, keywords, cidrs)
+        if shadow is not None:
+            removed.append(RemovedRule(rule.index, rule.raw, f"shadowed by rules[{shadow}]"))
+            continue
+
+        kept.append(rule)
+        if text is not None:
+            seen_text[text] = (rule.index, epoch)
+        if rule.type == "MATCH":
+            match_index = rule.index
+        if rule.resolves:
+            epoch += 1
+        if rule.type is None or rule.type in _LOGICAL_TYPES or rule.extra_params:
+            continue
+        seen = (rule.index, not rule.no_resolve, epoch)
+        if rule.type == "DOMAIN":
+            domains.setdefault(rule.payload, rule.index)
+        elif rule.type == "DOMAIN-SUFFIX":
+            suffixes.setdefault(rule.payload.lstrip("."), rule.index)
+        elif rule.type == "DOMAIN-KEYWORD":
+            keywords.append((rule.payload, rule.index))
+        elif rule.type in _CIDR_TYPES:
+            network = _network(rule.payload)
+            if network is not None:
+                bucket = cidrs.setdefault((network.version, network.prefixlen), {})
+                _remember(bucket, int(network.network_address), seen)
+        else:
+            _remember(seen_keys, (rule.type, rule.payload), seen)
+    return kept, removed
+
+
+def _ignores_resolution_state(rule: _Rule) -> bool:
+    """Whether the rule matches the same connections wherever it sits (never reads an IP another rule resolved)."""
+    if rule.type is None or rule.type in _LOGICAL_TYPES:
+        return not rule.uses_ip
+    return not rule.uses_ip or not rule.no_resolve
+
+
+def _remember(index: dict[Any, _Seen], key: Any, seen: _Seen) -> None:
+    # An entry that resolved covers every later rule; otherwise the newest epoch covers the most.
+    previous = index.get(key)
+    if previous is None or not previous[1]:
+        index[key] = seen
+
+
+def _shadowed_by(
+    rule: _Rule,
+    epoch: int,
+    seen_keys: dict[tuple[str, str], _Seen],
+    domains: dict[str, int],
+    suffixes: dict[str, int],
+    keywords: list[tuple[str, int]],
+    cidrs: dict[tuple[int, int], dict[int, _Seen]],
+) -> int | None:
+    """Index of an earlier rule matching everything `rule` matches, if one is known."""
+    if rule.type is None or rule.type in _LOGICAL_TYPES or rule.type == "MATCH" or rule.extra_params:
+        return None
+
+    if rule.type in _DOMAIN_TYPES:
+        value = rule.payload.lstrip(".") if rule.type == "DOMAIN-SUFFIX" else rule.payload
+        for keyword, idx in keywords:
+            if keyword in value:
+                return idx
+        if rule.type == "DOMAIN-KEYWORD":
+            return None
+        if rule.type == "DOMAIN" and value in domains:
+            return domains[value]
+        labels = value.split(".")
+        for start in range(len(labels)):
+            idx = suffixes.get(".".join(labels[start:]))
+            if idx is not None:
+                return idx
+        return None
+
+    if rule.type in _CIDR_TYPES:
+        network = _network(rule.payload)
+        if network is None:
+            return None
+        address = int(network.network_address)
+        bits = network.max_prefixlen
+        for (version, prefixlen), bucket in cidrs.items():
+            if version != network.version or prefixlen > network.prefixlen:
+                continue
+            hit = bucket.get(address >> (bits - prefixlen) << (bits - prefixlen))
+            if hit is not None and _covers(hit, rule, epoch):
+                return hit[0]
+        return None
+
+    hit = seen_keys.get((rule.type, rule.payload))
+    if hit is not None and (not rule.uses_ip or _covers(hit, rule, epoch)):
+        return hit[0]
+    return None
+
+
+def _covers(earlier: _Seen, rule: _Rule, epoch: int) -> bool:
+    """Whether an earlier IP rule with a wider payload saw at least the addresses `rule` will see."""
+    _, resolved, seen_epoch = earlier
+    return resolved or (rule.no_resolve and seen_epoch == epoch)
+
+
+def _network(payload: str) -> ipaddress.IPv4Network | ipaddress.IPv6Network | None:
+    try:
+        return ipaddress.ip_network(payload, strict=False)
+    except ValueError:
+        return None
+
+
+def _move_cheap_rules(rules: list[_Rule]) -> tuple[list[_Rule], list[MovedRule]]:
+    """Move each domain rule ahead of the earliest resolving rule it can safely pass."""
+    out: list[_Rule] = []
+    moved: list[MovedRule] = []
+    for rule in rules:
+        if rule.type in _DOMAIN_TYPES and not rule.extra_params:
+            pos = len(out)
+            dest: int | None = None
+            while pos > 0 and len(out) - pos < _MAX_LOOKBACK and _can_pass(rule, out[pos - 1]):
+                pos -= 1
+                if out[pos].resolves:
+                    dest = pos
+            if dest is not None:
+                moved.append(MovedRule(rule.index, rule.raw, ahead_of=out[dest].index))
+                out.insert(dest, rule)
+                continue
+        out.append(rule)
+    return out, moved
+
+
+def _can_pass(rule: _Rule, other: _Rule) -> bool:
+    """Whether swapping domain `rule` with the `other` rule just above it keeps every first match."""
+    if other.type is None or other.type == "MATCH" or other.target is None:
+        return False
+    if other.target == rule.target:
+        return True
+    if other.type not in _DOMAIN_TYPES or other.extra_params:
+        return False
+    return _domains_disjoint(rule, other)
+
+
+def _domains_disjoint(a: _Rule, b: _Rule) -> bool:
+    if a.type == "DOMAIN-KEYWORD" and b.type == "DOMAIN-KEYWORD":
+        return False
+    if a.type == "DOMAIN-KEYWORD" or b.type == "DOMAIN-KEYWORD":
+        keyword, other = (a, b) if a.type == "DOMAIN-KEYWORD" else (b, a)
+        return other.type == "DOMAIN" and keyword.payload not in other.payload
+    a_value, b_value = a.payload.lstrip("."), b.payload.lstrip(".")
+    if a.type == "DOMAIN" and b.type == "DOMAIN":
+        return a_value != b_value
+    if a.type == "DOMAIN-SUFFIX" and _under_suffix(b_value, a_value):
+        return False
+    if b.type == "DOMAIN-SUFFIX" and _under_suffix(a_value, b_value):
+        return False
+    return True
+
+
+def _under_suffix(domain: str, suffix: str) -> bool:
+    return domain == suffix or domain.endswith("." + suffix)
+
+
+def _referenced_rule_sets(config: dict[str, Any], rules: list[Any]) -> set[str]:
+    """Rule-provider names used by `rules`, `sub-rules` or a `rule-set:` reference elsewhere (e.g. dns)."""
+    referenced: set[str] = set()
+    sub_rules = config.get("sub-rules")
+    sub_rule_lists = list(sub_rules.values()) if isinstance(sub_rules, dict) else []
+    for rule_list in (rules, *sub_rule_lists):
+        if not isinstance(rule_list, list):
+            continue
+        for rule in rule_list:
+            if isinstance(rule, str):
+                referenced.update(m.strip() for m in _RULE_SET_REF_RE.findall(rule))
+
+    stack = [v for k, v in config.items() if k not in _RULE_SECTIONS and k not in _SKIPPED_SECTIONS]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            stack.extend(node.keys())
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, str) and "rule-set:" in node:
+            for ref in node.split("rule-set:")[1:]:
+                referenced.update(name.strip() for name in ref.split(",") if name.strip())
+    return referenced
@@ -1,12 +1,19 @@
 from __future__ import annotations
 
+import http.client
+import io
+import logging
 from dataclasses import dataclass
-from typing import Any
-from urllib.request import Request, urlopen
+from functools import partial
+from typing import Any, BinaryIO, Iterator
 
-import yaml
+from proxysub.dedupe import DEFAULT_DEDUPE_POLICY, dedupe_proxies
+from proxysub.fetch import FetchError, FetchResult, HttpConnectionPool, fetch_concurrently
+from proxysub.fetchcache import CachedSubscription, SubscriptionCache
+from proxysub.regions import RegionSpec, parse_region_specs
+from proxysub.yamlio import iter_yaml_sequence, load_yaml_file
 
-from proxysub.yamlio import load_yaml_file
+logger = logging.getLogger(__name__)
 
 
 @dataclass(frozen=True)
@@ -16,14 +23,23 @@ class SubsConfig:
     proxies: list[dict[str, Any]]
     west_cowboy_url: str | None = None
     west_cowboy_expected_status: str | int | None = None
+    # None means the default (US) node selection.
+    west_cowboy_regions: tuple[RegionSpec, ...] | None = None
 
     @property
-    def us_home_proxy_name(self) -> str:
+    def first_proxy_name(self) -> str | None:
         for proxy in self.proxies:
             name = proxy.get("name")
             if isinstance(name, str) and name.strip():
                 return name.strip()
-        raise ValueError("subs.yaml must contain at least one proxy with a non-empty 'name'")
+        return None
+
+    @property
+    def us_home_proxy_name(self) -> str:
+        name = self.first_proxy_name
+        if name is None:
+            raise ValueError("subs.yaml must contain at least one proxy with a non-empty 'name'")
+        return name
 
 
 def load_subs_config(path: Any) -> SubsConfig:
@@ -69,6 +85,7 @@ def parse_subs_config(doc: Any) -> SubsConfig:
 
     west_cowboy_url: str | None = None
     west_cowboy_expected_status: str | int | None = None
+    west_cowboy_regions: tuple[RegionSpec, ...] | None = None
     if isinstance(west_cowboy, dict):
         raw_url = west_cowboy.get("url")
         if raw_url is None:
@@ -85,69 +102,135 @@ def parse_subs_config(doc: Any) -> SubsConfig:
         if isinstance(raw_expected_status, (str, int)) and str(raw_expected_status).strip():
             west_cowboy_expected_status = raw_expected_status
 
+        raw_regions = west_cowboy.get("regions")
+        if raw_regions is not None:
+            west_cowboy_regions = parse_region_specs(raw_regions)
+
     return SubsConfig(
         proxy_provider_urls=proxy_provider_urls,
         proxy_providers=proxy_providers,
         proxies=proxies,
         west_cowboy_url=west_cowboy_url,
         west_cowboy_expected_status=west_cowboy_expected_status,
+        west_cowboy_regions=west_cowboy_regions,
     )
 
 
-def fetch_subscription_proxies(urls: list[str], *, timeout_s: int = 25) -> list[dict[str, Any]]:
+def fetch_subscription_proxies(
+    urls: list[str],
+    *,
+    timeout_s: int = 25,
+    max_concurrency: int = 8,
+    per_host_concurrency: int = 2,
+    deadline_s: float | None = None,
+    cache: SubscriptionCache | None = None,
+    dedupe_policy: str = DEFAULT_DEDUPE_POLICY,
+) -> list[dict[str, Any]]:
+    """Fetch every subscription and merge their proxies.
+
+    With `dedupe_policy` `off` every node is kept as fetched; otherwise repeated
+    names are dropped and nodes sharing an endpoint are collapsed.
+    """
     proxies: list[dict[str, Any]] = []
     errors: list[str] = []
 
-    for url in urls:
-        try:
-            text = _fetch_text(url, timeout_s=timeout_s)
-            doc = yaml.safe_load(text)
-            proxies.extend(_extract_proxies(doc))
-        except Exception as exc:
-            errors.append(f"{url}: {exc}")
+    for result in fetch_subscriptions(
+        urls,
+        timeout_s=timeout_s,
+        max_concurrency=max_concurrency,
+        per_host_concurrency=per_host_concurrency,
+        deadline_s=deadline_s,
+        cache=cache,
+    ):
+        if result.error is not None:
+            errors.append(f"{result.url}: {result.error}")
+        elif result.value:
+            proxies.extend(result.value)
 
     if not proxies and errors:
         preview = "\n".join(errors[:5])
         more = "" if len(errors) <= 5 else f"\n... ({len(errors) - 5} more)"
         raise RuntimeError(f"All subscription fetches failed:\n{preview}{more}")
 
-    return proxies
+    if dedupe_policy == "off":
+        return proxies
+    dedupe = dedupe_proxies(proxies, policy=dedupe_policy)
+    if dedupe.collapsed:
+        logger.info("collapsed %d subscription proxies sharing an endpoint", dedupe.collapsed)
+    return dedupe.proxies
+
+
+def fetch_subscriptions(
+    urls: list[str],
+    *,
+    timeout_s: float = 25,
+    max_concurrency: int = 8,
+    per_host_concurrency: int = 2,
+    deadline_s: float | None = None,
+    cache: SubscriptionCache | None = None,
+) -> list[FetchResult[list[dict[str, Any]]]]:
+    """Fetch and parse subscriptions concurrently; one result (proxies or error) per url, in order.
+
+    With a `cache`, requests are conditional (If-None-Match / If-Modified-Since) and a
+    304 reuses the cached proxy list; entries within the cache's max-age skip the network.
+    """
+    return fetch_concurrently(
+        urls,
+        partial(_fetch_subscription, cache=cache),
+        max_concurrency=max_concurrency,
+        per_host_concurrency=per_host_concurrency,
+        timeout_s=timeout_s,
+        deadline_s=deadline_s,
+    )
 
 
-def _fetch_text(url: str, *, timeout_s: int) -> str:
+def _fetch_subscription(
+    pool: HttpConnectionPool,
+    url: str,
+    timeout_s: float,
+    *,
+    cache: SubscriptionCache | None = None,
+) -> list[dict[str, Any]]:
     if not isinstance(url, str) or not url.strip():
         raise ValueError("subscription url must be a non-empty string")
     url = url.strip()
 
-    req = Request(
-        url,
-        headers={
-            "User-Agent": "proxysub/0.1",
-            "Accept": "application/yaml,text/yaml,text/plain,*/*",
-        },
-    )
-    with urlopen(req, timeout=timeout_s) as resp:
-        data = resp.read()
-    return data.decode("utf-8", errors="replace")
+    cached = cache.get(url) if cache is not None else None
+    if cache is not None and cached is not None and cache.is_fresh(cached):
+        return _cached_proxies(cached)
+
+    resp = pool.request(url, headers=cached.conditional_headers() if cached else None, timeout_s=timeout_s)
+    if resp.status == 304 and cache is not None and cached is not None:
+        cache.refresh(cached, headers=resp.headers)
+        return _cached_proxies(cached)
+    if resp.status >= 400:
+        raise FetchError(f"HTTP Error {resp.status}: {http.client.responses.get(resp.status, '')}".rstrip())
+
+    # The body is already buffered (the cache stores it); streaming only avoids
+    # building the document around the proxy list.
+    proxies = list(iter_subscription_proxies(io.BytesIO(resp.body)))
+    if cache is not None and resp.status == 200:
+        cache.put(url, body=resp.body, headers=resp.headers, proxies=proxies)
+    return proxies
+
 
+def _cached_proxies(cached: CachedSubscription) -> list[dict[str, Any]]:
+    if cached.proxies is not None:
+        return cached.proxies
+    with cached.open_body() as body:
+        return list(iter_subscription_proxies(body))
 
-def _extract_proxies(doc: Any) -> list[dict[str, Any]]:
-    if isinstance(doc, dict):
-        candidates = doc.get("proxies") or doc.get("payload") or []
-    elif isinstance(doc, list):
-        candidates = doc
-    else:
-        candidates = []
 
-    if not isinstance(candidates, list):
-        return []
+def iter_subscription_proxies(stream: str | bytes | BinaryIO) -> Iterator[dict[str, Any]]:
+    """Yield the named proxy mappings of a subscription body one at a time.
 
-    out: list[dict[str, Any]] = []
-    for item in candidates:
+    Reads the top-level list, or the `proxies` list of a Clash config (the `payload`
+    list when `proxies` is missing or empty), without building the rest of the document.
+    """
+    for item in iter_yaml_sequence(stream, keys=("proxies", "payload")):
         if not isinstance(item, dict):
             continue
         name = item.get("name")
         if not isinstance(name, str) or not name.strip():
             continue
-        out.append(item)
-    return out
+        yield item
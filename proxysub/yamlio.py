@@ -1,7 +1,15 @@
 from __future__ import annotations
 
+import contextlib
+import hashlib
+import io
+import os
+import re
+import threading
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
+from types import MappingProxyType
+from typing import Any, BinaryIO, Iterable, Iterator
 
 import yaml
 
@@ -10,30 +18,510 @@ class FlowSeq(list):
     """A list that should be emitted in YAML flow style (e.g. [a, b, c])."""
 
 
+class DetachedMap(dict):
+    """A dict whose subtree is emitted in its own alias scope, as if it had been deep-copied.
+
+    Lets entries share nested values (e.g. a default `health-check`) without the
+    dumper emitting anchors/aliases between them.
+    """
+
+
 class _CustomDumper(yaml.SafeDumper):
-    pass
+    def ignore_aliases(self, data: Any) -> bool:
+        # Read-only mappings are shared defaults; emit them inline wherever they appear.
+        return isinstance(data, (DetachedMap, MappingProxyType)) or super().ignore_aliases(data)
 
 
 def _represent_flow_seq(dumper: yaml.Dumper, data: FlowSeq) -> yaml.Node:  # type: ignore[name-defined]
     return dumper.represent_sequence("tag:yaml.org,2002:seq", data, flow_style=True)
 
 
+def _represent_detached_map(dumper: yaml.Dumper, data: DetachedMap) -> yaml.Node:  # type: ignore[name-defined]
+    outer = dumper.represented_objects
+    dumper.represented_objects = {}
+    try:
+        return dumper.represent_dict(data)
+    finally:
+        dumper.represented_objects = outer
+
+
 _CustomDumper.add_representer(FlowSeq, _represent_flow_seq)
+_CustomDumper.add_representer(DetachedMap, _represent_detached_map)
+_CustomDumper.add_representer(MappingProxyType, yaml.SafeDumper.represent_dict)
+
+YAML_BACKEND_ENV = "PROXYSUB_YAML_BACKEND"
+YAML_BACKENDS = ("auto", "libyaml", "python")
+HAS_LIBYAML = bool(getattr(yaml, "__with_libyaml__", False)) and hasattr(yaml, "CSafeLoader")
+
+# libyaml only speeds up loading. Its emitter folds, escapes and lays out long keys
+# differently from the pure-Python one, so output always goes through `_CustomDumper`.
+_backend = "python"
+
+
+def set_yaml_backend(name: str) -> str:
+    """Select the YAML loader backend: `auto` (libyaml when available), `libyaml` or `python`.
+
+    Returns the backend actually in use.
+    """
+    global _backend
+    if name not in YAML_BACKENDS:
+        raise ValueError(f"Unknown YAML backend {name!r}, expected one of {', '.join(YAML_BACKENDS)}")
+    if name == "libyaml" and not HAS_LIBYAML:
+        raise RuntimeError("libyaml backend requested but PyYAML was built without libyaml")
+    _backend = "libyaml" if name == "libyaml" or (name == "auto" and HAS_LIBYAML) else "python"
+    return _backend
+
+
+def get_yaml_backend() -> str:
+    return _backend
+
+
+@contextlib.contextmanager
+def use_yaml_backend(name: str) -> Iterator[str]:
+    """Switch the backend for the duration of a `with` block, restoring the previous one after."""
+    previous = _backend
+    try:
+        yield set_yaml_backend(name)
+    finally:
+        set_yaml_backend(previous)
+
+
+set_yaml_backend(os.getenv(YAML_BACKEND_ENV, "auto").strip().lower() or "auto")
+
+
+def load_yaml(stream: str | bytes) -> Any:
+    if _backend == "libyaml":
+        return yaml.load(stream, Loader=yaml.CSafeLoader)
+    return yaml.safe_load(stream)
+
+
+class YamlLimitError(yaml.YAMLError):
+    """Raised when a document exceeds the node-count or nesting limits of `load_yaml_limited`."""
+
+
+class _LimitedComposer(yaml.composer.Composer):
+    # Counts nodes as they are composed, charging every alias with the size of the
+    # subtree it refers to, so alias bombs are rejected before anything expands them.
+    max_nodes = 0
+    max_depth = 0
+    _limit_scope = "document"
+
+    def _reset_limits(self) -> None:
+        self.anchors = {}
+        self._node_count = 0
+        self._depth = 0
+        self._anchor_sizes: dict[str, int] = {}
+
+    def _charge(self, count: int) -> None:
+        self._node_count += count
+        if self._node_count > self.max_nodes:
+            raise YamlLimitError(f"{self._limit_scope} exceeds {self.max_nodes} nodes (after alias expansion)")
+
+    def compose_node(self, parent: Any, index: Any) -> Any:
+        event = self.peek_event()
+        if isinstance(event, yaml.AliasEvent):
+            self._charge(self._anchor_sizes.get(event.anchor, 1))
+            return super().compose_node(parent, index)
+
+        self._depth += 1
+        if self._depth > self.max_depth:
+            raise YamlLimitError(f"document nesting exceeds {self.max_depth} levels")
+        start = self._node_count
+        self._charge(1)
+        try:
+            node = super().compose_node(parent, index)
+        finally:
+            self._depth -= 1
+        if event.anchor is not None:
+            self._anchor_sizes[event.anchor] = self._node_count - start
+        return node
+
+
+class _LimitedSafeLoader(_LimitedComposer, yaml.SafeLoader):
+    def __init__(self, stream: Any) -> None:
+        super().__init__(stream)
+        self._reset_limits()
+
+
+if HAS_LIBYAML:
+
+    class _LimitedCSafeLoader(_LimitedComposer, yaml.CSafeLoader):
+        # The Python composer runs on top of libyaml's event stream.
+        def __init__(self, stream: Any) -> None:
+            yaml.CSafeLoader.__init__(self, stream)
+            self._reset_limits()
+
+
+def load_yaml_limited(stream: str | bytes, *, max_nodes: int, max_depth: int) -> Any:
+    """`load_yaml` for untrusted input; raises `YamlLimitError` past `max_nodes` or `max_depth`."""
+    loader = _limited_loader(stream, max_nodes=max_nodes, max_depth=max_depth)
+    try:
+        return loader.get_single_data()
+    finally:
+        loader.dispose()
+
+
+@dataclass(frozen=True)
+class YamlDocument:
+    value: Any = None
+    error: yaml.YAMLError | None = None
+
+
+_DOCUMENT_MARKER_RE = re.compile("(---|\\.\\.\\.)(?=[ \t\r\n\x85\u2028\u2029]|$)")
+# Lines as YAML counts them (`str.splitlines` also breaks on form feeds and others).
+_YAML_LINE_RE = re.compile("[^\r\n\x85\u2028\u2029]*(?:\r\n|[\r\n\x85\u2028\u2029])|[^\r\n\x85\u2028\u2029]+$")
+
+
+def split_yaml_documents(stream: str | bytes) -> list[tuple[int, str]]:
+    """Split a multi-document stream into `(first line, source)` per document, without parsing it.
+
+    Splits on `---` / `...` markers at the start of a line, which YAML never
+    allows inside a document. Bytes must be UTF-8.
+    """
+    text = stream.decode("utf-8") if isinstance(stream, bytes) else stream
+    docs: list[tuple[int, str]] = []
+    lines: list[str] = []
+    start = 0
+    is_open = False
+    for lineno, line in enumerate(_YAML_LINE_RE.findall(text)):
+        marker = _DOCUMENT_MARKER_RE.match(line)
+        if marker is not None and marker.group(1) == "---":
+            if is_open:
+                docs.append((start, "".join(lines)))
+                lines, start = [], lineno
+            lines.append(line)
+            is_open = True
+        elif marker is not None:
+            if is_open:
+                docs.append((start, "".join(lines) + line))
+            # Directives and comments after `...` belong to the next document.
+            lines, start, is_open = [], lineno + 1, False
+        else:
+            lines.append(line)
+            stripped = line.strip()
+            if stripped and not stripped.startswith("#") and (is_open or not line.startswith("%")):
+                is_open = True
+    if is_open:
+        docs.append((start, "".join(lines)))
+    return docs
+
+
+def load_yaml_documents_limited(
+    documents: Iterable[tuple[int, str]], *, max_nodes: int, max_depth: int
+) -> list[YamlDocument]:
+    """Load each document from `split_yaml_documents` on its own.
+
+    A document that fails to parse (or passes a limit) carries its error, with line
+    numbers of the whole stream, and does not affect the others. `max_nodes` bounds
+    all documents together.
+    """
+    out: list[YamlDocument] = []
+    used = 0
+    for start, source in documents:
+        loader = _limited_loader(source, max_nodes=max_nodes, max_depth=max_depth)
+        loader._node_count = used
+        loader._limit_scope = "stream"
+        try:
+            out.append(YamlDocument(value=loader.get_single_data()))
+        except yaml.YAMLError as exc:
+            if isinstance(exc, yaml.MarkedYAMLError) and start:
+                exc.context_mark = _shift_mark(exc.context_mark, start)
+                exc.problem_mark = _shift_mark(exc.problem_mark, start)
+            out.append(YamlDocument(error=exc))
+        finally:
+            used = loader._node_count
+            loader.dispose()
+    return out
+
+
+def _shift_mark(mark: Any, lines: int) -> yaml.Mark | None:
+    # libyaml's marks are read-only, so build a new one (without the source snippet).
+    if mark is None:
+        return None
+    return yaml.Mark(mark.name, mark.index, mark.line + lines, mark.column, None, None)
+
+
+def _limited_loader(stream: str | bytes, *, max_nodes: int, max_depth: int) -> _LimitedComposer:
+    loader_cls = _LimitedCSafeLoader if _backend == "libyaml" else _LimitedSafeLoader
+    loader = loader_cls(stream)
+    loader.max_nodes = max_nodes
+    loader.max_depth = max_depth
+    return loader
+
+
+class _ComposingSafeLoader(yaml.SafeLoader):
+    pass
+
+
+if HAS_LIBYAML:
+
+    class _ComposingCSafeLoader(yaml.composer.Composer, yaml.CSafeLoader):
+        # The Python composer (which can compose one node at a time) on libyaml's events.
+        def __init__(self, stream: Any) -> None:
+            yaml.CSafeLoader.__init__(self, stream)
+            yaml.composer.Composer.__init__(self)
+
+
+def iter_yaml_sequence(stream: str | bytes | BinaryIO, *, keys: tuple[str, ...] = ()) -> Iterator[Any]:
+    """Yield the items of a document's top-level sequence one at a time.
+
+    If the document is a mapping, the sequence is the value of the first of `keys`
+    (in the order given) that holds a non-empty value; a non-empty value that is not
+    a sequence yields nothing. The preferred key's sequence is constructed item by
+    item; other values are skipped at the event level (their anchors are kept for
+    later aliases) and parsing stops once it has been read. A lower-ranked key seen
+    before a preferred one is composed and held until the preferred key is ruled out.
+    Bytes are decoded as UTF-8 with replacement characters.
+    """
+    if isinstance(stream, bytes):
+        stream = io.BytesIO(stream)
+    if not isinstance(stream, str):
+        stream = io.TextIOWrapper(stream, encoding="utf-8", errors="replace")
+    loader = _ComposingCSafeLoader(stream) if _backend == "libyaml" else _ComposingSafeLoader(stream)
+    try:
+        loader.get_event()  # StreamStart
+        if loader.check_event(yaml.StreamEndEvent):
+            return
+        loader.get_event()  # DocumentStart
+        if loader.check_event(yaml.SequenceStartEvent):
+            yield from _iter_sequence_items(loader)
+            return
+        if not loader.check_event(yaml.MappingStartEvent):
+            return
+        loader.get_event()
+        ranks = {key: rank for rank, key in enumerate(keys)}
+        held: dict[int, yaml.Node] = {}
+        wanted = 0
+        while wanted < len(keys) and not loader.check_event(yaml.MappingEndEvent):
+            key = loader.construct_document(loader.compose_node(None, None))
+            rank = ranks.get(key) if isinstance(key, str) else None
+            if rank is None or rank < wanted:
+                _skip_node(loader)
+                continue
+            if rank > wanted:
+                held[rank] = loader.compose_node(None, None)
+                continue
+            if loader.check_event(yaml.SequenceStartEvent):
+                loader.get_event()
+                if not loader.check_event(yaml.SequenceEndEvent):
+                    yield from _iter_sequence_items(loader, started=True)
+                    return
+                loader.get_event()
+            else:
+                items = _non_empty_items(loader.construct_document(loader.compose_node(None, None)))
+                if items is not None:
+                    yield from items
+                    return
+            wanted += 1
+            while wanted in held:
+                items = _non_empty_items(loader.construct_document(held.pop(wanted)))
+                if items is not None:
+                    yield from items
+                    return
+                wanted += 1
+        for rank in sorted(held):
+            items = _non_empty_items(loader.construct_document(held[rank]))
+            if items is not None:
+                yield from items
+                return
+    finally:
+        loader.dispose()
+
+
+def _non_empty_items(value: Any) -> list[Any] | None:
+    """None for an empty value (the next key is tried), else the items it holds."""
+    if not value:
+        return None
+    return value if isinstance(value, list) else []
+
+
+def _iter_sequence_items(loader: Any, *, started: bool = False) -> Iterator[Any]:
+    if not started:
+        loader.get_event()
+    while not loader.check_event(yaml.SequenceEndEvent):
+        yield loader.construct_document(loader.compose_node(None, None))
+    loader.get_event()
+
+
+def _skip_node(loader: Any) -> None:
+    depth = 0
+    while True:
+        event = loader.peek_event()
+        if getattr(event, "anchor", None) is not None and not isinstance(event, yaml.AliasEvent):
+            loader.compose_node(None, None)
+        else:
+            loader.get_event()
+            if isinstance(event, (yaml.SequenceStartEvent, yaml.MappingStartEvent)):
+                depth += 1
+                continue
+            if isinstance(event, (yaml.SequenceEndEvent, yaml.MappingEndEvent)):
+                depth -= 1
+        if depth == 0:
+            return
 
 
 def load_yaml_file(path: Any) -> Any:
     file_path = Path(path)
     text = file_path.read_text(encoding="utf-8")
-    return yaml.safe_load(text)
+    return load_yaml(text)
+
+
+def clone_yaml_tree(data: Any, _memo: dict[int, Any] | None = None) -> Any:
+    """Copy the containers of a parsed YAML tree, sharing immutable scalars.
+
+    Much cheaper than `copy.deepcopy` for plain YAML data; shared containers stay
+    shared in the copy so aliases are emitted exactly as for the original.
+    """
+    if isinstance(data, dict):
+        if _memo is None:
+            _memo = {}
+        copied = _memo.get(id(data))
+        if copied is None:
+            copied = _memo[id(data)] = type(data)()
+            for key, value in data.items():
+                copied[key] = clone_yaml_tree(value, _memo)
+        return copied
+    if isinstance(data, list):
+        if _memo is None:
+            _memo = {}
+        copied = _memo.get(id(data))
+        if copied is None:
+            copied = _memo[id(data)] = type(data)()
+            copied.extend(clone_yaml_tree(item, _memo) for item in data)
+        return copied
+    return data
+
+
+def fingerprint_yaml_tree(data: Any) -> str:
+    """Hash a parsed YAML tree so that equal hashes imply identical `dump_yaml` output.
+
+    Formatting, comments and quoting of the source do not matter; key order, scalar
+    types and shared (aliased) nodes do.
+    """
+    hasher = hashlib.sha256()
+    seen: dict[int, int] = {}
+
+    def visit(node: Any) -> None:
+        if isinstance(node, (dict, list)):
+            ref = seen.get(id(node))
+            if ref is not None:
+                hasher.update(b"*%d;" % ref)
+                return
+            seen[id(node)] = len(seen)
+            if isinstance(node, dict):
+                hasher.update(b"{%d;" % len(node))
+                for key, value in node.items():
+                    visit(key)
+                    visit(value)
+            else:
+                hasher.update(b"[%d;" % len(node))
+                for item in node:
+                    visit(item)
+            return
+        hasher.update(repr((type(node).__name__, node)).encode("utf-8", "surrogatepass"))
+        hasher.update(b";")
+
+    visit(data)
+    return hasher.hexdigest()
+
+
+def has_shared_nodes(data: Any) -> bool:
+    """Return True if any dict/list occurs more than once, i.e. `dump_yaml` would emit aliases."""
+    seen: set[int] = set()
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, DetachedMap):
+            # Its own alias scope: sharing with the rest of the tree is not emitted.
+            if has_shared_nodes(list(node.values())):
+                return True
+        elif isinstance(node, dict):
+            if id(node) in seen:
+                return True
+            seen.add(id(node))
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            if id(node) in seen:
+                return True
+            seen.add(id(node))
+            stack.extend(node)
+    return False
+
+
+@dataclass(frozen=True)
+class YamlCacheStats:
+    hits: int
+    misses: int
+    entries: int
+
+
+@dataclass(frozen=True)
+class _CachedYamlFile:
+    mtime_ns: int
+    size: int
+    doc: Any
+
+
+class YamlFileCache:
+    """Keeps parsed YAML files in memory, re-parsing when mtime or size changes.
+
+    `load` always returns an isolated copy, so callers may mutate the result.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[Path, _CachedYamlFile] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def load(self, path: Any) -> Any:
+        doc, _ = self.load_with_version(path)
+        return doc
+
+    def load_with_version(self, path: Any) -> tuple[Any, tuple[int, int]]:
+        """Like `load`, also returning the (mtime_ns, size) version the copy was made from."""
+        file_path = Path(path).resolve()
+        stat = os.stat(file_path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is not None and (entry.mtime_ns, entry.size) == version:
+                self._hits += 1
+                return clone_yaml_tree(entry.doc), version
+
+        doc = load_yaml_file(file_path)
+        with self._lock:
+            self._misses += 1
+            self._entries[file_path] = _CachedYamlFile(mtime_ns=stat.st_mtime_ns, size=stat.st_size, doc=doc)
+        return clone_yaml_tree(doc), version
+
+    def version(self, path: Any) -> tuple[int, int]:
+        """Return the (mtime_ns, size) pair that `load` uses to validate its cache entry."""
+        stat = os.stat(Path(path).resolve())
+        return stat.st_mtime_ns, stat.st_size
+
+    def stats(self) -> YamlCacheStats:
+        with self._lock:
+            return YamlCacheStats(hits=self._hits, misses=self._misses, entries=len(self._entries))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._hits = 0
+            self._misses = 0
 
 
 def dump_yaml(data: Any) -> str:
+    return _dump_yaml_with(data, _CustomDumper)
+
+
+def _dump_yaml_with(data: Any, dumper: type) -> str:
     return yaml.dump(
         data,
         sort_keys=False,
         allow_unicode=True,
         default_flow_style=False,
-        Dumper=_CustomDumper,
+        Dumper=dumper,
     )
 
 
@@ -45,3 +533,13 @@ def write_yaml_atomic(data: Any, path: Any) -> Path:
     tmp_path.write_text(dump_yaml(data), encoding="utf-8")
     tmp_path.replace(output_path)
     return output_path
+
+
+def write_bytes_atomic(data: bytes, path: Any) -> Path:
+    output_path = Path(path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = output_path.with_suffix(output_path.suffix + ".tmp")
+    tmp_path.write_bytes(data)
+    tmp_path.replace(output_path)
+    return output_path
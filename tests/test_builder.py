@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import pytest
+
+from proxysub import builder
+
+SUBS = {"proxies": [{"name": "a", "type": "ss", "server": "192.0.2.1", "port": 443}]}
+
+
+def test_default_health_check_is_shared_read_only(tmp_path: Path) -> None:
+    template = tmp_path / "template.yaml"
+    template.write_text("proxies: []\nproxy-groups: []\nrules: [MATCH,DIRECT]\n", encoding="utf-8")
+    providers_doc = {"A": {"url": "https://example.com/a.yaml"}, "B": {"url": "https://example.com/b.yaml"}}
+    subs = {**SUBS, "proxy-providers": providers_doc}
+    config, _ = builder.build_config_from_doc(template_path=template, subs_doc=subs)
+    before = builder.render_yaml_from_doc(template_path=template, subs_doc=subs)
+    providers = config["proxy-providers"]
+
+    assert providers["A"]["health-check"] is providers["B"]["health-check"]
+    with pytest.raises(TypeError):
+        providers["A"]["health-check"]["interval"] = 60
+    providers["A"]["health-check"] = {**providers["A"]["health-check"], "interval": 60}
+
+    assert providers["B"]["health-check"]["interval"] == 300
+    assert builder.render_yaml_from_doc(template_path=template, subs_doc=subs) == before
+    assert "&id" not in before and before.count("generate_204\n      interval: 300") == 2
+
+
+def test_static_sections_are_keyed_on_the_optimizer_mode(tmp_path: Path) -> None:
+    template = tmp_path / "template.yaml"
+    template.write_text(
+        "proxies: []\n"
+        "rule-providers:\n  unused: {type: http, behavior: domain, url: https://example.com/u.mrs}\n"
+        "rules:\n  - DOMAIN,a.example,DIRECT\n  - DOMAIN,a.example,DIRECT\n  - MATCH,DIRECT\n",
+        encoding="utf-8",
+    )
+    previous = builder.get_rule_optimizer_mode()
+    try:
+        builder.set_rule_optimizer_mode("off")
+        # A render that read the mode before a concurrent switch stores its static text late.
+        doc, version = builder._load_template_doc_with_version(template)
+        stale_key = builder._static_key(template, version)
+        builder.set_rule_optimizer_mode("apply")
+        builder._dump_spliced(doc, static_key=stale_key)
+
+        spliced = builder.render_yaml_from_doc(template_path=template, subs_doc=SUBS)
+        full = builder.render_yaml_from_doc(template_path=template, subs_doc=SUBS, splice=False)
+        assert spliced == full
+        assert "unused" not in spliced and spliced.count("a.example") == 1
+    finally:
+        builder.set_rule_optimizer_mode(previous)
+
+
+def test_template_edits_invalidate_template_and_static_caches(tmp_path: Path) -> None:
+    template = tmp_path / "template.yaml"
+    template.write_text("proxies: []\nrules:\n  - DOMAIN,a.example,DIRECT\n  - MATCH,DIRECT\n", encoding="utf-8")
+    stat = template.stat()
+    first = builder.render_yaml_from_doc(template_path=template, subs_doc=SUBS)
+    assert "a.example" in first
+
+    # Same size, new mtime.
+    template.write_text("proxies: []\nrules:\n  - DOMAIN,b.example,DIRECT\n  - MATCH,DIRECT\n", encoding="utf-8")
+    os.utime(template, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    second = builder.render_yaml_from_doc(template_path=template, subs_doc=SUBS)
+    assert "b.example" in second and "a.example" not in second
+
+    # New size, mtime put back to the previous one.
+    mtime_ns = template.stat().st_mtime_ns
+    template.write_text("proxies: []\nrules:\n  - DOMAIN,cc.example,DIRECT\n  - MATCH,DIRECT\n", encoding="utf-8")
+    os.utime(template, ns=(stat.st_atime_ns, mtime_ns))
+    third = builder.render_yaml_from_doc(template_path=template, subs_doc=SUBS)
+    assert "cc.example" in third and "b.example" not in third
+
+    assert third == builder.render_yaml_from_doc(template_path=template, subs_doc=SUBS, splice=False)
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import pytest
+
+from proxysub.builder import render_yaml_from_doc
+from proxysub.cli import main
+from proxysub.yamlio import load_yaml_file
+
+TEMPLATE_PATH = Path(__file__).resolve().parent.parent / "templates" / "ryan.yaml"
+
+
+def _write_subs(path: Path, name: str) -> None:
+    path.write_text(f"proxies:\n  - {{name: {name}, type: ss, server: 192.0.2.1, port: 443}}\n", encoding="utf-8")
+
+
+def test_builds_inputs_and_skips_unchanged(tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    subs_dir, out_dir = tmp_path / "subs", tmp_path / "out"
+    subs_dir.mkdir()
+    _write_subs(subs_dir / "a.yaml", "US-A")
+    _write_subs(subs_dir / "b.yml", "JP-B")
+    (subs_dir / "notes.txt").write_text("not a subs file", encoding="utf-8")
+    argv = ["-t", str(TEMPLATE_PATH), "-o", str(out_dir), "--incremental", str(subs_dir)]
+
+    assert main([*argv, "-j", "2"]) == 0
+    assert "built 2, skipped 0, failed 0" in capsys.readouterr().out
+    assert sorted(path.name for path in out_dir.iterdir()) == ["a.yaml", "b.yaml"]
+    for name in ("a", "b"):
+        subs_path = next(subs_dir.glob(f"{name}.y*ml"))
+        expected = render_yaml_from_doc(template_path=TEMPLATE_PATH, subs_doc=load_yaml_file(subs_path))
+        assert (out_dir / f"{name}.yaml").read_text(encoding="utf-8") == expected
+
+    assert main([*argv, "-j", "1"]) == 0
+    assert "built 0, skipped 2, failed 0" in capsys.readouterr().out
+
+    # Edit one input; its output is rebuilt, the other is still skipped.
+    _write_subs(subs_dir / "b.yml", "JP-C")
+    output_mtime = (out_dir / "b.yaml").stat().st_mtime_ns
+    os.utime(subs_dir / "b.yml", ns=(output_mtime + 1_000_000_000, output_mtime + 1_000_000_000))
+    assert main([*argv, "-j", "1"]) == 0
+    assert "built 1, skipped 1, failed 0" in capsys.readouterr().out
+    assert "JP-C" in (out_dir / "b.yaml").read_text(encoding="utf-8")
+
+
+def test_missing_input_exits_with_usage_error(tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    assert main(["-t", str(TEMPLATE_PATH), "-o", str(tmp_path), str(tmp_path / "missing.yaml")]) == 2
+    assert "no subs files match" in capsys.readouterr().err
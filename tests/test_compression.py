@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+import pytest
+
+from proxysub.compression import negotiate_encoding
+
+AVAILABLE = ("br", "gzip")
+
+
+@pytest.mark.parametrize(
+    ("accept_encoding", "expected"),
+    [
+        (None, None),
+        ("", None),
+        ("gzip", "gzip"),
+        ("gzip, br", "br"),
+        ("gzip;q=1.0, br;q=0.5", "gzip"),
+        ("GZIP ; Q=0.8, br;q=0.2", "gzip"),
+        ("x-gzip", "gzip"),
+        ("deflate", None),
+        ("gzip;q=0", None),
+        ("gzip;q=oops, br;q=0.1", "br"),
+        ("*", "br"),
+        ("*;q=0.5, br;q=0.1", "gzip"),
+        ("*;q=0, gzip", "gzip"),
+        ("identity;q=0", None),
+        ("identity;q=0, *", "br"),
+        ("gzip;q=0.5, identity", None),
+        ("gzip, identity;q=0.5", "gzip"),
+        ("gzip;q=0.5, identity;q=0.5", "gzip"),
+    ],
+)
+def test_negotiate_encoding(accept_encoding: str | None, expected: str | None) -> None:
+    assert negotiate_encoding(accept_encoding, AVAILABLE) == expected
+
+
+def test_negotiate_encoding_without_variants() -> None:
+    assert negotiate_encoding("gzip, br", ()) is None
+    assert negotiate_encoding("*", {}) is None
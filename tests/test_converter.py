@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import time
+from typing import Any
+
+from proxysub.converter import WEST_COWBOY_GROUP_NAME, apply_profile_script
+
+_BASE = 1000
+_SCALE = 8
+
+
+def _config(n: int) -> dict[str, Any]:
+    proxies = [{"name": "US-Home", "type": "http", "server": "203.0.113.10", "port": 3128}]
+    proxies += [{"name": f"{'美国' if i % 2 else '日本'} 节点 {i:05d}", "type": "ss"} for i in range(n)]
+    groups = [
+        {"name": f"分组 {i:05d}", "type": "select", "proxies": ["DIRECT", proxies[i + 1]["name"], "DIRECT"]}
+        for i in range(n)
+    ]
+    return {"proxies": proxies, "proxy-groups": groups}
+
+
+def _best_time(n: int, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        config = _config(n)
+        started = time.perf_counter()
+        apply_profile_script(config, us_home_proxy_name="US-Home")
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def test_profile_script_scales_linearly() -> None:
+    _best_time(_BASE, repeat=1)
+    ratio = _best_time(_BASE * _SCALE) / _best_time(_BASE)
+    # Linear work gives ~8x; a quadratic pass over groups or proxies would give ~64x.
+    assert ratio < _SCALE * 3, f"8x input took {ratio:.1f}x as long"
+
+
+def test_profile_script_fills_west_cowboy_group() -> None:
+    config = apply_profile_script(_config(4), us_home_proxy_name="US-Home")
+    groups = {group["name"]: group for group in config["proxy-groups"]}
+
+    assert groups[WEST_COWBOY_GROUP_NAME]["proxies"] == ["美国 节点 00001", "美国 节点 00003"]
+    assert groups["分组 00000"]["proxies"] == ["DIRECT", "日本 节点 00000", "US-Home"]
+    assert config["proxies"][0]["dialer-proxy"] == WEST_COWBOY_GROUP_NAME
@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+from typing import Any
+
+import pytest
+
+from proxysub import subscriptions
+from proxysub.dedupe import dedupe_proxies
+from proxysub.fetch import FetchResult
+
+
+def _proxy(name: str, server: str = "192.0.2.1") -> dict[str, Any]:
+    return {"name": name, "type": "ss", "server": server, "port": 8388, "cipher": "aes-128-gcm", "password": "x"}
+
+
+def test_off_keeps_shared_endpoints_and_drops_repeated_names() -> None:
+    result = dedupe_proxies([_proxy("A"), _proxy("B"), _proxy("A", "192.0.2.9")], policy="off")
+
+    assert [p["name"] for p in result.proxies] == ["A", "B"]
+    assert result.proxies[0]["server"] == "192.0.2.1"
+    assert (result.collapsed, result.duplicate_names) == (0, 1)
+
+
+def test_subscription_fetch_dedupes_only_when_opted_in(monkeypatch: pytest.MonkeyPatch) -> None:
+    fetched = {
+        "https://a.example/sub": [_proxy("HK 01"), _proxy("JP 01", "192.0.2.2")],
+        "https://b.example/sub": [_proxy("HK 01", "192.0.2.3"), _proxy("JP 02", "192.0.2.2")],
+    }
+    monkeypatch.setattr(
+        subscriptions,
+        "fetch_subscriptions",
+        lambda urls, **_: [FetchResult(url=url, value=fetched[url]) for url in urls],
+    )
+
+    proxies = subscriptions.fetch_subscription_proxies(list(fetched), dedupe_policy="off")
+    assert proxies == [*fetched["https://a.example/sub"], *fetched["https://b.example/sub"]]
+
+    proxies = subscriptions.fetch_subscription_proxies(list(fetched), dedupe_policy="first")
+    assert [p["name"] for p in proxies] == ["HK 01", "JP 01"]
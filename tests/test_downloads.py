@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import multiprocessing
+import random
+import sqlite3
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any
+
+from proxysub import metrics
+from proxysub.downloads import MemoryDownloadStore, SqliteDownloadStore, run_reaper
+
+_WORKERS = 4
+_TOKENS = 200
+
+
+def _take_all(db_path: str, tokens: list[str], seed: int, start: Any, results: Any) -> None:
+    store = SqliteDownloadStore(ttl_s=600, db_path=Path(db_path))
+    order = list(tokens)
+    random.Random(seed).shuffle(order)
+    start.wait()
+    taken = []
+    for token in order:
+        item = store.take(token)
+        if item is not None:
+            assert item.data == f"config {token}".encode()
+            taken.append(token)
+    store.close()
+    results.put(taken)
+
+
+def test_concurrent_take_consumes_each_token_once(tmp_path: Path) -> None:
+    db_path = tmp_path / "downloads.sqlite3"
+    store = SqliteDownloadStore(ttl_s=600, db_path=db_path)
+    tokens = [store.reserve_token() for _ in range(_TOKENS)]
+    for token in tokens:
+        store.put(token, f"config {token}".encode(), variants={"gzip": b"gz"})
+    store.close()
+
+    ctx = multiprocessing.get_context("spawn")
+    start = ctx.Event()
+    results = ctx.Queue()
+    workers = [
+        ctx.Process(target=_take_all, args=(str(db_path), tokens, seed, start, results)) for seed in range(_WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+    start.set()
+    taken = Counter(token for _ in workers for token in results.get(timeout=60))
+    for worker in workers:
+        worker.join(timeout=60)
+        assert worker.exitcode == 0
+
+    assert set(taken) == set(tokens)
+    assert all(count == 1 for count in taken.values())
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM one_time_downloads").fetchone() == (0,)
+        assert conn.execute("SELECT COUNT(*) FROM one_time_download_variants").fetchone() == (0,)
+
+
+def test_expired_rows_are_removed_after_ttl(tmp_path: Path) -> None:
+    store = SqliteDownloadStore(ttl_s=60, db_path=tmp_path / "downloads.sqlite3")
+    store.put("old", b"old", variants={"gzip": b"o"}, now=1000.0)
+    store.put("fresh", b"fresh", now=1050.0)
+
+    assert store.cleanup(now=1059.0) == 0
+    assert store.cleanup(now=1061.0) == 1
+    assert store.stats().outstanding == 1
+    assert store.take("old", now=1061.0) is None
+    with sqlite3.connect(store.db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM one_time_download_variants").fetchone() == (0,)
+
+    # A token past its TTL is not served even before the reaper runs.
+    assert store.take("fresh", now=1111.0) is None
+    assert store.stats().outstanding == 0
+    store.close()
+
+
+def test_memory_store_expires_in_created_at_order() -> None:
+    store = MemoryDownloadStore(ttl_s=60)
+    for token, created_at in [("c", 1030.0), ("a", 1000.0), ("d", 1045.0), ("b", 1010.0)]:
+        store.put(token, token.encode() * 10, now=created_at)
+    # A consumed token leaves a stale heap entry behind, also when the token is reused.
+    assert store.take("b", now=1020.0) is not None
+    store.put("b", b"again", now=1040.0)
+
+    assert store.cleanup(now=1060.0) == 0
+    assert store.cleanup(now=1071.0) == 1
+    assert store.take("a", now=1071.0) is None
+    assert store.cleanup(now=1091.0) == 1
+    assert store.take("c", now=1091.0) is None
+    assert store.cleanup(now=1101.0) == 1
+    assert store.take("b", now=1101.0) is None
+    assert store.take("d", now=1101.0) is not None
+    stats = store.stats()
+    assert (stats.outstanding, stats.outstanding_bytes) == (0, 0)
+    assert (stats.reclaimed, stats.reclaimed_bytes) == (3, 10 + 10 + 5)
+
+
+def test_reaper_counts_reclaimed_bytes() -> None:
+    store = MemoryDownloadStore(ttl_s=60)
+    store.put("old", b"x" * 100, variants={"gzip": b"g" * 10}, now=time.time() - 120)
+    store.put("new", b"y" * 50)
+    reclaimed = metrics.DOWNLOADS_RECLAIMED.value()
+    reclaimed_bytes = metrics.DOWNLOAD_RECLAIMED_BYTES.value()
+
+    async def run_briefly() -> None:
+        reaper = asyncio.create_task(run_reaper(store, interval_s=0.01))
+        await asyncio.sleep(0.1)
+        reaper.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await reaper
+
+    asyncio.run(run_briefly())
+
+    assert metrics.DOWNLOADS_RECLAIMED.value() - reclaimed == 1
+    assert metrics.DOWNLOAD_RECLAIMED_BYTES.value() - reclaimed_bytes == 110
+    assert store.take("new") is not None
+    assert "proxysub_download_reclaimed_bytes_total" in metrics.REGISTRY.render()
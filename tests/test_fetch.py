@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from proxysub.fetch import FetchError, HttpConnectionPool, fetch_concurrently
+
+
+class _Stats:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.connections = 0
+        self.requests = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stats: _Stats
+
+    def setup(self) -> None:
+        super().setup()
+        with self.stats.lock:
+            self.stats.connections += 1
+
+    def do_GET(self) -> None:
+        stats = self.stats
+        with stats.lock:
+            stats.requests += 1
+            stats.in_flight += 1
+            stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+        try:
+            kind, _, arg = self.path.partition("?")[0].strip("/").partition("/")
+            if kind == "sleep":
+                time.sleep(float(arg))
+            status = 404 if kind == "missing" else 200
+            body = self.path.encode()
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with stats.lock:
+                stats.in_flight -= 1
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+@pytest.fixture
+def server() -> Iterator[tuple[str, _Stats]]:
+    stats = _Stats()
+    handler = type("Handler", (_Handler,), {"stats": stats})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{httpd.server_address[1]}", stats
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def _get_body(pool: HttpConnectionPool, url: str, timeout_s: float) -> bytes:
+    resp = pool.request(url, timeout_s=timeout_s)
+    if resp.status >= 400:
+        raise FetchError(f"HTTP Error {resp.status}")
+    return resp.body
+
+
+def test_results_in_input_order_within_per_host_limit(server: tuple[str, _Stats]) -> None:
+    base, stats = server
+    # Later urls finish first, so completion order differs from input order.
+    paths = [f"/sleep/{0.02 * (8 - i):.2f}" for i in range(8)]
+
+    results = fetch_concurrently(
+        [base + path for path in paths], _get_body, max_concurrency=8, per_host_concurrency=2, timeout_s=5
+    )
+
+    assert [result.url for result in results] == [base + path for path in paths]
+    assert [result.value for result in results] == [path.encode() for path in paths]
+    assert all(result.error is None for result in results)
+    assert stats.max_in_flight == 2
+
+
+def test_keep_alive_connections_are_reused(server: tuple[str, _Stats]) -> None:
+    base, stats = server
+    pool = HttpConnectionPool(max_idle_per_host=2)
+    urls = [f"{base}/sleep/0.01?n={i}" for i in range(12)]
+
+    first = fetch_concurrently(urls, _get_body, per_host_concurrency=2, timeout_s=5, pool=pool)
+    second = fetch_concurrently(urls, _get_body, per_host_concurrency=2, timeout_s=5, pool=pool)
+    pool.close()
+
+    assert all(result.error is None for result in first + second)
+    assert stats.requests == 2 * len(urls)
+    assert stats.connections <= 2
+
+
+def test_errors_and_deadline_are_reported_per_url(server: tuple[str, _Stats]) -> None:
+    base, _ = server
+    urls = [f"{base}/sleep/0", f"{base}/missing", f"{base}/sleep/3"]
+
+    started = time.monotonic()
+    results = fetch_concurrently(urls, _get_body, timeout_s=5, deadline_s=0.5)
+    elapsed = time.monotonic() - started
+
+    assert elapsed < 2
+    assert [result.url for result in results] == urls
+    assert results[0].value == b"/sleep/0" and results[0].error is None
+    assert results[1].value is None and results[1].error == "HTTP Error 404"
+    assert results[2].value is None and results[2].error == "deadline exceeded"
+
+
+def test_slow_host_does_not_hold_threads_from_other_hosts(server: tuple[str, _Stats]) -> None:
+    base, _ = server
+    port = base.rsplit(":", 1)[1]
+    # Same server, two host names: one slow host and one fast host.
+    slow = [f"http://127.0.0.1:{port}/sleep/0.4?n={i}" for i in range(4)]
+    fast = [f"http://localhost:{port}/sleep/0?n={i}" for i in range(4)]
+
+    results = fetch_concurrently(
+        slow + fast, _get_body, max_concurrency=2, per_host_concurrency=1, timeout_s=5, deadline_s=1.0
+    )
+
+    by_url = {result.url: result for result in results}
+    assert all(by_url[url].error is None for url in fast)
+    assert by_url[slow[0]].error is None
+    assert by_url[slow[-1]].error == "deadline exceeded"
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from proxysub.fetch import HttpResponse
+from proxysub.fetchcache import SubscriptionCache
+from proxysub.subscriptions import _fetch_subscription
+
+_BODY = b"proxies:\n  - {name: a, type: ss, server: 192.0.2.1, port: 443}\n"
+
+
+class _StubPool:
+    def __init__(self, *responses: HttpResponse) -> None:
+        self.responses = list(responses)
+        self.requests: list[dict[str, str]] = []
+
+    def request(self, url: str, *, headers: dict[str, str] | None = None, timeout_s: float) -> HttpResponse:
+        self.requests.append(dict(headers or {}))
+        return self.responses.pop(0)
+
+
+def _response(status: int, body: bytes = b"", **headers: str) -> HttpResponse:
+    return HttpResponse(url="https://sub.example/a", status=status, headers=headers, body=body)
+
+
+def test_max_age_serves_entries_without_revalidating(tmp_path: Path) -> None:
+    cache = SubscriptionCache(tmp_path, max_age_s=60)
+    cache.put("https://sub.example/a", body=_BODY, headers={}, proxies=[{"name": "a"}], now=1000)
+    entry = cache.get("https://sub.example/a")
+
+    assert entry is not None
+    assert cache.is_fresh(entry, now=1059)
+    assert not cache.is_fresh(entry, now=1060)
+    assert not SubscriptionCache(tmp_path).is_fresh(entry, now=1000)
+
+
+def test_not_modified_reuses_cached_proxies(tmp_path: Path) -> None:
+    cache = SubscriptionCache(tmp_path)
+    pool = _StubPool(
+        _response(200, _BODY, etag='"v1"', **{"last-modified": "Mon, 01 Jan 2024 00:00:00 GMT"}),
+        _response(304, etag='"v2"'),
+    )
+    first = _fetch_subscription(pool, "https://sub.example/a", 5, cache=cache)  # type: ignore[arg-type]
+    before = cache.get("https://sub.example/a")
+    second = _fetch_subscription(pool, "https://sub.example/a", 5, cache=cache)  # type: ignore[arg-type]
+    after = cache.get("https://sub.example/a")
+
+    assert first == second == [{"name": "a", "type": "ss", "server": "192.0.2.1", "port": 443}]
+    assert pool.requests == [
+        {},
+        {"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"},
+    ]
+    assert before is not None and after is not None
+    assert after.etag == '"v2"' and after.fetched_at >= before.fetched_at
+
+
+def test_fresh_entry_skips_the_network(tmp_path: Path) -> None:
+    cache = SubscriptionCache(tmp_path, max_age_s=3600)
+    pool = _StubPool(_response(200, _BODY))
+    _fetch_subscription(pool, "https://sub.example/a", 5, cache=cache)  # type: ignore[arg-type]
+    assert _fetch_subscription(pool, "https://sub.example/a", 5, cache=cache)[0]["name"] == "a"  # type: ignore[arg-type]
+    assert len(pool.requests) == 1
+
+
+def test_least_recently_validated_entries_are_evicted(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    SubscriptionCache(tmp_path).put("https://sub.example/old", body=b"x" * 40, headers={}, proxies=None, now=1)
+    # A new instance picks up entries already on disk.
+    cache = SubscriptionCache(tmp_path, max_bytes=100)
+    cache.put("https://sub.example/a", body=b"a" * 40, headers={}, proxies=None, now=2)
+    # Only the first put scans the directory; later puts use the in-memory sizes.
+    monkeypatch.setattr(Path, "glob", lambda *args: pytest.fail("directory scanned again"))
+    entry_a = cache.get("https://sub.example/a")
+    assert entry_a is not None
+    cache.put("https://sub.example/b", body=b"b" * 40, headers={}, proxies=None, now=3)
+    assert cache.get("https://sub.example/old") is None
+
+    cache.refresh(entry_a, headers={})
+    cache.put("https://sub.example/c", body=b"c" * 40, headers={}, proxies=None, now=4)
+    assert cache.get("https://sub.example/b") is None
+    assert cache.get("https://sub.example/a") is not None
+    assert cache.get("https://sub.example/c") is not None
+    assert len([path for path in tmp_path.iterdir() if path.suffix == ".body"]) == 2
+
+    cache.put("https://sub.example/big", body=b"z" * 101, headers={}, proxies=None)
+    assert cache.get("https://sub.example/big") is None
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import asyncio
+from collections.abc import AsyncIterator
+
+import pytest
+
+from proxysub.ingest import UploadInvalid, UploadTooLarge, read_multipart_file
+
+_BODY = (
+    b"--b\r\n"
+    b'Content-Disposition: form-data; name="file"; filename="subs.yaml"\r\n'
+    b"Content-Type: application/x-yaml\r\n\r\n"
+    b"proxies: []\r\n"
+    b"--b--\r\n"
+)
+
+
+def _read(body: bytes, *, chunk_size: int = 7, max_bytes: int = 1024) -> bytes:
+    async def chunks() -> AsyncIterator[bytes]:
+        for start in range(0, len(body), chunk_size):
+            yield body[start : start + chunk_size]
+
+    return asyncio.run(
+        read_multipart_file(
+            chunks(),
+            content_type="multipart/form-data; boundary=b",
+            content_length=None,
+            field_name="file",
+            max_bytes=max_bytes,
+        )
+    )
+
+
+def test_reads_file_field() -> None:
+    assert _read(_BODY) == b"proxies: []"
+
+
+@pytest.mark.parametrize("cut", [len(_BODY) - 3, _BODY.index(b"proxies") + 4, 30, 5])
+def test_truncated_body_is_invalid(cut: int) -> None:
+    with pytest.raises(UploadInvalid):
+        _read(_BODY[:cut])
+
+
+def test_oversized_body_is_rejected() -> None:
+    with pytest.raises(UploadTooLarge):
+        _read(_BODY, max_bytes=len(_BODY) - 1)
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections.abc import Iterator
+from typing import Any
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from proxysub.downloads import MemoryDownloadStore
+from proxysub.pool import BuildPool
+
+_FILES = {"file": ("subs.yaml", b"proxies: []\n", "application/x-yaml")}
+
+
+@pytest.fixture
+def client(monkeypatch: pytest.MonkeyPatch) -> Iterator[TestClient]:
+    monkeypatch.setattr(main, "_DOWNLOAD_STORE", MemoryDownloadStore(ttl_s=60))
+    # No `with`: the lifespan would start the module's build pool and reaper.
+    yield TestClient(main.app)
+
+
+def _wait_for(predicate: Any, timeout_s: float = 5) -> None:
+    deadline = time.monotonic() + timeout_s
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_full_build_queue_answers_503(client: TestClient, monkeypatch: pytest.MonkeyPatch) -> None:
+    build_pool = BuildPool(template_path=main.DEFAULT_TEMPLATE_PATH, workers=1, queue_limit=1)
+    release = threading.Event()
+
+    def blocked_render(*args: Any) -> tuple[bytes, dict[str, bytes]]:
+        release.wait(10)
+        return b"proxies: []\n", {}
+
+    monkeypatch.setattr(main, "_BUILD_POOL", build_pool)
+    monkeypatch.setattr(main, "render_upload_encoded", blocked_render)
+    statuses: list[int] = []
+    blocked = [
+        threading.Thread(target=lambda: statuses.append(client.post("/upload", files=_FILES).status_code))
+        for _ in range(build_pool.workers + build_pool.queue_limit)
+    ]
+    try:
+        for thread in blocked:
+            thread.start()
+        _wait_for(lambda: build_pool.in_flight == 2)
+
+        busy = client.post("/upload", files=_FILES)
+        assert busy.status_code == 503
+        assert build_pool.in_flight == 2
+    finally:
+        release.set()
+        for thread in blocked:
+            thread.join(10)
+        build_pool.shutdown()
+
+    assert statuses == [200, 200]
+    assert build_pool.in_flight == 0
+
+
+@pytest.mark.parametrize("path", ["/", "/templates/ryan.yaml"])
+def test_conditional_get_uses_weak_comparison(client: TestClient, path: str) -> None:
+    identity = {"Accept-Encoding": "identity"}
+    first = client.get(path, headers=identity)
+    etag = first.headers["etag"]
+    assert first.status_code == 200 and etag.startswith('"')
+
+    for if_none_match in [etag, f"W/{etag}", f'"other", {etag}', f'W/"other",W/{etag}', "*"]:
+        cached = client.get(path, headers={**identity, "If-None-Match": if_none_match})
+        assert cached.status_code == 304, if_none_match
+        assert cached.content == b""
+        assert cached.headers["etag"] == etag
+
+    for if_none_match in ['"other"', 'W/"other", "another"', etag[:-2] + '"']:
+        assert client.get(path, headers={**identity, "If-None-Match": if_none_match}).status_code == 200
+
+
+def test_template_etag_differs_per_encoding(client: TestClient) -> None:
+    plain = client.get("/templates/ryan.yaml", headers={"Accept-Encoding": "identity"})
+    gzipped = client.get("/templates/ryan.yaml", headers={"Accept-Encoding": "gzip"})
+
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert gzipped.content == plain.content
+    assert plain.headers["vary"] == gzipped.headers["vary"] == "Accept-Encoding"
+    plain_etag, gzip_etag = plain.headers["etag"], gzipped.headers["etag"]
+    assert gzip_etag == plain_etag[:-1] + '-gzip"'
+
+    def revalidate(encoding: str, etag: str) -> Any:
+        return client.get("/templates/ryan.yaml", headers={"Accept-Encoding": encoding, "If-None-Match": etag})
+
+    # A validator for one coding does not revalidate the other.
+    assert revalidate("gzip", plain_etag).status_code == 200
+    assert revalidate("identity", gzip_etag).status_code == 200
+    revalidated = revalidate("gzip", gzip_etag)
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == gzip_etag
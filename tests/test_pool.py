@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from proxysub import builder, pool
+from proxysub.ingest import UploadLimits
+from proxysub.yamlio import use_yaml_backend
+
+TEMPLATE_PATH = Path(__file__).resolve().parent.parent / "templates" / "ryan.yaml"
+SUBS = b"""proxies:
+  - {name: US-Home, type: ss, server: 192.0.2.1, port: 8388, cipher: aes-128-gcm, password: x}
+  - {name: "\\U0001F1EF\\U0001F1F5 JP", type: ss, server: 192.0.2.2, port: 8388, cipher: aes-128-gcm, password: x}
+"""
+
+
+@pytest.fixture
+def optimizer_mode():
+    previous = builder.get_rule_optimizer_mode()
+    yield builder.set_rule_optimizer_mode
+    builder.set_rule_optimizer_mode(previous)
+
+
+def test_output_cache_follows_rule_optimizer_mode(optimizer_mode) -> None:
+    optimizer_mode("off")
+    plain = pool.render_upload(TEMPLATE_PATH, SUBS)
+    optimizer_mode("apply")
+    optimized = pool.render_upload(TEMPLATE_PATH, SUBS)
+    assert optimized == builder.render_yaml_from_doc(
+        template_path=TEMPLATE_PATH, subs_doc=pool.load_yaml_limited(SUBS, max_nodes=10_000, max_depth=64)
+    ).encode("utf-8")
+    optimizer_mode("off")
+    assert pool.render_upload(TEMPLATE_PATH, SUBS) == plain
+
+
+def test_output_cache_key_includes_render_settings(optimizer_mode) -> None:
+    optimizer_mode("off")
+    doc = {"proxies": []}
+    with use_yaml_backend("python"):
+        python_key = pool._OUTPUT_CACHE.key_for(TEMPLATE_PATH, doc)
+    optimizer_mode("dry-run")
+    with use_yaml_backend("python"):
+        dry_run_key = pool._OUTPUT_CACHE.key_for(TEMPLATE_PATH, doc)
+    assert python_key != dry_run_key
+
+
+def test_batch_reports_yaml_errors_per_document() -> None:
+    raw = SUBS + b"---\nproxies: [\n---\n" + SUBS
+    items = pool.render_batch(TEMPLATE_PATH, raw)
+
+    assert [item.index for item in items] == [0, 1, 2]
+    assert items[0].error is None and items[2].error is None
+    assert items[0].rendered == items[2].rendered == pool.render_upload(TEMPLATE_PATH, SUBS)
+    assert items[1].rendered is None
+    assert items[1].error is not None and items[1].error.startswith("Invalid YAML:")
+    assert "line 6" in items[1].error
+
+
+def test_batch_node_limit_covers_the_whole_stream() -> None:
+    raw = b"---\n".join([SUBS] * 3)
+    limits = UploadLimits(max_nodes=60)
+    items = pool.render_batch(TEMPLATE_PATH, raw, limits)
+
+    assert items[0].error is None
+    assert items[-1].error is not None and "stream exceeds 60 nodes" in items[-1].error
+
+
+def test_output_cache_hit_reuses_compressed_variants(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls: list[int] = []
+    compress = pool.compress_variants
+
+    def counting_compress(data: bytes, encodings=None) -> dict[str, bytes]:
+        calls.append(len(data))
+        return compress(data, encodings)
+
+    monkeypatch.setattr(pool, "compress_variants", counting_compress)
+    subs = SUBS + b"  - {name: variants-test, type: ss, server: 192.0.2.3, port: 1, cipher: aes-128-gcm, password: x}\n"
+    first = pool.render_upload_encoded(TEMPLATE_PATH, subs)
+    second = pool.render_upload_encoded(TEMPLATE_PATH, subs)
+
+    assert first == second
+    assert "gzip" in first[1]
+    assert len(calls) == 1
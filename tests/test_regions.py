@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import gc
+import tracemalloc
+from collections.abc import Callable
+
+from proxysub import regions
+from proxysub.regions import RegionSpec, get_region_classifier
+
+
+def test_classifier_cache_is_bounded() -> None:
+    default = get_region_classifier()
+    first = (RegionSpec("R-first", keywords=("首个",)),)
+    first_classifier = get_region_classifier(first)
+    for i in range(regions._CLASSIFIERS_MAX_ENTRIES * 4):
+        custom = (RegionSpec(f"R{i}", keywords=(f"区域{i}",)),)
+        assert get_region_classifier(custom) is get_region_classifier(list(custom))
+        assert get_region_classifier(custom).classify(f"区域{i} 01") == f"R{i}"
+
+    assert get_region_classifier(first) is not first_classifier
+    assert get_region_classifier(first).classify("首个 01") == "R-first"
+    assert get_region_classifier().classify("美国 01") == "US"
+    assert default.regions == get_region_classifier().regions
+
+
+def _retained_bytes(fn: Callable[[], object]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        fn()
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def test_memo_memory_is_bounded() -> None:
+    classifier = regions.RegionClassifier(regions.DEFAULT_WEST_COWBOY_REGIONS)
+    names = (f"美国 高速 节点 {'x' * 40} {i:06d}" for i in range(60_000))
+    retained = _retained_bytes(lambda: classifier.classify_many(names))
+    # 60k names take ~11 MiB as strings; the memo keeps at most its byte budget of them.
+    assert retained < regions._MEMO_MAX_BYTES * 2
+
+    long_names = (f"日本 {i} " + "节点" * 5_000 for i in range(500))
+    assert _retained_bytes(lambda: classifier.classify_many(long_names)) < 1024 * 1024
+    assert classifier.classify("美国 01") == "US"
+    assert classifier.classify("日本 " + "节点" * 5_000) is None
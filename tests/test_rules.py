@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import copy
+import ipaddress
+import random
+from typing import Any
+
+import pytest
+
+from proxysub.rules import plan_rule_optimizations
+
+# A tiny model of Mihomo's first-match evaluation, including lazy DNS resolution.
+_RESOLVED = {
+    "www.example.com": "10.1.2.3",
+    "api.example.com": "10.2.0.1",
+    "example.com": "192.0.2.10",
+    "cdn.foo.net": "1.1.1.1",
+    "foo.net": "1.2.3.4",
+    "ads.tracker.org": "203.0.113.7",
+    "tracker.org": "10.1.9.9",
+    "google.com": "8.8.8.8",
+    "mail.google.com": "172.217.0.1",
+    "unlisted.test": "198.51.100.1",
+}
+SAMPLES: list[tuple[str | None, str]] = [(domain, ip) for domain, ip in _RESOLVED.items()] + [
+    (None, ip) for ip in ("10.1.2.3", "10.200.0.1", "1.1.1.1", "8.8.4.4", "192.0.2.99", "203.0.113.1")
+]
+PROVIDER_PAYLOADS = {
+    "ads": ("domain", ["+.tracker.org", "doubleclick.net"]),
+    "google": ("domain", ["+.google.com"]),
+    "private": ("ipcidr", ["10.0.0.0/8", "192.0.2.0/24"]),
+    "cloud": ("ipcidr", ["1.0.0.0/8", "8.8.8.0/24"]),
+}
+
+
+def _in_cidr(ip: str, cidr: str) -> bool:
+    return ipaddress.ip_address(ip) in ipaddress.ip_network(cidr, strict=False)
+
+
+def _domain_in_set(domain: str, entries: list[str]) -> bool:
+    for entry in entries:
+        if entry.startswith("+."):
+            suffix = entry[2:]
+            if domain == suffix or domain.endswith("." + suffix):
+                return True
+        elif domain == entry:
+            return True
+    return False
+
+
+def first_match(rules: list[str], domain: str | None, ip: str) -> str | None:
+    resolved = domain is None
+    for rule in rules:
+        kind, *fields = [f.strip() for f in rule.split(",")]
+        if kind in ("MATCH", "FINAL"):
+            return fields[0]
+        payload, target, params = fields[0], fields[1], fields[2:]
+        if kind == "DOMAIN":
+            hit = domain == payload
+        elif kind == "DOMAIN-SUFFIX":
+            hit = domain is not None and (domain == payload or domain.endswith("." + payload))
+        elif kind == "DOMAIN-KEYWORD":
+            hit = domain is not None and payload in domain
+        elif kind == "RULE-SET" and PROVIDER_PAYLOADS[payload][0] == "domain":
+            hit = domain is not None and _domain_in_set(domain, PROVIDER_PAYLOADS[payload][1])
+        elif kind in ("IP-CIDR", "RULE-SET"):
+            if not resolved:
+                if "no-resolve" in params:
+                    continue
+                resolved = True
+            cidrs = [payload] if kind == "IP-CIDR" else PROVIDER_PAYLOADS[payload][1]
+            hit = any(_in_cidr(ip, cidr) for cidr in cidrs)
+        else:
+            raise AssertionError(f"unsupported rule {rule}")
+        if hit:
+            return target
+    return None
+
+
+def _providers(*names: str) -> dict[str, Any]:
+    return {
+        name: {"type": "http", "behavior": PROVIDER_PAYLOADS[name][0], "url": f"https://example.com/{name}.mrs"}
+        for name in names
+    }
+
+
+def optimize(config: dict[str, Any]) -> tuple[dict[str, Any], Any]:
+    """Apply the plan to a copy and check every sample connection still gets the same target."""
+    plan = plan_rule_optimizations(config)
+    optimized = copy.deepcopy(config)
+    plan.apply(optimized)
+    for domain, ip in SAMPLES:
+        assert first_match(optimized["rules"], domain, ip) == first_match(config["rules"], domain, ip), (domain, ip)
+    return optimized, plan
+
+
+def test_drops_duplicates_and_shadowed_rules() -> None:
+    rules = [
+        "DOMAIN-SUFFIX,example.com,Proxy",
+        "DOMAIN,www.example.com,Direct",
+        "DOMAIN-KEYWORD,tracker,Reject",
+        "DOMAIN-SUFFIX,ads.tracker.org,Direct",
+        "IP-CIDR,10.0.0.0/8,Direct",
+        "IP-CIDR,10.1.0.0/16,Proxy",
+        "DOMAIN-SUFFIX,example.com,Proxy",
+        "MATCH,Proxy",
+    ]
+    optimized, plan = optimize({"rules": rules})
+
+    assert [r.index for r in plan.removed_rules] == [1, 3, 5, 6]
+    assert optimized["rules"] == [rules[0], rules[2], rules[4], rules[7]]
+
+
+def test_no_resolve_rule_is_kept_after_a_resolving_rule() -> None:
+    rules = [
+        "IP-CIDR,10.0.0.0/8,Direct,no-resolve",
+        "IP-CIDR,1.0.0.0/8,Proxy",
+        "IP-CIDR,10.1.0.0/16,Reject,no-resolve",
+        "MATCH,Proxy",
+    ]
+    optimized, plan = optimize({"rules": rules})
+
+    assert not plan.removed_rules
+    assert optimized["rules"] == rules
+    # Resolved by rule 1, www.example.com (10.1.2.3) reaches the later no-resolve rule.
+    assert first_match(optimized["rules"], "www.example.com", "10.1.2.3") == "Reject"
+
+
+def test_moves_domain_rules_ahead_of_resolving_rules() -> None:
+    rules = [
+        "DOMAIN-SUFFIX,google.com,Proxy",
+        "IP-CIDR,1.0.0.0/8,Proxy",
+        "DOMAIN-SUFFIX,foo.net,Proxy",
+        "IP-CIDR,10.0.0.0/8,Direct",
+        "DOMAIN-SUFFIX,tracker.org,Reject",
+        "MATCH,Proxy",
+    ]
+    optimized, plan = optimize({"rules": rules})
+
+    # Same target as the resolving rule above it: safe to move.
+    assert [(m.rule, m.ahead_of) for m in plan.moved_rules] == [("DOMAIN-SUFFIX,foo.net,Proxy", 1)]
+    assert optimized["rules"][:3] == [rules[0], rules[2], rules[1]]
+    # tracker.org (10.1.9.9) is caught by the 10.0.0.0/8 rule first, so that rule stays ahead.
+    assert first_match(optimized["rules"], "tracker.org", "10.1.9.9") == "Direct"
+
+
+def test_domain_rule_does_not_pass_an_overlapping_domain_rule() -> None:
+    rules = [
+        "IP-CIDR,1.0.0.0/8,Proxy",
+        "DOMAIN,cdn.foo.net,Reject",
+        "DOMAIN-SUFFIX,foo.net,Proxy",
+        "MATCH,Direct",
+    ]
+    optimized, plan = optimize({"rules": rules})
+
+    assert not plan.moved_rules
+    assert optimized["rules"] == rules
+
+
+def test_rules_after_match_are_removed_and_nothing_moves_past_it() -> None:
+    rules = ["IP-CIDR,10.0.0.0/8,Direct", "MATCH,Proxy", "DOMAIN,example.com,Direct", "MATCH,Direct"]
+    optimized, plan = optimize({"rules": rules})
+
+    assert [r.index for r in plan.removed_rules] == [2, 3]
+    assert not plan.moved_rules
+    assert optimized["rules"] == rules[:2]
+
+
+def test_final_is_left_in_place() -> None:
+    # FINAL is not parsed: rules after it are kept and no rule moves past it.
+    rules = ["IP-CIDR,10.0.0.0/8,Direct", "FINAL,Proxy", "DOMAIN,example.com,Direct"]
+    optimized, plan = optimize({"rules": rules})
+
+    assert not plan.changed
+    assert optimized["rules"] == rules
+
+
+def test_rule_set_references_keep_their_providers() -> None:
+    config = {
+        "rule-providers": _providers("ads", "google", "private", "cloud"),
+        "rules": [
+            "RULE-SET,ads,Reject",
+            "RULE-SET,private,Direct",
+            "RULE-SET,ads,Reject",
+            "MATCH,Proxy",
+        ],
+    }
+    optimized, plan = optimize(config)
+
+    assert [r.index for r in plan.removed_rules] == [2]
+    assert set(plan.removed_providers) == {"google", "cloud"}
+    assert set(optimized["rule-providers"]) == {"ads", "private"}
+
+
+def test_providers_referenced_outside_rules_are_kept() -> None:
+    config = {
+        "rule-providers": _providers("ads", "google", "private", "cloud"),
+        "rules": ["SUB-RULE,(NETWORK,tcp),web", "MATCH,Proxy"],
+        "sub-rules": {"web": ["RULE-SET,ads,Reject", "MATCH,Proxy"]},
+        "dns": {"nameserver-policy": {"rule-set:google": "https://dns.google/dns-query"}},
+        "proxy-groups": [{"name": "Cloud", "type": "select", "proxies": ["DIRECT"], "x-note": "rule-set:cloud"}],
+    }
+    plan = plan_rule_optimizations(config)
+
+    assert plan.removed_providers == ("private",)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_rule_lists_keep_every_first_match(seed: int) -> None:
+    rng = random.Random(seed)
+    pool = [
+        "DOMAIN,www.example.com",
+        "DOMAIN,example.com",
+        "DOMAIN,cdn.foo.net",
+        "DOMAIN-SUFFIX,example.com",
+        "DOMAIN-SUFFIX,google.com",
+        "DOMAIN-SUFFIX,tracker.org",
+        "DOMAIN-SUFFIX,net",
+        "DOMAIN-KEYWORD,foo",
+        "DOMAIN-KEYWORD,mail",
+        "IP-CIDR,10.0.0.0/8",
+        "IP-CIDR,10.1.0.0/16",
+        "IP-CIDR,1.0.0.0/8",
+        "IP-CIDR,192.0.2.0/24",
+        "IP-CIDR,8.8.8.0/24",
+        "RULE-SET,ads",
+        "RULE-SET,google",
+        "RULE-SET,private",
+        "RULE-SET,cloud",
+    ]
+    rules = []
+    for _ in range(rng.randint(5, 40)):
+        rule = f"{rng.choice(pool)},{rng.choice(['Direct', 'Proxy', 'Reject'])}"
+        if rule.startswith(("IP-CIDR", "RULE-SET,private", "RULE-SET,cloud")) and rng.random() < 0.4:
+            rule += ",no-resolve"
+        rules.append(rule)
+    rules.append("MATCH,Proxy")
+    if rng.random() < 0.3:
+        rules.insert(rng.randrange(len(rules)), "MATCH,Direct")
+
+    optimize({"rules": rules, "rule-providers": _providers(*PROVIDER_PAYLOADS)})
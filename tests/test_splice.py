@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from proxysub import builder
+from proxysub.yamlio import HAS_LIBYAML, dump_yaml, load_yaml, use_yaml_backend
+
+TEMPLATE_PATH = Path(__file__).resolve().parent.parent / "templates" / "ryan.yaml"
+
+PLAIN_UPLOAD = """
+proxies:
+  - {name: US-Home, type: ss, server: 192.0.2.1, port: 8388, cipher: aes-128-gcm, password: x}
+  - {name: 🇯🇵 日本 01, type: vmess, server: jp.example.com, port: 443, uuid: 11111111-1111-1111-1111-111111111111, alterId: 0, cipher: auto}
+proxy-providers:
+  机场A: https://example.com/a.yaml
+"""
+
+# Shared nodes: the same mapping reused by several proxies and providers.
+ANCHORED_UPLOAD = """
+defaults: &ss
+  type: ss
+  cipher: aes-128-gcm
+  password: shared
+health: &health
+  enable: true
+  url: https://www.gstatic.com/generate_204
+  interval: 300
+proxies:
+  - {<<: *ss, name: US-Home, server: 192.0.2.1, port: 8388}
+  - {<<: *ss, name: US-02, server: 192.0.2.2, port: 8388}
+  - &hk {name: HK-01, type: trojan, server: hk.example.com, port: 443, password: p}
+proxy-providers:
+  机场A: {url: https://example.com/a.yaml, health-check: *health}
+  机场B: {url: https://example.com/b.yaml, health-check: *health}
+"""
+
+
+@pytest.fixture(params=["off", "apply"])
+def optimizer_mode(request):
+    previous = builder.get_rule_optimizer_mode()
+    builder.set_rule_optimizer_mode(request.param)
+    yield request.param
+    builder.set_rule_optimizer_mode(previous)
+
+
+@pytest.mark.parametrize("upload", [PLAIN_UPLOAD, ANCHORED_UPLOAD], ids=["plain", "anchors"])
+def test_splice_matches_full_dump(upload: str, optimizer_mode: str) -> None:
+    full = builder.render_yaml_from_doc(template_path=TEMPLATE_PATH, subs_doc=load_yaml(upload), splice=False)
+    # Twice: the first call fills the static-section cache, the second reuses it.
+    for _ in range(2):
+        spliced = builder.render_yaml_from_doc(template_path=TEMPLATE_PATH, subs_doc=load_yaml(upload), splice=True)
+        assert spliced.encode("utf-8") == full.encode("utf-8")
+
+
+def test_batch_splice_matches_full_dump(optimizer_mode: str) -> None:
+    docs = [load_yaml(PLAIN_UPLOAD), load_yaml(ANCHORED_UPLOAD)]
+    spliced = builder.render_yaml_batch(template_path=TEMPLATE_PATH, subs_docs=docs, splice=True)
+    full = builder.render_yaml_batch(template_path=TEMPLATE_PATH, subs_docs=docs, splice=False)
+    assert [item.text for item in spliced] == [item.text for item in full]
+    assert all(item.text for item in spliced)
+
+
+LONG_NAME = "机场" * 46
+QUOTED = 'say "hi" \\ it\'s: #1 ' * 8
+
+
+def _tricky_upload() -> dict:
+    return {
+        "proxies": [
+            {"name": "US-Home", "type": "ss", "server": "192.0.2.1", "port": 8388, "password": QUOTED},
+            {"name": f"{LONG_NAME} 🇯🇵", "type": "ss", "server": "192.0.2.2", "port": 8388, "password": "x\x85y"},
+        ],
+        "proxy-providers": {LONG_NAME: "https://example.com/a.yaml", "🇺🇸 美国 " * 20: "https://example.com/b.yaml"},
+    }
+
+
+@pytest.fixture
+def tricky_template(tmp_path: Path) -> Path:
+    doc = load_yaml(TEMPLATE_PATH.read_text(encoding="utf-8"))
+    doc["rule-providers"][LONG_NAME] = {"type": "http", "behavior": "domain", "url": "https://example.com/r.yaml"}
+    doc["rules"].insert(0, f"RULE-SET,{LONG_NAME},DIRECT")
+    doc["x-note"] = {"text": QUOTED, "long": "word " * 60, "escapes": "tab\there\x85nel"}
+    path = tmp_path / "template.yaml"
+    path.write_text(dump_yaml(doc), encoding="utf-8")
+    return path
+
+
+@pytest.mark.parametrize("backend", ["python", "libyaml"])
+def test_splice_matches_full_dump_with_long_keys_and_quoted_strings(
+    tricky_template: Path, optimizer_mode: str, backend: str
+) -> None:
+    if backend == "libyaml" and not HAS_LIBYAML:
+        pytest.skip("PyYAML built without libyaml")
+    with use_yaml_backend(backend):
+        full = builder.render_yaml_from_doc(
+            template_path=tricky_template, subs_doc=_tricky_upload(), splice=False
+        )
+        for _ in range(2):
+            spliced = builder.render_yaml_from_doc(
+                template_path=tricky_template, subs_doc=_tricky_upload(), splice=True
+            )
+            assert spliced == full
+    assert "\n? " not in full
+    assert LONG_NAME in full
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from proxysub import yamlio
+
+needs_libyaml = pytest.mark.skipif(not yamlio.HAS_LIBYAML, reason="PyYAML built without libyaml")
+
+
+_ALPHABET = (
+    "abcXYZ019 -_:#,[]{}&*!|>'\"%@`?\\/.\t\n\r"
+    "\x00\x07\x1b\x7f\x85\xa0\u2028\u2029\ufeff"
+    "美国日本香港机场节点"
+    "\U0001F1FA\U0001F1F8\U0001F680"
+)
+
+
+def _random_strings(seed: int, count: int) -> list[str]:
+    rng = random.Random(seed)
+    return ["".join(rng.choice(_ALPHABET) for _ in range(rng.randint(0, 200))) for _ in range(count)]
+
+
+def _dump_both(doc: object) -> tuple[str, str]:
+    with yamlio.use_yaml_backend("python"):
+        python_text = yamlio.dump_yaml(doc)
+    with yamlio.use_yaml_backend("libyaml"):
+        libyaml_text = yamlio.dump_yaml(doc)
+    return python_text, libyaml_text
+
+
+@needs_libyaml
+@pytest.mark.parametrize("seed", range(4))
+def test_backends_dump_identical_bytes_fuzz(seed: int) -> None:
+    for value in _random_strings(seed, 500):
+        doc = {"name": value, "list": [value], value: 1}
+        python_text, libyaml_text = _dump_both(doc)
+        assert libyaml_text == python_text, repr(value)
+        with yamlio.use_yaml_backend("libyaml"):
+            loaded = yamlio.load_yaml(python_text)
+        with yamlio.use_yaml_backend("python"):
+            assert yamlio.load_yaml(python_text) == loaded, repr(value)
+
+
+@needs_libyaml
+@pytest.mark.parametrize(
+    "key",
+    # Up to 128 characters, most of them over 128 UTF-8 bytes: libyaml's emitter writes those as `? key`.
+    ["机场" * 46, "k" * 120, "🇺🇸 美国 " * 20, "long key with: colon " * 5],
+)
+def test_backends_dump_long_keys_as_plain_keys(key: str) -> None:
+    doc = {"proxy-providers": {key: {"url": "https://example.com/a.yaml"}}}
+    python_text, libyaml_text = _dump_both(doc)
+    assert libyaml_text == python_text
+    assert "? " not in python_text
+
+
+@needs_libyaml
+@pytest.mark.parametrize(
+    "value",
+    ["x\x85y", "word " * 40, "quoted \"value\" with \\ and \t tab " * 5, "line\nbreak " * 20, "\U0001F680" * 50],
+)
+def test_backends_dump_long_and_quoted_strings(value: str) -> None:
+    python_text, libyaml_text = _dump_both({"name": value, "list": [value]})
+    assert libyaml_text == python_text
+
+
+def test_use_yaml_backend_restores_previous() -> None:
+    before = yamlio.get_yaml_backend()
+    with pytest.raises(RuntimeError), yamlio.use_yaml_backend("python"):
+        assert yamlio.get_yaml_backend() == "python"
+        raise RuntimeError("boom")
+    assert yamlio.get_yaml_backend() == before
+
+
+def test_split_documents_keeps_markers_out_of_block_scalars() -> None:
+    text = "# lead\n%YAML 1.1\n---\na: |\n  x\n  ---\n...\n# next\n--- {b: 1}\n---\n"
+    assert yamlio.split_yaml_documents(text) == [
+        (0, "# lead\n%YAML 1.1\n---\na: |\n  x\n  ---\n...\n"),
+        (7, "# next\n--- {b: 1}\n"),
+        (9, "---\n"),
+    ]
+    docs = yamlio.load_yaml_documents_limited(yamlio.split_yaml_documents(text), max_nodes=100, max_depth=10)
+    assert [doc.value for doc in docs] == [{"a": "x\n---\n"}, {"b": 1}, None]
+
+
+def _reference_sequence(text: str) -> list[object]:
+    doc = yamlio.load_yaml(text)
+    if isinstance(doc, dict):
+        doc = doc.get("proxies") or doc.get("payload") or []
+    return doc if isinstance(doc, list) else []
+
+
+_BACKENDS = ["python", pytest.param("libyaml", marks=needs_libyaml)]
+
+
+@pytest.mark.parametrize("backend", _BACKENDS)
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        ("payload: [p]\nproxies: [a, b]\n", ["a", "b"]),
+        ("proxies: [a]\npayload: [p]\n", ["a"]),
+        ("payload: [p]\nproxies: []\n", ["p"]),
+        ("proxies:\npayload:\n  - p\n", ["p"]),
+        ("payload: [p]\nother: 1\n", ["p"]),
+        ("other: [a]\n", []),
+        ("{}\n", []),
+        ("", []),
+        ("- a\n- b\n", ["a", "b"]),
+        ("proxies: not a list\npayload: [p]\n", []),
+        ("payload: [p]\nproxies: {name: a}\n", []),
+        ("proxies: 0\npayload: [p]\n", ["p"]),
+    ],
+)
+def test_iter_sequence_prefers_keys_in_the_order_given(backend: str, text: str, expected: list[object]) -> None:
+    with yamlio.use_yaml_backend(backend):
+        assert list(yamlio.iter_yaml_sequence(text, keys=("proxies", "payload"))) == expected
+        assert _reference_sequence(text) == expected
+
+
+@pytest.mark.parametrize("backend", _BACKENDS)
+def test_iter_sequence_skips_nested_keys_and_keeps_anchors(backend: str) -> None:
+    text = (
+        "meta:\n"
+        "  proxies: [nested]\n"
+        "  base: &base {type: ss, port: 443}\n"
+        "groups:\n"
+        "  - {payload: [nested]}\n"
+        "payload: &list\n"
+        "  - {<<: *base, name: p}\n"
+        "proxies:\n"
+        "  - {<<: *base, name: a}\n"
+        "  - {name: b, port: 1}\n"
+        "rules: [this, is, never, read\n"
+    )
+    with yamlio.use_yaml_backend(backend):
+        items = list(yamlio.iter_yaml_sequence(text.encode(), keys=("proxies", "payload")))
+    assert items == [{"type": "ss", "port": 443, "name": "a"}, {"name": "b", "port": 1}]